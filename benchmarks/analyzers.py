@@ -0,0 +1,319 @@
+"""
+Synthetic-account benchmark for the analyzers.
+
+Each analyzer runs in a fresh Python process against a moto mock account
+seeded with only its own resources (by default 10k instances, 50k volumes,
+2k RDS instances, 5k buckets and 100k snapshots; --scale shrinks or grows
+all of them). It
+reports the wall time of lambda_handler, AWS API calls per operation, peak
+RSS during the invocation and the DynamoDB writes, and writes everything to
+a JSON file that a later run can be compared against with --compare.
+
+Usage (needs `pip install moto`):
+    python benchmarks/analyzers.py [--scale 0.1] [--analyzers ec2_analyzer,s3_analyzer]
+                                   [--event '{"fan_out": true}'] [--output analyzers.json]
+                                   [--compare previous.json]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANALYZERS = ['ec2_analyzer', 'ebs_analyzer', 'rds_analyzer', 's3_analyzer', 'snapshot_analyzer']
+
+# Resources seeded for each analyzer at --scale 1
+RESOURCE_COUNTS = {
+    'ec2_analyzer': 10000,
+    'ebs_analyzer': 50000,
+    'rds_analyzer': 2000,
+    's3_analyzer': 5000,
+    'snapshot_analyzer': 100000
+}
+
+# run_instances launches at most this many instances per call in moto
+INSTANCES_PER_CALL = 1000
+
+# Metrics compared by --compare; higher is worse for all of them
+COMPARED = ('wall_seconds', 'api_calls', 'peak_rss_mb', 'dynamodb_write_requests')
+
+
+def count_api_calls():
+    """Count every botocore API call by 'service.Operation' (the returned Counter fills up in place)."""
+    from botocore.client import BaseClient
+
+    calls = Counter()
+    make_api_call = BaseClient._make_api_call
+
+    def counted(client, operation_name, api_params):
+        calls[f'{client.meta.service_model.service_name}.{operation_name}'] += 1
+        return make_api_call(client, operation_name, api_params)
+
+    BaseClient._make_api_call = counted
+    return calls
+
+
+def reset_peak_rss():
+    """Reset the process's peak RSS (Linux), so it only covers what follows. False if unsupported."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """Peak RSS since the last reset_peak_rss(), or since process start."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_child(analyzer, count, event):
+    """Seed an account for one analyzer and measure one invocation, inside this (fresh) process."""
+    sys.path.insert(0, os.path.join(ROOT, 'layers', 'shared'))
+    sys.path.insert(0, os.path.join(ROOT, 'lambdas', analyzer))
+
+    import boto3
+    from moto import mock_aws
+
+    import lambda_function
+
+    with mock_aws():
+        started = time.perf_counter()
+        create_tables()
+        SEEDERS[analyzer](count)
+        seed_seconds = time.perf_counter() - started
+
+        calls = count_api_calls()
+        rss_reset = reset_peak_rss()
+        started = time.perf_counter()
+        response = lambda_function.lambda_handler(dict(event), None)
+        wall_seconds = time.perf_counter() - started
+        peak_rss = peak_rss_mb()
+        api_calls = dict(calls)
+
+        body = json.loads(response['body'])
+        table_items = boto3.client('dynamodb').scan(
+            TableName=os.environ['DYNAMODB_TABLE'], Select='COUNT'
+        )['Count']
+
+    return {
+        'analyzer': analyzer,
+        'resources': count,
+        'status_code': response['statusCode'],
+        'seed_seconds': round(seed_seconds, 2),
+        'wall_seconds': round(wall_seconds, 2),
+        'findings_count': body.get('findings_count'),
+        'api_calls': sum(api_calls.values()),
+        'api_calls_by_operation': dict(sorted(api_calls.items())),
+        'peak_rss_mb': peak_rss,
+        'peak_rss_scope': 'invocation' if rss_reset else 'process',
+        'dynamodb_write_requests': api_calls.get('dynamodb.BatchWriteItem', 0) + api_calls.get('dynamodb.PutItem', 0),
+        'dynamodb_items_written': (body.get('write_stats') or {}).get('items_written'),
+        'dynamodb_table_items': table_items
+    }
+
+
+def create_tables():
+    """Create the findings and scan state tables."""
+    import boto3
+
+    dynamodb = boto3.client('dynamodb')
+    dynamodb.create_table(
+        TableName=os.environ['DYNAMODB_TABLE'],
+        KeySchema=[
+            {'AttributeName': 'id', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+            {'AttributeName': 'timestamp', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.create_table(
+        TableName=os.environ['STATE_TABLE'],
+        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+def seed_instances(count):
+    """Running instances of a few types."""
+    import boto3
+
+    ec2 = boto3.client('ec2')
+    instance_types = ['t3.micro', 'm5.large', 'm5.2xlarge', 'c5.xlarge', 'r5.large']
+    for index, start in enumerate(range(0, count, INSTANCES_PER_CALL)):
+        batch = min(INSTANCES_PER_CALL, count - start)
+        ec2.run_instances(
+            ImageId='ami-12c6146b', MinCount=batch, MaxCount=batch,
+            InstanceType=instance_types[index % len(instance_types)]
+        )
+
+
+def seed_volumes(count):
+    """A mix of gp2, gp3 and io1 volumes, all unattached."""
+    import boto3
+
+    ec2 = boto3.client('ec2')
+    for index in range(count):
+        volume_type = ('gp2', 'gp3', 'gp2', 'io1')[index % 4]
+        extra = {'Iops': 1000} if volume_type == 'io1' else {}
+        ec2.create_volume(
+            Size=10 + index % 500, AvailabilityZone='us-east-1a', VolumeType=volume_type, **extra
+        )
+
+
+def seed_db_instances(count):
+    """DB instances across engines; the ones over 10GB qualify for the analyzer."""
+    import boto3
+
+    rds = boto3.client('rds')
+    engines = ['postgres', 'mysql']
+    for index in range(count):
+        rds.create_db_instance(
+            DBInstanceIdentifier=f'benchmark-db-{index}',
+            DBInstanceClass='db.t3.micro' if index % 2 else 'db.m5.large',
+            Engine=engines[index % len(engines)],
+            AllocatedStorage=5 if index % 10 == 0 else 20 + index % 200,
+            MasterUsername='benchmark',
+            MasterUserPassword='benchmark-password'
+        )
+
+
+def seed_buckets(count):
+    """Empty buckets, every tenth one versioned."""
+    import boto3
+
+    s3 = boto3.client('s3')
+    for index in range(count):
+        name = f'benchmark-bucket-{index}'
+        s3.create_bucket(Bucket=name)
+        if index % 10 == 0:
+            s3.put_bucket_versioning(Bucket=name, VersioningConfiguration={'Status': 'Enabled'})
+
+
+def seed_snapshots(count):
+    """Ten snapshots per volume, taken the same day; half of the volumes are deleted afterwards."""
+    import boto3
+
+    ec2 = boto3.client('ec2')
+    for index in range(max(1, count // 10)):
+        volume_id = ec2.create_volume(Size=10 + index % 500, AvailabilityZone='us-east-1a')['VolumeId']
+        for _ in range(min(10, count - index * 10)):
+            ec2.create_snapshot(VolumeId=volume_id)
+        if index % 2:
+            ec2.delete_volume(VolumeId=volume_id)
+
+
+SEEDERS = {
+    'ec2_analyzer': seed_instances,
+    'ebs_analyzer': seed_volumes,
+    'rds_analyzer': seed_db_instances,
+    's3_analyzer': seed_buckets,
+    'snapshot_analyzer': seed_snapshots
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    """Print each compared metric next to the baseline run's."""
+    with open(baseline_path) as f:
+        baseline = {result['analyzer']: result for result in json.load(f)['results']}
+
+    print(f"\nCompared with {baseline_path}:")
+    for result in results:
+        previous = baseline.get(result['analyzer'])
+        if previous is None:
+            continue
+        changes = []
+        for metric in COMPARED:
+            old, new = previous.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            change = f'{(new - old) / old * 100:+.1f}%' if old else 'n/a'
+            changes.append(f'{metric} {old} -> {new} ({change})')
+        print(f"{result['analyzer']:14} " + '   '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--count', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiply the default resource counts')
+    parser.add_argument('--analyzers', default=','.join(ANALYZERS), help='Comma-separated analyzers to run')
+    parser.add_argument('--event', default='{}', help='Event passed to every lambda_handler, as JSON')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Earlier --output file to compare against')
+    args = parser.parse_args()
+    event = json.loads(args.event)
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.count, event)))
+        return
+
+    results = []
+    # Findings go to local artifacts as they would to S3 in a deployment
+    with tempfile.TemporaryDirectory() as artifacts:
+        env = dict(
+            os.environ,
+            AWS_DEFAULT_REGION='us-east-1',
+            AWS_ACCESS_KEY_ID='testing',
+            AWS_SECRET_ACCESS_KEY='testing',
+            DYNAMODB_TABLE='CostOptimizerFindings',
+            STATE_TABLE='CostOptimizerScanState',
+            FINDINGS_OUTPUT=artifacts
+        )
+        for analyzer in args.analyzers.split(','):
+            count = max(1, int(RESOURCE_COUNTS[analyzer] * args.scale))
+            completed = subprocess.run(
+                [sys.executable, __file__, '--child', analyzer, '--count', str(count), '--event', args.event],
+                env=env, capture_output=True, text=True, check=True
+            )
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(f"{analyzer:14} {count:7} resources   wall {result['wall_seconds']:8.2f} s   "
+                  f"API calls {result['api_calls']:7}   peak RSS {result['peak_rss_mb']:7.1f} MB   "
+                  f"DynamoDB writes {result['dynamodb_write_requests']:6}")
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'scale': args.scale,
+        'event': event,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+Finding item encoding benchmark.
+
+Builds N findings shaped like the analyzers' (EC2 with rightsizing stats,
+EBS, RDS with storage forecasts, S3 with the top prefixes of an inventory
+report for some buckets) and writes them to two moto tables:
+as the usual items (to_item() through the boto3 TypeSerializer) and as
+compact items (Finding.to_compact_item(), wire format). Reports the encode
+time per item, the write time, the item size and write units by
+DynamoDB's sizing rules (moto does not meter capacity by size), and the
+table storage. It then scans both tables back through decode_item() and
+checks every finding reads the same from either.
+
+Usage (needs `pip install moto`):
+    python benchmarks/items.py [--findings 5000] [--output items.json]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'layers', 'shared'))
+
+REGION = 'us-east-1'
+STANDARD_TABLE = 'CostOptimizerFindings'
+COMPACT_TABLE = 'CostOptimizerFindingsCompact'
+
+# DynamoDB bills storage with this overhead per item
+ITEM_OVERHEAD_BYTES = 100
+
+
+def generate_findings(count, seed):
+    """Findings of the four main resource types in equal parts."""
+    from cost_optimizer.findings import Finding
+
+    rng = random.Random(seed)
+    started = datetime(2026, 10, 1, 6)
+    findings = []
+    for index in range(count):
+        kind = index % 4
+        # About a second apart, with microseconds as the analyzers' timestamps have
+        timestamp = (started + timedelta(microseconds=index * 1000003)).isoformat()
+        cost = round(rng.uniform(5, 900), 2)
+        if kind == 0:
+            p95 = round(rng.uniform(0, 60), 2)
+            resource_id = f'i-{index:017x}'
+            finding = Finding(
+                resource_id=resource_id, resource_type='EC2', issue='idle_instance' if p95 < 5 else 'running_instance',
+                severity='high' if p95 < 5 else 'info', details=f'Running EC2 instance: web-{index}',
+                recommendation=f'CPU p95 {p95:.1f}% - stop or downsize',
+                metadata={
+                    'instance_name': f'web-{index}', 'instance_type': 'm5.xlarge', 'region': REGION,
+                    'state': 'running', 'age_days': rng.randint(1, 900), 'cpu_avg_percent': round(p95 / 2, 2),
+                    'cpu_p50_percent': round(p95 / 3, 2), 'cpu_p95_percent': p95,
+                    'cpu_p99_percent': round(p95 * 1.2, 2),
+                    'cpu_peak_to_mean': round(rng.uniform(1, 6), 2), 'idle_hours_fraction': round(rng.random(), 3),
+                    'recommended_type': 'm5.large' if p95 < 30 else None, 'metrics_failed': False,
+                    'network_in_mb': round(rng.uniform(0, 1e5), 2), 'network_out_mb': round(rng.uniform(0, 1e5), 2),
+                    'attached_volumes': [f'vol-{index:017x}'], 'attached_storage_gb': 100,
+                    'launch_time': (started - timedelta(days=rng.randint(1, 900))).isoformat()
+                },
+                monthly_cost=cost, monthly_savings=cost / 2 if p95 < 30 else 0.0, timestamp=timestamp
+            )
+        elif kind == 1:
+            size = rng.choice([8, 20, 100, 500])
+            finding = Finding(
+                resource_id=f'vol-{index:017x}', resource_type='EBS', issue='gp2_to_gp3', severity='low',
+                details=f'EBS volume (data-{index}): {size}GB gp2, in-use',
+                recommendation=f'Migrate the {size}GB volume to gp3 - same baseline performance for less',
+                metadata={
+                    'volume_name': f'data-{index}', 'volume_type': 'gp2', 'size_gb': size, 'state': 'in-use',
+                    'region': REGION, 'iops': size * 3, 'throughput': 0, 'is_attached': True,
+                    'attached_to': f'i-{index:017x}', 'instance_state': 'running', 'age_days': rng.randint(1, 900),
+                    'read_ops_7d': rng.randint(0, 10 ** 6), 'write_ops_7d': rng.randint(0, 10 ** 6),
+                    'read_gb_7d': round(rng.uniform(0, 50), 2), 'write_gb_7d': round(rng.uniform(0, 50), 2),
+                    'metrics_failed': False, 'create_time': started.isoformat()
+                },
+                monthly_cost=size * 0.1, monthly_savings=size * 0.02, timestamp=timestamp
+            )
+        elif kind == 2:
+            storage = rng.choice([100, 500, 1000])
+            finding = Finding(
+                resource_id=f'db-{index}', resource_type='RDS', issue='overprovisioned_storage', severity='medium',
+                details=f'RDS instance with {storage}GB storage (available)',
+                recommendation=f'{storage * 0.8:.0f}GB of {storage}GB free, full in 400 days at the current growth',
+                metadata={
+                    'instance_class': 'db.m5.large', 'engine': 'postgres', 'region': REGION, 'storage_gb': storage,
+                    'storage_type': 'gp3', 'multi_az': False, 'status': 'available', 'cluster_id': None,
+                    'age_days': rng.randint(1, 900), 'datapoints': 30, 'cpu_avg_percent': round(rng.uniform(0, 50), 2),
+                    'cpu_max_percent': round(rng.uniform(50, 90), 2), 'connections_max': rng.randint(0, 200),
+                    'read_iops_avg': round(rng.uniform(0, 500), 2), 'write_iops_avg': round(rng.uniform(0, 500), 2),
+                    'free_storage_gb': storage * 0.8, 'storage_growth_gb_per_day': round(rng.uniform(0, 2), 3),
+                    'days_to_full': 400.0, 'reclaimable_gb': storage / 2, 'idle': False, 'metrics_failed': False
+                },
+                monthly_cost=cost, monthly_savings=storage / 2 * 0.115, timestamp=timestamp
+            )
+        else:
+            # Buckets with an S3 Inventory report (every other one) list their top prefixes
+            name = f'bucket-{index}'
+            inventory = index % 8 == 3
+            class_gb = {'STANDARD': round(rng.uniform(0, 5000), 2), 'STANDARD_IA': round(rng.uniform(0, 500), 2)}
+            if inventory:
+                class_gb.update(GLACIER_IR=round(rng.uniform(0, 500), 2), DEEP_ARCHIVE=round(rng.uniform(0, 500), 2))
+            size = round(sum(class_gb.values()), 2)
+            finding = Finding(
+                resource_id=name, resource_type='S3', issue='cold_bucket', severity='medium',
+                details=f'S3 Bucket: {name}',
+                recommendation=f"No GET requests in 7 days - move the {class_gb['STANDARD']:.0f}GB to STANDARD_IA",
+                metadata={
+                    'bucket_name': name, 'region': REGION, 'age_days': rng.randint(1, 900), 'size_gb': size,
+                    'object_count': rng.randint(0, 10 ** 7),
+                    'storage_classes': {storage_class: rng.randint(0, 10 ** 6) for storage_class in class_gb},
+                    'storage_class_gb': class_gb,
+                    'storage_breakdown_source': 'inventory' if inventory else 'cloudwatch',
+                    'top_prefixes': [
+                        {
+                            'prefix': f'logs/{rng.choice(["app", "web", "etl"])}/2026/{month:02d}/',
+                            'objects': rng.randint(0, 10 ** 5), 'size_gb': round(rng.uniform(0, 100), 2)
+                        }
+                        for month in range(1, 21)
+                    ] if inventory else [],
+                    'versioning_enabled': False, 'is_public': False, 'get_requests_7d': 0,
+                    'put_requests_7d': rng.randint(0, 1000), 'metrics_failed': False,
+                    'creation_date': (started - timedelta(days=rng.randint(1, 900))).isoformat()
+                },
+                monthly_cost=size * 0.023, monthly_savings=class_gb['STANDARD'] * 0.0105, timestamp=timestamp
+            )
+        findings.append(finding)
+    return findings
+
+
+def value_size(value):
+    """DynamoDB size of a low-level attribute value."""
+    kind, data = next(iter(value.items()))
+    if kind == 'M':
+        return 3 + sum(len(name.encode()) + 1 + value_size(item) for name, item in data.items())
+    if kind == 'L':
+        return 3 + sum(1 + value_size(item) for item in data)
+    if kind == 'S':
+        return len(data.encode())
+    if kind == 'B':
+        return len(data)
+    if kind == 'N':
+        digits = data.lstrip('-').replace('.', '').lstrip('0') or '0'
+        return math.ceil(len(digits) / 2) + 1
+    return 1
+
+
+def item_size(item):
+    """DynamoDB size of a low-level item: attribute names plus values."""
+    return sum(len(name.encode()) + value_size(value) for name, value in item.items())
+
+
+def create_table(dynamodb, name, sort_key, sort_type):
+    dynamodb.create_table(
+        TableName=name,
+        KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}, {'AttributeName': sort_key, 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[
+            {'AttributeName': 'id', 'AttributeType': 'S'}, {'AttributeName': sort_key, 'AttributeType': sort_type}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+def measure(dynamodb, table_name, items):
+    """Write wire items through a FindingSink and size them."""
+    from cost_optimizer.sink import FindingSink
+
+    started = time.perf_counter()
+    with FindingSink(dynamodb, table_name=table_name) as sink:
+        for item in items:
+            sink.write_item(item)
+    sizes = [item_size(item) for item in items]
+    return {
+        'write_seconds': round(time.perf_counter() - started, 2),
+        'items_written': sink.stats()['items_written'],
+        'avg_item_bytes': round(sum(sizes) / len(sizes), 1),
+        'max_item_bytes': max(sizes),
+        'write_units': sum(math.ceil(size / 1024) for size in sizes),
+        'storage_bytes': sum(sizes) + ITEM_OVERHEAD_BYTES * len(sizes)
+    }
+
+
+def read_back(dynamodb, table_name):
+    """Every item of a table, decoded, by resource id."""
+    from cost_optimizer.findings import decode_item
+
+    decoded = {}
+    request = {'TableName': table_name}
+    while True:
+        response = dynamodb.scan(**request)
+        for item in response['Items']:
+            finding = decode_item(item)
+            decoded[finding['resource_id']] = finding
+        if 'LastEvaluatedKey' not in response:
+            return decoded
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--findings', type=int, default=5000, help='Number of findings')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', REGION)
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    import boto3
+    from boto3.dynamodb.types import TypeSerializer
+    from moto import mock_aws
+
+    from cost_optimizer.output import to_json
+
+    findings = generate_findings(args.findings, seed=1)
+    serializer = TypeSerializer()
+
+    started = time.perf_counter()
+    standard_items = [
+        {key: serializer.serialize(value) for key, value in finding.to_item().items()} for finding in findings
+    ]
+    standard_encode = time.perf_counter() - started
+
+    started = time.perf_counter()
+    compact_items = [finding.to_compact_item() for finding in findings]
+    compact_encode = time.perf_counter() - started
+
+    with mock_aws():
+        dynamodb = boto3.client('dynamodb')
+        create_table(dynamodb, STANDARD_TABLE, 'timestamp', 'S')
+        create_table(dynamodb, COMPACT_TABLE, 'ts', 'N')
+
+        standard = measure(dynamodb, STANDARD_TABLE, standard_items)
+        compact = measure(dynamodb, COMPACT_TABLE, compact_items)
+        standard['encode_us_per_item'] = round(standard_encode / len(findings) * 1e6, 1)
+        compact['encode_us_per_item'] = round(compact_encode / len(findings) * 1e6, 1)
+
+        standard_read = read_back(dynamodb, STANDARD_TABLE)
+        compact_read = read_back(dynamodb, COMPACT_TABLE)
+
+    mismatches = sum(
+        to_json(standard_read[resource_id]) != to_json(compact_read.get(resource_id, {}))
+        for resource_id in standard_read
+    )
+
+    result = {
+        'findings': args.findings,
+        'standard': standard,
+        'compact': compact,
+        'compressed_items': sum('z' in item for item in compact_items),
+        'write_unit_reduction': round(1 - compact['write_units'] / standard['write_units'], 3),
+        'storage_reduction': round(1 - compact['storage_bytes'] / standard['storage_bytes'], 3),
+        'decoded_mismatches': mismatches
+    }
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
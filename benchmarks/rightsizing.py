@@ -0,0 +1,76 @@
+"""
+EC2 rightsizing benchmark.
+
+Generates synthetic hourly CPU and network series for a fleet (with gaps)
+and times cost_optimizer.rightsizing over the whole (instances x hours)
+arrays, reporting CPU time for the statistics and the recommendations.
+
+Usage:
+    python benchmarks/rightsizing.py [--instances 10000] [--hours 168] [--output rightsizing.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'layers', 'shared'))
+
+from cost_optimizer.rightsizing import recommend_types, utilization_stats  # noqa: E402
+
+INSTANCE_TYPES = ['t3.micro', 't3.large', 'm5.large', 'm5.2xlarge', 'c5.4xlarge', 'r5.xlarge', 'm6i.8xlarge']
+
+
+def generate_fleet(instances, hours, seed):
+    """Daily-cycle CPU with noise and spikes, network traffic and ~2% missing hours."""
+    rng = np.random.default_rng(seed)
+    base = rng.uniform(1, 60, size=(instances, 1))
+    daily = 1 + 0.5 * np.sin(np.arange(hours) * 2 * np.pi / 24)
+    cpu = np.clip(base * daily + rng.normal(0, 3, size=(instances, hours)), 0, 100)
+    spikes = rng.random((instances, hours)) < 0.01
+    cpu[spikes] = rng.uniform(80, 100, size=spikes.sum())
+    cpu[rng.random((instances, hours)) < 0.02] = np.nan
+
+    network = rng.exponential(50 * 1024 * 1024, size=(instances, hours))
+    types = [INSTANCE_TYPES[i % len(INSTANCE_TYPES)] for i in range(instances)]
+    return cpu, network, types
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--instances', type=int, default=10000, help='Number of instances')
+    parser.add_argument('--hours', type=int, default=168, help='Hourly datapoints per instance')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    cpu, network, types = generate_fleet(args.instances, args.hours, seed=1)
+
+    started = time.process_time()
+    stats = utilization_stats(cpu, network)
+    stats_seconds = time.process_time() - started
+
+    started = time.process_time()
+    recommended = recommend_types(types, stats['p99'], stats['datapoints'])
+    recommend_seconds = time.process_time() - started
+
+    result = {
+        'instances': args.instances,
+        'hours': args.hours,
+        'stats_cpu_seconds': round(stats_seconds, 3),
+        'recommend_cpu_seconds': round(recommend_seconds, 3),
+        'total_cpu_seconds': round(stats_seconds + recommend_seconds, 3),
+        'downsizing_recommendations': sum(1 for value in recommended if value),
+        'median_p95_percent': round(float(np.median(stats['p95'])), 2)
+    }
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""
+Rollup query benchmark.
+
+Seeds a moto account with a year of daily EBS findings for N volumes, both
+as raw findings rows (one item per volume and day, as the analyzers write
+them) and as rollup series (one item per volume), then answers "which
+volumes have been idle for the last 30 days" both ways: with a filtered
+Scan of the findings table, and with cost_optimizer.rollups (one Query of
+the volumes' partition and a vectorized pass). Reports wall time, pages,
+items read and approximate bytes read for each, and checks both agree.
+
+Usage (needs `pip install moto`):
+    python benchmarks/rollups.py [--resources 200] [--days 365] [--window 30] [--output rollups.json]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'layers', 'shared'))
+
+FINDINGS_TABLE = 'CostOptimizerFindings'
+ROLLUP_TABLE = 'CostOptimizerRollups'
+REGION = 'us-east-1'
+
+IDLE_FIELDS = ('read_ops_7d', 'write_ops_7d')
+
+
+def generate_history(resources, days, seed):
+    """
+    Daily values per volume: ~20% idle all year, ~5% going idle for the
+    last weeks, the rest busy; sizes of some volumes grow; ~2% of days
+    are missing (skipped or failed runs).
+    """
+    rng = random.Random(seed)
+    history = {}
+    for index in range(resources):
+        volume_id = f'vol-{index:017x}'
+        size = rng.choice([8, 20, 100, 500, 1000])
+        growth = rng.choice([0, 0, 0, 0.5, 2])
+        kind = rng.random()
+        idle_from = 0 if kind < 0.2 else days - rng.randint(20, 60) if kind < 0.25 else days
+        series = []
+        for day in range(days):
+            if rng.random() < 0.02:
+                series.append(None)
+                continue
+            busy = day < idle_from
+            series.append({
+                'size_gb': round(size + growth * day),
+                'read_ops_7d': rng.randint(1000, 500000) if busy else 0,
+                'write_ops_7d': rng.randint(1000, 500000) if busy else 0,
+                'read_gb_7d': round(rng.uniform(0.1, 50), 2) if busy else 0.0,
+                'write_gb_7d': round(rng.uniform(0.1, 50), 2) if busy else 0.0
+            })
+        history[volume_id] = series
+    return history
+
+
+def create_tables(dynamodb):
+    dynamodb.create_table(
+        TableName=FINDINGS_TABLE,
+        KeySchema=[
+            {'AttributeName': 'id', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+            {'AttributeName': 'timestamp', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb.create_table(
+        TableName=ROLLUP_TABLE,
+        KeySchema=[
+            {'AttributeName': 'series', 'KeyType': 'HASH'},
+            {'AttributeName': 'resource_id', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'series', 'AttributeType': 'S'},
+            {'AttributeName': 'resource_id', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+def seed_findings(dynamodb, history, first_day):
+    """One finding per volume and day, shaped like the EBS analyzer's."""
+    from cost_optimizer.findings import Finding
+    from cost_optimizer.sink import FindingSink
+
+    with FindingSink(dynamodb, table_name=FINDINGS_TABLE) as sink:
+        for volume_id, series in history.items():
+            for day, values in enumerate(series):
+                if values is None:
+                    continue
+                timestamp = (first_day + timedelta(days=day, hours=6)).isoformat()
+                idle = not values['read_ops_7d'] and not values['write_ops_7d']
+                cost = values['size_gb'] * 0.08
+                sink.write(Finding(
+                    resource_id=volume_id,
+                    resource_type='EBS',
+                    issue='unused_volume' if idle else 'gp2_to_gp3',
+                    severity='high' if idle else 'low',
+                    details=f"EBS volume {volume_id} ({values['size_gb']}GB)",
+                    recommendation='Snapshot and delete the volume' if idle else 'Migrate to gp3',
+                    metadata={'region': REGION, 'volume_type': 'gp2', 'state': 'in-use', **values},
+                    monthly_cost=cost,
+                    monthly_savings=cost if idle else cost * 0.2,
+                    timestamp=timestamp
+                ).to_item())
+
+
+def seed_rollups(dynamodb, history, first_day):
+    """One rollup series per volume, as RollupStore would have built it day by day."""
+    from cost_optimizer.sink import FindingSink
+
+    start_day = first_day.strftime('%Y-%m-%d')
+    last_day = (first_day + timedelta(days=len(next(iter(history.values()))) - 1)).strftime('%Y-%m-%d')
+    with FindingSink(dynamodb, table_name=ROLLUP_TABLE) as sink:
+        for volume_id, series in history.items():
+            fields = {}
+            for name in IDLE_FIELDS + ('size_gb', 'read_gb_7d', 'write_gb_7d'):
+                fields[name] = array('f', (math.nan if values is None else values[name] for values in series))
+            fields['monthly_cost'] = array('f', (
+                math.nan if values is None else values['size_gb'] * 0.08 for values in series
+            ))
+            sink.write({
+                'series': f'EBS#{REGION}',
+                'resource_id': volume_id,
+                'start_day': start_day,
+                'fields': {name: column.tobytes() for name, column in fields.items()},
+                'issue': 'gp2_to_gp3',
+                'issue_day': last_day
+            })
+
+
+def item_bytes(value):
+    """Approximate DynamoDB size of a low-level attribute value (names included for maps)."""
+    kind, data = next(iter(value.items()))
+    if kind == 'M':
+        return 3 + sum(len(name) + item_bytes(item) for name, item in data.items())
+    if kind == 'L':
+        return 3 + sum(1 + item_bytes(item) for item in data)
+    if kind in ('S', 'B'):
+        return len(data.encode() if isinstance(data, str) else data)
+    if kind == 'N':
+        return len(data.strip('-').replace('.', '')) // 2 + 1
+    return 1
+
+
+def idle_from_scan(dynamodb, window, now):
+    """Idle volumes from a Scan of every raw finding of the last `window` days."""
+    cutoff = (now - timedelta(days=window)).isoformat()
+    request = {
+        'TableName': FINDINGS_TABLE,
+        'FilterExpression': 'resource_type = :type AND #ts >= :cutoff',
+        'ExpressionAttributeNames': {'#ts': 'timestamp'},
+        'ExpressionAttributeValues': {':type': {'S': 'EBS'}, ':cutoff': {'S': cutoff}}
+    }
+    stats = {'pages': 0, 'items_read': 0, 'items_returned': 0, 'bytes_returned': 0}
+    known, busy = {}, set()
+    while True:
+        response = dynamodb.scan(**request)
+        stats['pages'] += 1
+        stats['items_read'] += response['ScannedCount']
+        stats['items_returned'] += response['Count']
+        for item in response['Items']:
+            stats['bytes_returned'] += item_bytes({'M': item})
+            volume_id = item['id']['S']
+            known[volume_id] = known.get(volume_id, 0) + 1
+            metadata = item['metadata']['M']
+            if any(float(metadata[name]['N']) > 0 for name in IDLE_FIELDS):
+                busy.add(volume_id)
+        if 'LastEvaluatedKey' not in response:
+            break
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    min_days = max(1, window // 2)
+    idle = {volume_id for volume_id, days in known.items() if volume_id not in busy and days >= min_days}
+    return idle, stats
+
+
+def idle_from_rollups(dynamodb, window):
+    """Idle volumes from one Query of the rollup partition."""
+    from cost_optimizer.rollups import idle_resources, load_frame
+
+    stats = {'pages': 0, 'items_read': 0, 'items_returned': 0, 'bytes_returned': 0}
+    query = dynamodb.query
+
+    def counted_query(**kwargs):
+        response = query(**kwargs)
+        stats['pages'] += 1
+        stats['items_read'] += response['ScannedCount']
+        stats['items_returned'] += response['Count']
+        stats['bytes_returned'] += sum(item_bytes({'M': item}) for item in response['Items'])
+        return response
+
+    dynamodb.query = counted_query
+    try:
+        frame = load_frame(dynamodb, 'EBS', REGION, table_name=ROLLUP_TABLE)
+        idle = {volume_id for volume_id, *_ in idle_resources(frame, IDLE_FIELDS, days=window)}
+    finally:
+        dynamodb.query = query
+    return idle, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--resources', type=int, default=200, help='Number of volumes')
+    parser.add_argument('--days', type=int, default=365, help='Days of history per volume')
+    parser.add_argument('--window', type=int, default=30, help='Days a volume must have been idle')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    os.environ.setdefault('AWS_DEFAULT_REGION', REGION)
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+    import boto3
+    from moto import mock_aws
+
+    history = generate_history(args.resources, args.days, seed=1)
+    # Runs happened on each of the last `days` days, today included
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    first_day = today - timedelta(days=args.days - 1)
+
+    with mock_aws():
+        dynamodb = boto3.client('dynamodb')
+        create_tables(dynamodb)
+
+        started = time.perf_counter()
+        seed_findings(dynamodb, history, first_day.replace(tzinfo=None))
+        seed_rollups(dynamodb, history, first_day)
+        seed_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        scan_idle, scan_stats = idle_from_scan(dynamodb, args.window, first_day.replace(tzinfo=None) +
+                                               timedelta(days=args.days))
+        scan_stats['wall_seconds'] = round(time.perf_counter() - started, 3)
+
+        started = time.perf_counter()
+        rollup_idle, rollup_stats = idle_from_rollups(dynamodb, args.window)
+        rollup_stats['wall_seconds'] = round(time.perf_counter() - started, 3)
+
+    result = {
+        'resources': args.resources,
+        'days': args.days,
+        'window': args.window,
+        'seed_seconds': round(seed_seconds, 2),
+        'scan': scan_stats,
+        'rollups': rollup_stats,
+        'idle_volumes': len(rollup_idle),
+        'results_match': scan_idle == rollup_idle,
+        'speedup': round(scan_stats['wall_seconds'] / max(rollup_stats['wall_seconds'], 1e-6), 1),
+        'read_reduction': round(scan_stats['items_read'] / max(rollup_stats['items_read'], 1), 1)
+    }
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
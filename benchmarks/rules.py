@@ -0,0 +1,157 @@
+"""
+Rules engine benchmark.
+
+Builds N synthetic EC2 findings and a rule set of the bundled EC2 rules
+behind generated ones (50 by default, most matching few findings, so every
+rule is evaluated over most of the batch). Times the compiled rules
+(cost_optimizer.rules): building the columns, evaluating the masks and
+RuleSet.apply() as a whole. For comparison it evaluates the same
+expressions one finding at a time with eval() over a dict of its fields,
+and checks both pick the same first matching rule for every finding.
+
+Usage:
+    python benchmarks/rules.py [--findings 100000] [--rules 50] [--output rules.json]
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'layers', 'shared'))
+
+from cost_optimizer.findings import Finding  # noqa: E402
+from cost_optimizer.rules import BUNDLED_RULES, FINDING_FIELDS, RuleSet, column  # noqa: E402
+
+INSTANCE_TYPES = ['t3.micro', 't3.large', 'm5.large', 'm5.2xlarge', 'c5.4xlarge', 'r5.xlarge', 'm6i.8xlarge']
+
+
+def generate_findings(count, seed):
+    """Running instances with CPU statistics; ~2% without metrics, ~20% with a smaller type recommended."""
+    rng = random.Random(seed)
+    findings = []
+    for index in range(count):
+        instance_type = INSTANCE_TYPES[index % len(INSTANCE_TYPES)]
+        metrics_failed = rng.random() < 0.02
+        p95 = None if metrics_failed else round(rng.uniform(0, 80), 2)
+        metadata = {
+            'instance_type': instance_type,
+            'state': 'running',
+            'age_days': rng.randint(1, 900),
+            'datapoints': 0 if metrics_failed else 168,
+            'metrics_failed': metrics_failed,
+            'cpu_avg_percent': None if metrics_failed else round(p95 / 2, 2),
+            'cpu_p95_percent': p95,
+            'cpu_p99_percent': None if metrics_failed else round(min(p95 * 1.2, 100), 2),
+            'idle_hours_fraction': None if metrics_failed else round(rng.random() ** 4, 3),
+            'recommended_type': 'm5.large' if not metrics_failed and rng.random() < 0.2 else None
+        }
+        findings.append(Finding(
+            resource_id=f'i-{index:017x}', resource_type='EC2', issue='running_instance', severity='info',
+            details=f'Running EC2 instance: web-{index}', recommendation='', metadata=metadata,
+            monthly_cost=round(rng.uniform(5, 900), 2)
+        ))
+    return findings
+
+
+def generate_rules(count, seed):
+    """`count` EC2 rules: generated ones that share subexpressions, then the bundled EC2 rules."""
+    rng = random.Random(seed)
+    with open(BUNDLED_RULES, encoding='utf-8') as f:
+        bundled = json.load(f)['EC2']
+
+    generated = []
+    for index in range(max(count - len(bundled), 0)):
+        kind = index % 3
+        if kind == 0:
+            when = (f"instance_type == '{rng.choice(INSTANCE_TYPES)}' and cpu_p99_percent < {rng.randint(1, 10)}"
+                    f" and age_days > {rng.randint(100, 800)}")
+        elif kind == 1:
+            when = f"monthly_cost > {rng.randint(700, 890)} and cpu_avg_percent < {rng.randint(1, 5)}"
+        else:
+            when = (f"instance_type in ('{rng.choice(INSTANCE_TYPES)}', '{rng.choice(INSTANCE_TYPES)}')"
+                    f" and idle_hours_fraction >= 0.9 and recommended_type is not None")
+        generated.append({
+            'name': f'generated_{index}', 'when': when, 'severity': 'low',
+            'recommendation': f'Rule {index}: {{instance_type}} at {{cpu_p95_percent:.1f}}% p95 CPU'
+        })
+    return {'EC2': generated + bundled}
+
+
+def fields(finding):
+    """A finding's fields as a dict, for the eval() baseline."""
+    values = dict(finding.metadata)
+    values.update((name, getattr(finding, name)) for name in FINDING_FIELDS)
+    return values
+
+
+def first_match_per_dict(expressions, values):
+    """Index of the first expression true for `values`, -1 if none. Missing values fail comparisons."""
+    for index, expression in enumerate(expressions):
+        try:
+            if eval(expression, {}, values):
+                return index
+        except TypeError:
+            continue
+    return -1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--findings', type=int, default=100000, help='Number of EC2 findings')
+    parser.add_argument('--rules', type=int, default=50, help='Number of EC2 rules, bundled ones included')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    findings = generate_findings(args.findings, seed=1)
+    rules = RuleSet(generate_rules(args.rules, seed=1))
+    ec2_rules = rules.rules['EC2']
+    names = set().union(*(rule.names for rule in ec2_rules))
+
+    started = time.process_time()
+    for name in names:
+        if name in FINDING_FIELDS:
+            column([getattr(finding, name) for finding in findings])
+        else:
+            column([finding.metadata.get(name) for finding in findings])
+    columns_seconds = time.process_time() - started
+
+    started = time.process_time()
+    matched = rules.matches(findings, 'EC2')
+    matches_seconds = time.process_time() - started
+
+    copies = copy.deepcopy(findings)
+    started = time.process_time()
+    rules.apply(copies)
+    apply_seconds = time.process_time() - started
+
+    expressions = [compile(rule.when, rule.name, 'eval') for rule in ec2_rules]
+    started = time.process_time()
+    per_dict = [first_match_per_dict(expressions, fields(finding)) for finding in findings]
+    per_dict_seconds = time.process_time() - started
+
+    result = {
+        'findings': args.findings,
+        'rules': len(ec2_rules),
+        'columns_cpu_seconds': round(columns_seconds, 3),
+        'masks_cpu_seconds': round(max(matches_seconds - columns_seconds, 0), 3),
+        'matches_cpu_seconds': round(matches_seconds, 3),
+        'apply_cpu_seconds': round(apply_seconds, 3),
+        'per_dict_cpu_seconds': round(per_dict_seconds, 3),
+        'matched_findings': int((matched >= 0).sum()),
+        'first_match_mismatches': int((matched != np.array(per_dict)).sum())
+    }
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+S3 Inventory parsing benchmark.
+
+Generates a synthetic gzip CSV inventory report on local disk and streams it
+through cost_optimizer.s3_inventory, reporting throughput and peak RSS.
+Peak RSS should stay flat as --rows grows (30M rows is a ~3 GB uncompressed
+report).
+
+Usage:
+    python benchmarks/s3_inventory.py [--rows 2000000] [--files 4] [--output inventory.json]
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'layers', 'shared'))
+
+from cost_optimizer.s3_inventory import aggregate_local_files, parse_schema  # noqa: E402
+
+FILE_SCHEMA = 'Bucket, Key, VersionId, IsLatest, IsDeleteMarker, Size, LastModifiedDate, StorageClass'
+STORAGE_CLASSES = ['STANDARD'] * 6 + ['STANDARD_IA', 'INTELLIGENT_TIERING', 'GLACIER', 'DEEP_ARCHIVE']
+
+
+def write_report(path, rows, seed):
+    """Write one synthetic inventory CSV file."""
+    rng = random.Random(seed)
+    with gzip.open(path, 'wt', newline='') as f:
+        for i in range(rows):
+            prefix = f'prefix-{rng.randrange(5000)}'
+            latest = 'true' if rng.random() > 0.05 else 'false'
+            f.write(
+                f'"benchmark-bucket","{prefix}/object-{seed}-{i}.bin","v{i}","{latest}","false",'
+                f'"{rng.randrange(1, 64 * 1024 * 1024)}","2024-01-01T00:00:00.000Z","{rng.choice(STORAGE_CLASSES)}"\n'
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000000, help='Total inventory rows')
+    parser.add_argument('--files', type=int, default=4, help='Number of report files')
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        started = time.perf_counter()
+        for index in range(args.files):
+            path = os.path.join(directory, f'report-{index}.csv.gz')
+            write_report(path, args.rows // args.files, seed=index)
+            paths.append(path)
+        generate_seconds = time.perf_counter() - started
+        compressed_bytes = sum(os.path.getsize(path) for path in paths)
+
+        rss_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        aggregate = aggregate_local_files(paths, parse_schema(FILE_SCHEMA))
+        parse_seconds = time.perf_counter() - started
+        rss_after_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    result = {
+        'rows': args.rows,
+        'files': args.files,
+        'compressed_mb': round(compressed_bytes / (1024 * 1024), 1),
+        'generate_seconds': round(generate_seconds, 2),
+        'parse_seconds': round(parse_seconds, 2),
+        'rows_per_second': round(args.rows / parse_seconds),
+        'peak_rss_mb': round(rss_after_kb / 1024, 1),
+        'rss_growth_mb': round((rss_after_kb - rss_before_kb) / 1024, 1),
+        'objects_counted': aggregate.objects,
+        'prefixes_tracked': len(aggregate.prefixes),
+        'storage_classes': aggregate.class_objects()
+    }
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
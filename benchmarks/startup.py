@@ -0,0 +1,117 @@
+"""
+Startup benchmark for the analyzers.
+
+Each analyzer runs in a fresh Python process to mimic a cold container.
+For each one it reports how long importing lambda_function takes, plus the
+latency of the first (cold) and second (warm) invocation against a moto
+mock account.
+
+Usage (needs `pip install moto`):
+    python benchmarks/startup.py [--output startup.json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ANALYZERS = ['ec2_analyzer', 'ebs_analyzer', 'rds_analyzer', 's3_analyzer', 'snapshot_analyzer']
+
+
+def run_child(analyzer):
+    """Measure one analyzer inside this (fresh) process."""
+    sys.path.insert(0, os.path.join(ROOT, 'layers', 'shared'))
+    sys.path.insert(0, os.path.join(ROOT, 'lambdas', analyzer))
+
+    started = time.perf_counter()
+    import lambda_function
+    import_seconds = time.perf_counter() - started
+
+    # moto is imported after the analyzer so it does not count as import time
+    from moto import mock_aws
+
+    with mock_aws():
+        seed_account()
+
+        started = time.perf_counter()
+        lambda_function.lambda_handler({}, None)
+        first_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        lambda_function.lambda_handler({}, None)
+        warm_seconds = time.perf_counter() - started
+
+    return {
+        'analyzer': analyzer,
+        'import_ms': round(import_seconds * 1000, 1),
+        'first_invocation_ms': round(first_seconds * 1000, 1),
+        'warm_invocation_ms': round(warm_seconds * 1000, 1)
+    }
+
+
+def seed_account():
+    """Create the findings table and one resource of each kind."""
+    import boto3
+
+    boto3.client('dynamodb').create_table(
+        TableName=os.environ['DYNAMODB_TABLE'],
+        KeySchema=[
+            {'AttributeName': 'id', 'KeyType': 'HASH'},
+            {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+            {'AttributeName': 'timestamp', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    boto3.client('ec2').run_instances(ImageId='ami-12c6146b', MinCount=1, MaxCount=1)
+    boto3.client('s3').create_bucket(Bucket='startup-benchmark-bucket')
+    boto3.client('rds').create_db_instance(
+        DBInstanceIdentifier='startup-benchmark-db',
+        DBInstanceClass='db.t3.micro',
+        Engine='postgres',
+        AllocatedStorage=20,
+        MasterUsername='benchmark',
+        MasterUserPassword='benchmark-password'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child)))
+        return
+
+    env = dict(
+        os.environ,
+        AWS_DEFAULT_REGION='us-east-1',
+        AWS_ACCESS_KEY_ID='testing',
+        AWS_SECRET_ACCESS_KEY='testing',
+        DYNAMODB_TABLE='CostOptimizerFindings'
+    )
+    results = []
+    for analyzer in ANALYZERS:
+        completed = subprocess.run(
+            [sys.executable, __file__, '--child', analyzer],
+            env=env, capture_output=True, text=True, check=True
+        )
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{analyzer:14} import {result['import_ms']:8.1f} ms   "
+              f"first call {result['first_invocation_ms']:8.1f} ms   "
+              f"warm call {result['warm_invocation_ms']:8.1f} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
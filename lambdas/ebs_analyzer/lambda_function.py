@@ -1,166 +1,333 @@
-import boto3
 import json
-from datetime import datetime, timedelta
-from decimal import Decimal
+from datetime import datetime
 
+from cost_optimizer.accounts import account_clients, account_id, resolve_accounts, scan_accounts, scope
+from cost_optimizer.checkpoint import ScanCheckpoint
+from cost_optimizer.clients import shared_pool
+from cost_optimizer.fanout import coordinate, is_fan_out, shard_ids, shard_worker
+from cost_optimizer.findings import Finding
+from cost_optimizer.inventory import shared_snapshot
+from cost_optimizer.metric_cache import MetricDayCache, use_metric_cache
+from cost_optimizer.metrics import MetricQueryEngine, MAX_QUERIES_PER_REQUEST
+from cost_optimizer.output import FindingsOutput, to_json
+from cost_optimizer.pipeline import FindingEmitter, run_pipeline
+from cost_optimizer.pricing import shared_index
+from cost_optimizer.ratelimit import api_stats, reset_stats
+from cost_optimizer.rollups import RollupStore, use_rollups
+from cost_optimizer.rules import shared_rules
+from cost_optimizer.sink import FindingSink
+from cost_optimizer.state import ScanState, is_incremental
+from cost_optimizer.telemetry import debug, emit_metrics, reset_metrics
+from cost_optimizer.regions import resolve_regions, scan_regions
+from cost_optimizer.resources import chunked
+
+VOLUME_METRICS = ('VolumeReadOps', 'VolumeWriteOps', 'VolumeReadBytes', 'VolumeWriteBytes')
+
+# One batch of attached volumes fills one GetMetricData request
+BATCH_SIZE = MAX_QUERIES_PER_REQUEST // len(VOLUME_METRICS)
+
+# Instance states whose volumes are billed without being used
+STOPPED_STATES = ('stopped',)
+
+
+@shard_worker
 def lambda_handler(event, context):
     """
     Analyze EBS volumes - check all volumes with basic useful metrics.
+
+    Scans the regions in event['regions'] / SCAN_REGIONS (default: own region),
+    of the accounts in event['accounts'] / SCAN_ACCOUNTS (default: own account).
     """
-    ec2 = boto3.client('ec2')
-    cloudwatch = boto3.client('cloudwatch')
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table('CostOptimizerFindings')
-    
-    findings = []
-    
+    event = event or {}
+    incremental = is_incremental(event)
+    metric_cache = use_metric_cache(event)
+    clients = shared_pool()
+    reset_stats()
+    reset_metrics()
+    dynamodb = clients.client('dynamodb')
+    # Daily per-resource series for trend queries (see cost_optimizer.rollups)
+    rollups = RollupStore(dynamodb) if use_rollups(event) else None
+
+    output = None
+
     try:
-        # Get all EBS volumes
-        response = ec2.describe_volumes()
-        
-        for volume in response['Volumes']:
-            volume_id = volume['VolumeId']
-            volume_type = volume['VolumeType']
-            size_gb = volume['Size']
-            state = volume['State']
-            create_time = volume['CreateTime']
-            iops = volume.get('Iops', 0)
-            throughput = volume.get('Throughput', 0)
-            
-            # Check if volume is attached
-            is_attached = len(volume['Attachments']) > 0
-            attached_to = None
-            
-            if is_attached:
-                attached_to = volume['Attachments'][0]['InstanceId']
-            
-            # Get volume name from tags
-            volume_name = 'N/A'
-            if 'Tags' in volume:
-                for tag in volume['Tags']:
-                    if tag['Key'] == 'Name':
-                        volume_name = tag['Value']
-                        break
-            
-            print(f"Analyzing EBS volume: {volume_id} ({volume_name})")
-            
-            # Get basic useful metrics (only for attached volumes)
-            read_ops = 0
-            write_ops = 0
-            read_bytes = 0
-            write_bytes = 0
-            
-            if is_attached:
-                read_ops = get_volume_ops(cloudwatch, volume_id, 'VolumeReadOps')
-                write_ops = get_volume_ops(cloudwatch, volume_id, 'VolumeWriteOps')
-                read_bytes = get_volume_bytes(cloudwatch, volume_id, 'VolumeReadBytes')
-                write_bytes = get_volume_bytes(cloudwatch, volume_id, 'VolumeWriteBytes')
-            
-            # Calculate volume age
-            age_days = (datetime.now(create_time.tzinfo) - create_time).days
-            
-            # Record the volume with metrics
-            finding = {
-                "id":volume_id,
-                'resource_id': volume_id,
-                'resource_type': 'EBS',
-                'issue': 'ebs_volume',
-                'severity': 'info',
-                'details': f'EBS Volume: {volume_name} ({state})',
-                'recommendation': f'Attached: {is_attached}, Size: {size_gb}GB',
-                'metadata': {
-                    'volume_name': volume_name,
-                    'volume_type': volume_type,
-                    'size_gb': size_gb,
-                    'state': state,
-                    'is_attached': is_attached,
-                    'attached_to': attached_to,
-                    'age_days': age_days,
-                    'iops': iops,
-                    'throughput_mbps': throughput,
-                    'read_ops_7d': int(read_ops),
-                    'write_ops_7d': int(write_ops),
-                    'read_gb_7d': Decimal(str(round(read_bytes / (1024**3), 2))),
-                    'write_gb_7d': Decimal(str(round(write_bytes / (1024**3), 2))),
-                    'create_time': create_time.isoformat()
-                },
-                'timestamp': datetime.now().isoformat()
-            }
-            findings.append(finding)
-        
-        # Store findings in DynamoDB
-        for finding in findings:
-            table.put_item(Item=finding)
-        
+        regions = resolve_regions(event, clients)
+        accounts = resolve_accounts(event)
+        if is_fan_out(event):
+            # Coordinator: list resources and analyze them in parallel shards
+            return coordinate(
+                clients, 'ebs', event, context, regions,
+                lambda region, account=None: shard_resources(clients, region, account), lambda_handler,
+                accounts=accounts
+            )
+
+        checkpoint = ScanCheckpoint(dynamodb, 'ebs', event, context)
+        prices = shared_index(clients)
+        output = FindingsOutput(clients, 'ebs', event, context)
+        checkpoint.restore(output)
+
+        # Findings are written to DynamoDB in batches as they are produced
+        with FindingSink(dynamodb) as sink:
+            def scan(region, account=None):
+                return analyze_region(
+                    clients, region, sink, output, prices, checkpoint, incremental, shard_ids(event), metric_cache,
+                    rollups, account
+                )
+
+            if accounts:
+                report = {'accounts': scan_accounts(accounts, regions, scan)}
+            else:
+                report = {'regions': scan_regions(regions, scan)}
+        output.close()
+
+        # Only once the findings are written, so a resumed scan never skips any
+        checkpoint.close(clients, output, event, context)
+
+        write_stats = sink.stats()
+        print(f"Wrote {write_stats['items_written']} findings: {write_stats}")
+
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                'findings_count': len(findings),
-                'message': f'Analyzed {len(findings)} EBS volumes',
-                'findings': findings
-            }, default=str)
+            'body': to_json(output.summary(
+                message=f'Analyzed {output.count} EBS volumes in {len(regions)} regions' + (
+                    f' of {len(accounts)} accounts' if accounts else ''
+                ),
+                **report,
+                write_stats=write_stats,
+                api_stats=api_stats(),
+                checkpoint=checkpoint.summary(event)
+            ))
         }
-        
+
     except Exception as e:
         print(f"Error analyzing EBS volumes: {str(e)}")
+        if output:
+            output.abort()
         return {
             'statusCode': 500,
             'body': json.dumps({
                 'error': str(e)
             })
         }
+    finally:
+        # One set of EMF metrics per invocation
+        emit_metrics('ebs', output.count if output else None)
 
 
-def get_volume_ops(cloudwatch, volume_id, metric_name, days=7):
-    """Get total volume operations (read or write) over the last 7 days."""
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=days)
-    
-    try:
-        response = cloudwatch.get_metric_statistics(
-            Namespace='AWS/EBS',
-            MetricName=metric_name,
-            Dimensions=[{'Name': 'VolumeId', 'Value': volume_id}],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=86400,  # 1 day
-            Statistics=['Sum']
-        )
-        
-        if response['Datapoints']:
-            total_ops = sum(d['Sum'] for d in response['Datapoints'])
-            return total_ops
-        
-        return 0.0
-    except Exception as e:
-        print(f"Error getting volume ops for {volume_id}: {str(e)}")
-        return 0.0
+def analyze_region(clients, region, sink, output, prices, checkpoint, incremental=False, resource_ids=None,
+                   metric_cache=False, rollups=None, account=None):
+    """Analyze the EBS volumes in one region (of another account), or only `resource_ids` for a shard."""
+    cloudwatch = account_clients(clients, account).client('cloudwatch', region)
+    # Volumes and the instances they are attached to, shared with the EC2 analyzer
+    snapshot = shared_snapshot(clients, region, account=account)
+    # Severity, issue and recommendation from the rules file (see cost_optimizer.rules)
+    rules = shared_rules(clients)
+    state = ScanState(clients.client('dynamodb'), account_id=account_id(account)) if incremental else None
+    # Closed days of metrics come from earlier runs, only new days are fetched
+    cache = None
+    if metric_cache:
+        cache = MetricDayCache(clients.client('dynamodb'), region, account_id=account_id(account))
+    emitter = FindingEmitter(sink, output, state, rollups, account_id(account), timestamp=checkpoint.timestamp)
+    # Checkpoint key and log label of the region, with the account when scanning another
+    target = scope(region, account)
+    api_calls = 0
+
+    def enrich(batch):
+        # Incremental mode skips volumes whose config has not changed since the last full scan
+        if state:
+            batch = state.changed(
+                batch, volume_key, lambda volume: volume_config(volume, attached_instance_state(volume, snapshot))
+            )
+
+        # Get basic useful metrics (only for volumes attached to an instance that can use them)
+        metrics = MetricQueryEngine(cloudwatch, days=7, cache=cache)
+        for volume in batch:
+            if needs_metrics(volume, snapshot):
+                queue_volume_metrics(metrics, volume['VolumeId'])
+        metrics.resolve()
+        return batch, metrics
+
+    def evaluate(enriched):
+        nonlocal api_calls
+        batch, metrics = enriched
+        api_calls += metrics.api_calls
+        findings = rules.apply([
+            build_volume_finding(volume, metrics, region, prices, attached_instance_state(volume, snapshot))
+            for volume in batch
+        ])
+        if state:
+            state.record_unreported(map(volume_key, batch), findings)
+        return findings
+
+    # All EBS volumes from the snapshot, from the checkpoint when resuming
+    cursor = checkpoint.cursor(target)
+    if run_pipeline(
+        chunked(snapshot.iter_volumes(cursor=cursor, volume_ids=resource_ids), BATCH_SIZE), enrich, evaluate, emitter,
+        **checkpoint.tracking(target, cursor)
+    ):
+        checkpoint.finish(target)
+
+    print(f"Fetched metrics for {emitter.count} volumes in {target} with {api_calls} GetMetricData calls")
+    if state:
+        print(f"Incremental scan of {target}: {state.stats()}")
+    if cache:
+        print(f"Metric cache for {target}: {cache.stats()}")
+    return emitter.count
+
+
+def shard_resources(clients, region, account=None):
+    """Volume ids in a region with their weight (metric queries, attached volumes only) for a sharded scan."""
+    snapshot = shared_snapshot(clients, region, account=account)
+    return [
+        (volume['VolumeId'], len(VOLUME_METRICS) if needs_metrics(volume, snapshot) else 1)
+        for volume in snapshot.iter_volumes()
+    ]
+
+
+def attached_instance_state(volume, snapshot):
+    """State of the instance a volume is attached to, None if unattached or unknown."""
+    if not volume['Attachments']:
+        return None
+    return snapshot.instance_state(volume['Attachments'][0]['InstanceId'])
+
+
+def needs_metrics(volume, snapshot):
+    """Unattached volumes and volumes of stopped instances have no I/O to query."""
+    return bool(volume['Attachments']) and attached_instance_state(volume, snapshot) not in STOPPED_STATES
+
+
+def volume_key(volume):
+    """Scan state key for a volume."""
+    return f"EBS#{volume['VolumeId']}"
+
+
+def volume_config(volume, instance_state=None):
+    """Configuration attributes (and the state of its instance) that decide whether a volume needs a full scan."""
+    return {
+        'volume_type': volume['VolumeType'],
+        'size_gb': volume['Size'],
+        'state': volume['State'],
+        'iops': volume.get('Iops', 0),
+        'throughput': volume.get('Throughput', 0),
+        'attached_to': [attachment['InstanceId'] for attachment in volume['Attachments']],
+        'instance_state': instance_state,
+        'tags': volume.get('Tags', [])
+    }
+
+
+def build_volume_finding(volume, metrics, region, prices, instance_state=None):
+    """Build the finding for a volume from its resolved metrics, prices and the state of its instance."""
+    volume_id = volume['VolumeId']
+    volume_type = volume['VolumeType']
+    size_gb = volume['Size']
+    state = volume['State']
+    create_time = volume['CreateTime']
+    iops = volume.get('Iops', 0)
+    throughput = volume.get('Throughput', 0)
+
+    # Check if volume is attached
+    is_attached = len(volume['Attachments']) > 0
+    attached_to = None
+
+    if is_attached:
+        attached_to = volume['Attachments'][0]['InstanceId']
+
+    # Billed in full while its instance is stopped
+    on_stopped_instance = instance_state in STOPPED_STATES
+
+    # Get volume name from tags
+    volume_name = 'N/A'
+    if 'Tags' in volume:
+        for tag in volume['Tags']:
+            if tag['Key'] == 'Name':
+                volume_name = tag['Value']
+                break
+
+    debug(f"Analyzing EBS volume: {volume_id} ({volume_name})")
+
+    # Unattached volumes have no queued metrics and read back as 0
+    read_ops = metrics.sum(volume_id, 'VolumeReadOps')
+    write_ops = metrics.sum(volume_id, 'VolumeWriteOps')
+    read_bytes = metrics.sum(volume_id, 'VolumeReadBytes')
+    write_bytes = metrics.sum(volume_id, 'VolumeWriteBytes')
+
+    # Calculate volume age
+    age_days = (datetime.now(create_time.tzinfo) - create_time).days
+
+    # An unattached volume's (or a stopped instance's volume's) whole cost can be saved,
+    # an attached gp2 volume saves by moving to gp3
+    monthly_cost = volume_monthly_cost(prices, region, volume_type, size_gb, iops, throughput)
+    monthly_savings = None
+    if monthly_cost is not None:
+        monthly_savings = 0.0
+        if not is_attached or on_stopped_instance:
+            monthly_savings = monthly_cost
+        elif volume_type == 'gp2':
+            gp3_cost = volume_monthly_cost(prices, region, 'gp3', size_gb, 0, 0)
+            if gp3_cost is not None:
+                monthly_savings = max(monthly_cost - gp3_cost, 0.0)
+
+    issue, severity = 'ebs_volume', 'info'
+    recommendation = f'Attached: {is_attached}, Size: {size_gb}GB'
+    if on_stopped_instance:
+        issue, severity = 'attached_to_stopped_instance', 'low'
+        recommendation = (f'Attached to stopped instance {attached_to}, Size: {size_gb}GB - '
+                          f'snapshot and delete the volume if the instance is not needed')
+
+    # Record the volume with metrics
+    return Finding(
+        resource_id=volume_id,
+        resource_type='EBS',
+        issue=issue,
+        severity=severity,
+        details=f'EBS Volume: {volume_name} ({state})',
+        recommendation=recommendation,
+        metadata={
+            'volume_name': volume_name,
+            'volume_type': volume_type,
+            'region': region,
+            'size_gb': size_gb,
+            'state': state,
+            'is_attached': is_attached,
+            'attached_to': attached_to,
+            'instance_state': instance_state,
+            'age_days': age_days,
+            'iops': iops,
+            'throughput_mbps': throughput,
+            'read_ops_7d': int(read_ops),
+            'write_ops_7d': int(write_ops),
+            'read_gb_7d': round(read_bytes / (1024**3), 2),
+            'write_gb_7d': round(write_bytes / (1024**3), 2),
+            'metrics_failed': metrics.failed(volume_id),
+            'create_time': create_time.isoformat()
+        },
+        monthly_cost=monthly_cost,
+        monthly_savings=monthly_savings
+    )
+
+
+def volume_monthly_cost(prices, region, volume_type, size_gb, iops, throughput):
+    """Storage plus provisioned IOPS and throughput cost of a volume, or None without a storage price."""
+    gb_price = prices.monthly('ebs', region, volume_type)
+    if gb_price is None:
+        return None
+    cost = size_gb * gb_price
+
+    # gp3 includes 3000 IOPS and 125 MiB/s, io1/io2 bill every provisioned IOPS
+    if volume_type == 'gp3':
+        cost += max(iops - 3000, 0) * (prices.monthly('ebs-iops', region, 'gp3') or 0.0)
+        cost += max(throughput - 125, 0) * (prices.monthly('ebs-throughput', region, 'gp3') or 0.0)
+    elif volume_type in ('io1', 'io2'):
+        cost += iops * (prices.monthly('ebs-iops', region, volume_type) or 0.0)
+    return cost
+
+
+def queue_volume_metrics(metrics, volume_id):
+    """Queue read/write operation and byte totals for a volume."""
+    dimensions = [{'Name': 'VolumeId', 'Value': volume_id}]
+    for metric_name in VOLUME_METRICS:
+        metrics.add(volume_id, 'AWS/EBS', metric_name, dimensions, 'Sum')
 
 
-def get_volume_bytes(cloudwatch, volume_id, metric_name, days=7):
-    """Get total volume data transfer (read or write) in bytes."""
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=days)
-    
-    try:
-        response = cloudwatch.get_metric_statistics(
-            Namespace='AWS/EBS',
-            MetricName=metric_name,
-            Dimensions=[{'Name': 'VolumeId', 'Value': volume_id}],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=86400,  # 1 day
-            Statistics=['Sum']
-        )
-        
-        if response['Datapoints']:
-            total_bytes = sum(d['Sum'] for d in response['Datapoints'])
-            return total_bytes
-        
-        return 0.0
-    except Exception as e:
-        print(f"Error getting volume bytes for {volume_id}: {str(e)}")
-        return 0.0
-    
 if __name__ == "__main__":
-    print(lambda_handler({}, {}))
\ No newline at end of file
+    print(lambda_handler({}, {}))
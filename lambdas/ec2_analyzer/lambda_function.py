@@ -1,151 +1,286 @@
-import boto3
 import json
-from datetime import datetime, timedelta
-from decimal import Decimal
+import os
+from datetime import datetime
 
+from cost_optimizer.accounts import account_clients, account_id, resolve_accounts, scan_accounts, scope
+from cost_optimizer.checkpoint import ScanCheckpoint
+from cost_optimizer.clients import shared_pool
+from cost_optimizer.fanout import coordinate, is_fan_out, shard_ids, shard_worker
+from cost_optimizer.findings import Finding
+from cost_optimizer.inventory import shared_snapshot
+from cost_optimizer.metric_cache import MetricDayCache, use_metric_cache
+from cost_optimizer.metrics import MetricQueryEngine, MAX_QUERIES_PER_REQUEST
+from cost_optimizer.output import FindingsOutput, to_json
+from cost_optimizer.pipeline import FindingEmitter, run_pipeline
+from cost_optimizer.pricing import shared_index
+from cost_optimizer.ratelimit import api_stats, reset_stats
+from cost_optimizer.rollups import RollupStore, use_rollups
+from cost_optimizer.rules import shared_rules
+from cost_optimizer.sink import FindingSink
+from cost_optimizer.state import ScanState, is_incremental
+from cost_optimizer.telemetry import debug, emit_metrics, reset_metrics
+from cost_optimizer.regions import resolve_regions, scan_regions
+from cost_optimizer.resources import chunked
+from cost_optimizer.rightsizing import rightsize
 
+# Three metric queries per instance, so one batch fills one GetMetricData request
+BATCH_SIZE = MAX_QUERIES_PER_REQUEST // 3
+
+# Metric period in seconds for the rightsizing series (hourly; 300 or 60 with detailed monitoring)
+METRIC_PERIOD = int(os.environ.get('EC2_METRIC_PERIOD', '3600'))
+
+
+@shard_worker
 def lambda_handler(event, context):
     """
     Analyze EC2 instances - check running instances with basic useful metrics.
+
+    Scans the regions in event['regions'] / SCAN_REGIONS (default: own region),
+    of the accounts in event['accounts'] / SCAN_ACCOUNTS (default: own account).
     """
-    ec2 = boto3.client('ec2')
-    cloudwatch = boto3.client('cloudwatch')
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table('CostOptimizerFindings')
-    
-    findings = []
-    
+    event = event or {}
+    incremental = is_incremental(event)
+    metric_cache = use_metric_cache(event)
+    clients = shared_pool()
+    reset_stats()
+    reset_metrics()
+    dynamodb = clients.client('dynamodb')
+    # Daily per-resource series for trend queries (see cost_optimizer.rollups)
+    rollups = RollupStore(dynamodb) if use_rollups(event) else None
+
+    output = None
+
     try:
-        # Get all EC2 instances
-        response = ec2.describe_instances()
-       
-        for reservation in response['Reservations']:
-            for instance in reservation['Instances']:
-                instance_id = instance['InstanceId']
-                instance_type = instance['InstanceType']
-                state = instance['State']['Name']
-                launch_time = instance['LaunchTime']
-                
-                # Get instance name from tags
-                instance_name = 'N/A'
-                if 'Tags' in instance:
-                    for tag in instance['Tags']:
-                        if tag['Key'] == 'Name':
-                            instance_name = tag['Value']
-                            break
-                
-                # FILTER: Only check running instances
-                if state != 'running':
-                    print(f"Skipping {instance_id} - not running (status: {state})")
-                    continue
-                
-                print(f"Analyzing EC2 instance: {instance_id} ({instance_name})")
-                
-                # Get basic useful metrics
-                cpu_utilization = get_cpu_utilization(cloudwatch, instance_id)
-                network_in = get_network_traffic(cloudwatch, instance_id, 'NetworkIn')
-                network_out = get_network_traffic(cloudwatch, instance_id, 'NetworkOut')
-                
-                # Calculate instance age
-                age_days = (datetime.now(launch_time.tzinfo) - launch_time).days
-                
-                # Record the instance with metrics
-                finding = {
-                    "id": instance_id,
-                    'resource_id': instance_id,
-                    'resource_type': 'EC2',
-                    'issue': 'running_instance',
-                    'severity': 'info',
-                    'details': f'Running EC2 instance: {instance_name}',
-                    'recommendation': f'CPU Avg: {cpu_utilization:.1f}%',
-                    'metadata': {
-                        'instance_name': instance_name,
-                        'instance_type': instance_type,
-                        'state': state,
-                        'age_days': age_days,
-                        'cpu_avg_percent': Decimal(str(round(cpu_utilization, 2))),
-                        'network_in_mb': Decimal(str(round(network_in / (1024 * 1024), 2))),
-                        'network_out_mb': Decimal(str( round(network_out / (1024 * 1024), 2))),
-                        'launch_time': launch_time.isoformat()
-                    },
-                    'timestamp': datetime.now().isoformat()
-                }
-                findings.append(finding)
-        
-        # Store findings in DynamoDB
-        for finding in findings:
-            table.put_item(Item=finding)
-        
+        regions = resolve_regions(event, clients)
+        accounts = resolve_accounts(event)
+        if is_fan_out(event):
+            # Coordinator: list resources and analyze them in parallel shards
+            return coordinate(
+                clients, 'ec2', event, context, regions,
+                lambda region, account=None: shard_resources(clients, region, account), lambda_handler,
+                accounts=accounts
+            )
+
+        checkpoint = ScanCheckpoint(dynamodb, 'ec2', event, context)
+        prices = shared_index(clients)
+        output = FindingsOutput(clients, 'ec2', event, context)
+        checkpoint.restore(output)
+
+        # Findings are written to DynamoDB in batches as they are produced
+        with FindingSink(dynamodb) as sink:
+            def scan(region, account=None):
+                return analyze_region(
+                    clients, region, sink, output, prices, checkpoint, incremental, shard_ids(event), metric_cache,
+                    rollups, account
+                )
+
+            if accounts:
+                report = {'accounts': scan_accounts(accounts, regions, scan)}
+            else:
+                report = {'regions': scan_regions(regions, scan)}
+        output.close()
+
+        # Only once the findings are written, so a resumed scan never skips any
+        checkpoint.close(clients, output, event, context)
+
+        write_stats = sink.stats()
+        print(f"Wrote {write_stats['items_written']} findings: {write_stats}")
+
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                'findings_count': len(findings),
-                'message': f'Analyzed {len(findings)} running EC2 instances',
-                'findings': findings
-            }, default=str)
+            'body': to_json(output.summary(
+                message=f'Analyzed {output.count} running EC2 instances in {len(regions)} regions' + (
+                    f' of {len(accounts)} accounts' if accounts else ''
+                ),
+                **report,
+                write_stats=write_stats,
+                api_stats=api_stats(),
+                checkpoint=checkpoint.summary(event)
+            ))
         }
-        
+
     except Exception as e:
         print(f"Error analyzing EC2 instances: {str(e)}")
+        if output:
+            output.abort()
         return {
             'statusCode': 500,
             'body': json.dumps({
                 'error': str(e)
             })
         }
+    finally:
+        # One set of EMF metrics per invocation
+        emit_metrics('ec2', output.count if output else None)
 
 
-def get_cpu_utilization(cloudwatch, instance_id, days=7):
-    """Get average CPU utilization over the last 7 days."""
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=days)
-    
-    try:
-        response = cloudwatch.get_metric_statistics(
-            Namespace='AWS/EC2',
-            MetricName='CPUUtilization',
-            Dimensions=[{'Name': 'InstanceId', 'Value': instance_id}],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=86400,  # 1 day
-            Statistics=['Average']
-        )
-        
-        if response['Datapoints']:
-            avg_cpu = sum(d['Average'] for d in response['Datapoints']) / len(response['Datapoints'])
-            return avg_cpu
-        
-        return 0.0
-    except Exception as e:
-        print(f"Error getting CPU metrics for {instance_id}: {str(e)}")
-        return 0.0
+def analyze_region(clients, region, sink, output, prices, checkpoint, incremental=False, resource_ids=None,
+                   metric_cache=False, rollups=None, account=None):
+    """Analyze the running instances in one region (of another account), or only `resource_ids` for a shard."""
+    cloudwatch = account_clients(clients, account).client('cloudwatch', region)
+    # Instances and volumes described once, shared with the EBS analyzer
+    snapshot = shared_snapshot(clients, region, account=account)
+    # Severity, issue and recommendation from the rules file (see cost_optimizer.rules)
+    rules = shared_rules(clients)
+    state = ScanState(clients.client('dynamodb'), account_id=account_id(account)) if incremental else None
+    # Closed days of metrics come from earlier runs, only new days are fetched
+    cache = None
+    if metric_cache:
+        cache = MetricDayCache(clients.client('dynamodb'), region, account_id=account_id(account))
+    emitter = FindingEmitter(sink, output, state, rollups, account_id(account), timestamp=checkpoint.timestamp)
+    # Checkpoint key and log label of the region, with the account when scanning another
+    target = scope(region, account)
+    api_calls = 0
 
+    def enrich(batch):
+        # Incremental mode skips instances whose config has not changed since the last full scan
+        if state:
+            batch = state.changed(batch, instance_key, instance_config)
 
-def get_network_traffic(cloudwatch, instance_id, metric_name, days=7):
-    """Get total network traffic (NetworkIn or NetworkOut) in bytes."""
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=days)
-    
-    try:
-        response = cloudwatch.get_metric_statistics(
-            Namespace='AWS/EC2',
-            MetricName=metric_name,
-            Dimensions=[{'Name': 'InstanceId', 'Value': instance_id}],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=86400,  # 1 day
-            Statistics=['Sum']
-        )
-        
-        if response['Datapoints']:
-            total_bytes = sum(d['Sum'] for d in response['Datapoints'])
-            return total_bytes
-        
-        return 0.0
-    except Exception as e:
-        print(f"Error getting network metrics for {instance_id}: {str(e)}")
-        return 0.0
+        # Get hourly CPU and network series for the whole batch at once
+        metrics = MetricQueryEngine(cloudwatch, days=7, period=METRIC_PERIOD, cache=cache)
+        for instance in batch:
+            queue_instance_metrics(metrics, instance['InstanceId'])
+        metrics.resolve()
+        return batch, metrics
+
+    def evaluate(enriched):
+        nonlocal api_calls
+        batch, metrics = enriched
+        api_calls += metrics.api_calls
+
+        # Percentiles, idle hours and recommended types for the batch in one pass
+        utilization = rightsize(metrics, batch)
+        findings = rules.apply([
+            build_instance_finding(
+                instance, metrics, region, usage, prices, snapshot.attached_volumes(instance['InstanceId'])
+            )
+            for instance, usage in zip(batch, utilization)
+        ])
+        if state:
+            state.record_unreported(map(instance_key, batch), findings)
+        return findings
+
+    # Running instances from the snapshot, from the checkpoint when resuming
+    cursor = checkpoint.cursor(target)
+    running_instances = snapshot.iter_instances(states=('running',), cursor=cursor, instance_ids=resource_ids)
+    if run_pipeline(
+        chunked(running_instances, BATCH_SIZE), enrich, evaluate, emitter, **checkpoint.tracking(target, cursor)
+    ):
+        checkpoint.finish(target)
+
+    print(f"Fetched metrics for {emitter.count} instances in {target} with {api_calls} GetMetricData calls")
+    if state:
+        print(f"Incremental scan of {target}: {state.stats()}")
+    if cache:
+        print(f"Metric cache for {target}: {cache.stats()}")
+    return emitter.count
+
+
+def shard_resources(clients, region, account=None):
+    """Running instance ids in a region with their weight (metric queries) for a sharded scan."""
+    snapshot = shared_snapshot(clients, region, account=account)
+    return [(instance['InstanceId'], 3) for instance in snapshot.iter_instances(states=('running',))]
+
+
+def instance_key(instance):
+    """Scan state key for an instance."""
+    return f"EC2#{instance['InstanceId']}"
+
+
+def instance_config(instance):
+    """Configuration attributes that decide whether an instance needs a full scan."""
+    return {
+        'instance_type': instance['InstanceType'],
+        'state': instance['State']['Name'],
+        'launch_time': instance['LaunchTime'],
+        'tags': instance.get('Tags', [])
+    }
+
+
+def build_instance_finding(instance, metrics, region, utilization, prices, volumes=()):
+    """Build the finding for a running instance from its resolved metrics, utilization stats, prices and attached volumes."""
+    instance_id = instance['InstanceId']
+    instance_type = instance['InstanceType']
+    state = instance['State']['Name']
+    launch_time = instance['LaunchTime']
+
+    # Get instance name from tags
+    instance_name = 'N/A'
+    if 'Tags' in instance:
+        for tag in instance['Tags']:
+            if tag['Key'] == 'Name':
+                instance_name = tag['Value']
+                break
+
+    debug(f"Analyzing EC2 instance: {instance_id} ({instance_name})")
+
+    cpu_utilization = metrics.average(instance_id, 'CPUUtilization')
+    network_in = metrics.sum(instance_id, 'NetworkIn')
+    network_out = metrics.sum(instance_id, 'NetworkOut')
+
+    # Calculate instance age
+    age_days = (datetime.now(launch_time.tzinfo) - launch_time).days
+
+    recommendation = f"CPU Avg: {cpu_utilization:.1f}%, p95: {utilization['cpu_p95_percent']:.1f}%"
+    # No recommendation from a series that could not be fetched completely
+    metrics_failed = metrics.failed(instance_id)
+    recommended_type = None if metrics_failed else utilization['recommended_type']
+    if recommended_type:
+        recommendation += f', consider downsizing to {recommended_type}'
+
+    # On-demand cost, and what downsizing to the recommended type would save
+    monthly_cost = prices.monthly('ec2', region, instance_type)
+    monthly_savings = None
+    if monthly_cost is not None:
+        monthly_savings = 0.0
+        if recommended_type:
+            recommended_cost = prices.monthly('ec2', region, recommended_type)
+            if recommended_cost is not None:
+                monthly_savings = max(monthly_cost - recommended_cost, 0.0)
+
+    # Record the instance with metrics
+    return Finding(
+        resource_id=instance_id,
+        resource_type='EC2',
+        issue='running_instance',
+        severity='low' if recommended_type else 'info',
+        details=f'Running EC2 instance: {instance_name}',
+        recommendation=recommendation,
+        metadata={
+            'instance_name': instance_name,
+            'instance_type': instance_type,
+            'region': region,
+            'state': state,
+            'age_days': age_days,
+            'cpu_avg_percent': round(cpu_utilization, 2),
+            'cpu_p50_percent': utilization['cpu_p50_percent'],
+            'cpu_p95_percent': utilization['cpu_p95_percent'],
+            'cpu_p99_percent': utilization['cpu_p99_percent'],
+            'cpu_peak_to_mean': utilization['cpu_peak_to_mean'],
+            'idle_hours_fraction': utilization['idle_hours_fraction'],
+            # Hourly CPU datapoints behind the statistics, which are 0 rather than unknown without any
+            'datapoints': utilization['datapoints'],
+            'recommended_type': recommended_type,
+            'metrics_failed': metrics_failed,
+            'network_in_mb': round(network_in / (1024 * 1024), 2),
+            'network_out_mb': round(network_out / (1024 * 1024), 2),
+            'attached_volumes': [volume['VolumeId'] for volume in volumes],
+            'attached_storage_gb': sum(volume['Size'] for volume in volumes),
+            'launch_time': launch_time.isoformat()
+        },
+        monthly_cost=monthly_cost,
+        monthly_savings=monthly_savings
+    )
+
+
+def queue_instance_metrics(metrics, instance_id):
+    """Queue CPU utilization and network traffic queries for an instance."""
+    dimensions = [{'Name': 'InstanceId', 'Value': instance_id}]
+    metrics.add(instance_id, 'AWS/EC2', 'CPUUtilization', dimensions, 'Average')
+    metrics.add(instance_id, 'AWS/EC2', 'NetworkIn', dimensions, 'Sum')
+    metrics.add(instance_id, 'AWS/EC2', 'NetworkOut', dimensions, 'Sum')
 
 
 if __name__ == "__main__":
-    print(lambda_handler({}, {}))
\ No newline at end of file
+    print(lambda_handler({}, {}))
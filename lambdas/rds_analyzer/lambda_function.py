@@ -1,82 +1,571 @@
-import boto3
 import json
 from datetime import datetime
-from decimal import Decimal
 
+from cost_optimizer.accounts import account_clients, account_id, resolve_accounts, scan_accounts, scope
+from cost_optimizer.checkpoint import ScanCheckpoint
+from cost_optimizer.clients import shared_pool
+from cost_optimizer.fanout import coordinate, is_fan_out, shard_ids, shard_worker
+from cost_optimizer.findings import Finding
+from cost_optimizer.forecasting import GIB, MIN_DATAPOINTS, linear_trends, storage_forecast
+from cost_optimizer.metric_cache import MetricDayCache, use_metric_cache
+from cost_optimizer.metrics import MetricQueryEngine, MAX_QUERIES_PER_REQUEST
+from cost_optimizer.output import FindingsOutput, to_json
+from cost_optimizer.pipeline import FindingEmitter, run_pipeline
+from cost_optimizer.pricing import shared_index, rds_deployment, rds_engine
+from cost_optimizer.ratelimit import api_stats, reset_stats
+from cost_optimizer.rightsizing import series_matrix
+from cost_optimizer.rollups import RollupStore, use_rollups
+from cost_optimizer.rules import shared_rules
+from cost_optimizer.sink import FindingSink
+from cost_optimizer.state import ScanState, is_incremental
+from cost_optimizer.telemetry import debug, emit_metrics, reset_metrics
+from cost_optimizer.regions import resolve_regions, scan_regions
+from cost_optimizer.resources import iter_db_clusters, iter_db_instances, chunked
+
+# Metric and statistic per DB instance, as daily datapoints over METRIC_DAYS
+DB_METRICS = (
+    ('CPUUtilization', 'Average'), ('DatabaseConnections', 'Maximum'), ('FreeStorageSpace', 'Minimum'),
+    ('ReadIOPS', 'Average'), ('WriteIOPS', 'Average')
+)
+
+# Metric and statistic per DB cluster; Aurora storage grows on demand, so it is tracked as bytes used
+CLUSTER_METRICS = (
+    ('CPUUtilization', 'Average'), ('DatabaseConnections', 'Maximum'), ('VolumeBytesUsed', 'Average'),
+    ('VolumeReadIOPs', 'Sum'), ('VolumeWriteIOPs', 'Sum')
+)
+
+# One batch of DB instances (or clusters) fills one GetMetricData request
+BATCH_SIZE = MAX_QUERIES_PER_REQUEST // len(DB_METRICS)
+
+# Days of metrics behind the utilization stats and storage trends
+METRIC_DAYS = 30
+
+# A database is idle when its daily peak connections never exceed this
+IDLE_MAX_CONNECTIONS = 0
+
+# Smallest storage an RDS instance can be migrated to
+MIN_STORAGE_GB = 20
+
+# Marks DB cluster ids among the DB instance ids of a shard
+CLUSTER_PREFIX = 'cluster:'
+
+# DB instance ids per shard, kept small for the describe_db_instances id filter
+MAX_SHARD_INSTANCES = 100
+
+
+@shard_worker
 def lambda_handler(event, context):
     """
-    Analyze RDS instances and report on running instances with storage > 10GB.
+    Analyze RDS instances and DB clusters from 30 days of CloudWatch metrics:
+    idle databases and storage allocated far beyond its projected growth.
+    The rules decide which ones are reported (see cost_optimizer.rules).
+
+    Scans the regions in event['regions'] / SCAN_REGIONS (default: own region),
+    of the accounts in event['accounts'] / SCAN_ACCOUNTS (default: own account).
     """
-    rds = boto3.client('rds')
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table('CostOptimizerFindings')
-    
-    findings = []
-    
+    event = event or {}
+    incremental = is_incremental(event)
+    metric_cache = use_metric_cache(event)
+    clients = shared_pool()
+    reset_stats()
+    reset_metrics()
+    dynamodb = clients.client('dynamodb')
+    # Daily per-resource series for trend queries (see cost_optimizer.rollups)
+    rollups = RollupStore(dynamodb) if use_rollups(event) else None
+
+    output = None
+
     try:
-        # Get all RDS instances
-        response = rds.describe_db_instances()
-        
-        for db_instance in response['DBInstances']:
-            db_identifier = db_instance['DBInstanceIdentifier']
-            db_instance_class = db_instance['DBInstanceClass']
-            engine = db_instance['Engine']
-            status = db_instance['DBInstanceStatus']
-            multi_az = db_instance['MultiAZ']
-            storage_type = db_instance['StorageType']
-            allocated_storage = db_instance['AllocatedStorage']
-            
-            # FILTER 1: Only check running instances (status = 'available')
-            if status != 'available':
-                print(f"Skipping {db_identifier} - not running (status: {status})")
-                continue
-            
-            # FILTER 2: Only check instances with storage > 10GB
-            if allocated_storage <= 10:
-                print(f"Skipping {db_identifier} - storage too small ({allocated_storage}GB)")
-                continue
-            
-            print(f"Found qualifying RDS instance: {db_identifier}")
-            
-            # Record the instance details
-            finding = {
-                'id': db_identifier,
-                'resource_id': db_identifier,
-                'resource_type': 'RDS',
-                'issue': 'running_instance_over_10gb',
-                'severity': 'info',
-                'details': f'Running RDS instance with {allocated_storage}GB storage',
-                'recommendation': 'Instance meets criteria: Running and >10GB storage',
-                'metadata': {
-                    'instance_class': db_instance_class,
-                    'engine': engine,
-                    'storage_gb': allocated_storage,
-                    'storage_type': storage_type,
-                    'multi_az': multi_az,
-                    'status': status
-                },
-                'timestamp': datetime.now().isoformat()
-            }
-            findings.append(finding)
-        
-        # Store findings in DynamoDB
-        for finding in findings:
-            table.put_item(Item=finding)
-        
+        regions = resolve_regions(event, clients)
+        accounts = resolve_accounts(event)
+        if is_fan_out(event):
+            # Coordinator: list resources and analyze them in parallel shards
+            return coordinate(
+                clients, 'rds', event, context, regions,
+                lambda region, account=None: shard_resources(clients, region, account), lambda_handler,
+                max_resources=MAX_SHARD_INSTANCES, accounts=accounts
+            )
+
+        checkpoint = ScanCheckpoint(dynamodb, 'rds', event, context)
+        prices = shared_index(clients)
+        output = FindingsOutput(clients, 'rds', event, context)
+        checkpoint.restore(output)
+
+        # Findings are written to DynamoDB in batches as they are produced
+        with FindingSink(dynamodb) as sink:
+            def scan(region, account=None):
+                return analyze_region(
+                    clients, region, sink, output, prices, checkpoint, incremental, shard_ids(event), metric_cache,
+                    rollups, account
+                )
+
+            if accounts:
+                report = {'accounts': scan_accounts(accounts, regions, scan)}
+            else:
+                report = {'regions': scan_regions(regions, scan)}
+        output.close()
+
+        # Only once the findings are written, so a resumed scan never skips any
+        checkpoint.close(clients, output, event, context)
+
+        write_stats = sink.stats()
+        print(f"Wrote {write_stats['items_written']} findings: {write_stats}")
+
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                'findings_count': len(findings),
-                'message': f'Found {len(findings)} running RDS instances with storage > 10GB',
-                'findings': findings
-            }, default=str)
+            'body': to_json(output.summary(
+                message=f'Found {output.count} RDS instances and clusters in {len(regions)} regions' + (
+                    f' of {len(accounts)} accounts' if accounts else ''
+                ),
+                **report,
+                write_stats=write_stats,
+                api_stats=api_stats(),
+                checkpoint=checkpoint.summary(event)
+            ))
         }
-        
+
     except Exception as e:
-        print(f"Error analyzing RDS instances: {str(e)}")
+        print(f"Error analyzing RDS resources: {str(e)}")
+        if output:
+            output.abort()
         return {
             'statusCode': 500,
             'body': json.dumps({
                 'error': str(e)
             })
-        }
\ No newline at end of file
+        }
+    finally:
+        # One set of EMF metrics per invocation
+        emit_metrics('rds', output.count if output else None)
+
+
+def analyze_region(clients, region, sink, output, prices, checkpoint, incremental=False, resource_ids=None,
+                   metric_cache=False, rollups=None, account=None):
+    """
+    Analyze the RDS instances, then the DB clusters, in one region (of another
+    account), or only `resource_ids` for a shard.
+    """
+    pool = account_clients(clients, account)
+    rds = pool.client('rds', region)
+    cloudwatch = pool.client('cloudwatch', region)
+    # Severity, issue and recommendation from the rules file (see cost_optimizer.rules)
+    rules = shared_rules(clients)
+    state = ScanState(clients.client('dynamodb'), account_id=account_id(account)) if incremental else None
+    # Closed days of metrics come from earlier runs, only new days are fetched
+    cache = None
+    if metric_cache:
+        cache = MetricDayCache(clients.client('dynamodb'), region, account_id=account_id(account))
+    emitter = FindingEmitter(sink, output, state, rollups, account_id(account), timestamp=checkpoint.timestamp)
+    # Checkpoint key and log label of the region, with the account when scanning another
+    target = scope(region, account)
+    instance_ids, cluster_ids = split_shard_ids(resource_ids)
+    api_calls = 0
+
+    def enrich(batch):
+        # Incremental mode skips instances whose config has not changed since the last full scan
+        if state:
+            batch = state.changed(batch, db_key, db_config)
+
+        # Daily metrics of the whole batch in one GetMetricData request
+        metrics = MetricQueryEngine(cloudwatch, days=METRIC_DAYS, cache=cache)
+        for db_instance in batch:
+            if needs_metrics(db_instance):
+                queue_metrics(metrics, db_instance['DBInstanceIdentifier'], 'DBInstanceIdentifier', DB_METRICS)
+        metrics.resolve()
+        return batch, metrics
+
+    def evaluate(enriched):
+        nonlocal api_calls
+        batch, metrics = enriched
+        api_calls += metrics.api_calls
+
+        # Utilization and storage forecasts for the batch in one pass
+        usage = db_usage(metrics, batch)
+        # Skip rules drop the instances not worth reporting (stopped, cluster members, ...)
+        findings = rules.apply([
+            build_db_finding(db_instance, metrics, region, db_instance_usage, prices)
+            for db_instance, db_instance_usage in zip(batch, usage)
+        ])
+        if state:
+            state.record_unreported(map(db_key, batch), findings)
+        return findings
+
+    def enrich_clusters(batch):
+        if state:
+            batch = state.changed(batch, cluster_key, cluster_config)
+
+        # Member instances price the cluster
+        members = {}
+        batch_ids = [cluster['DBClusterIdentifier'] for cluster in batch]
+        for db_instance in iter_db_instances(rds, db_cluster_ids=batch_ids) if batch_ids else ():
+            members.setdefault(db_instance['DBClusterIdentifier'], []).append(db_instance)
+
+        metrics = MetricQueryEngine(cloudwatch, days=METRIC_DAYS, cache=cache)
+        for cluster in batch:
+            if cluster['Status'] == 'available':
+                queue_metrics(metrics, cluster['DBClusterIdentifier'], 'DBClusterIdentifier', CLUSTER_METRICS)
+        metrics.resolve()
+        return batch, members, metrics
+
+    def evaluate_clusters(enriched):
+        nonlocal api_calls
+        batch, members, metrics = enriched
+        api_calls += metrics.api_calls
+
+        usage = cluster_usage(metrics, batch)
+        findings = rules.apply([
+            build_cluster_finding(
+                cluster, metrics, region, cluster_usage_row, prices, members.get(cluster['DBClusterIdentifier'], [])
+            )
+            for cluster, cluster_usage_row in zip(batch, usage)
+        ])
+        if state:
+            state.record_unreported(map(cluster_key, batch), findings)
+        return findings
+
+    # A shard analyzes only its own ids of each kind
+    if instance_ids is None or instance_ids:
+        # Stream all RDS instances page by page, from the checkpoint when resuming
+        cursor = checkpoint.cursor(target)
+        if not run_pipeline(
+            chunked(iter_db_instances(rds, cursor=cursor, db_instance_ids=instance_ids), BATCH_SIZE), enrich,
+            evaluate, emitter,
+            **checkpoint.tracking(target, cursor)
+        ):
+            return emitter.count
+        checkpoint.finish(target)
+
+    if cluster_ids is None or cluster_ids:
+        key = f'{target}/clusters'
+        cursor = checkpoint.cursor(key)
+        if run_pipeline(
+            chunked(iter_db_clusters(rds, cursor=cursor, db_cluster_ids=cluster_ids), BATCH_SIZE), enrich_clusters,
+            evaluate_clusters, emitter,
+            **checkpoint.tracking(key, cursor)
+        ):
+            checkpoint.finish(key)
+
+    print(f"Fetched metrics for {emitter.count} RDS resources in {target} with {api_calls} GetMetricData calls")
+    if state:
+        print(f"Incremental scan of {target}: {state.stats()}")
+    if cache:
+        print(f"Metric cache for {target}: {cache.stats()}")
+    return emitter.count
+
+
+def shard_resources(clients, region, account=None):
+    """DB instance and (prefixed) DB cluster ids in a region with their weight (metric queries) for a sharded scan."""
+    rds = account_clients(clients, account).client('rds', region)
+    resources = [
+        (db_instance['DBInstanceIdentifier'], len(DB_METRICS) if needs_metrics(db_instance) else 1)
+        for db_instance in iter_db_instances(rds)
+    ]
+    resources += [
+        (CLUSTER_PREFIX + cluster['DBClusterIdentifier'], len(CLUSTER_METRICS)) for cluster in iter_db_clusters(rds)
+    ]
+    return resources
+
+
+def split_shard_ids(resource_ids):
+    """The DB instance ids and DB cluster ids of a shard, (None, None) outside a shard."""
+    if resource_ids is None:
+        return None, None
+    cluster_ids = [resource_id[len(CLUSTER_PREFIX):] for resource_id in resource_ids
+                   if resource_id.startswith(CLUSTER_PREFIX)]
+    instance_ids = [resource_id for resource_id in resource_ids if not resource_id.startswith(CLUSTER_PREFIX)]
+    return instance_ids, cluster_ids
+
+
+def needs_metrics(db_instance):
+    """Stopped instances have no metrics, and cluster members are measured with their cluster."""
+    return db_instance['DBInstanceStatus'] == 'available' and not db_instance.get('DBClusterIdentifier')
+
+
+def queue_metrics(metrics, resource_id, dimension, metric_stats):
+    """Queue daily queries of the given (metric, statistic) pairs for a DB instance or cluster."""
+    dimensions = [{'Name': dimension, 'Value': resource_id}]
+    for metric_name, stat in metric_stats:
+        metrics.add(resource_id, 'AWS/RDS', metric_name, dimensions, stat)
+
+
+def db_key(db_instance):
+    """Scan state key for a DB instance."""
+    return f"RDS#{db_instance['DBInstanceIdentifier']}"
+
+
+def db_config(db_instance):
+    """Configuration attributes that decide whether a DB instance needs a full scan."""
+    return {
+        'instance_class': db_instance['DBInstanceClass'],
+        'engine': db_instance['Engine'],
+        'status': db_instance['DBInstanceStatus'],
+        'storage_gb': db_instance['AllocatedStorage'],
+        'storage_type': db_instance['StorageType'],
+        'multi_az': db_instance['MultiAZ']
+    }
+
+
+def cluster_key(cluster):
+    """Scan state key for a DB cluster."""
+    return f"RDS_CLUSTER#{cluster['DBClusterIdentifier']}"
+
+
+def cluster_config(cluster):
+    """Configuration attributes that decide whether a DB cluster needs a full scan."""
+    return {
+        'engine': cluster['Engine'],
+        'engine_mode': cluster.get('EngineMode'),
+        'status': cluster['Status'],
+        'members': sorted(member['DBInstanceIdentifier'] for member in cluster.get('DBClusterMembers', []))
+    }
+
+
+def activity_stats(metrics, resource_ids):
+    """
+    Daily CPU, peak connections and idleness over the metric window for a
+    batch of DB instances or clusters, as 1-D arrays (NaN without data).
+    """
+    import numpy as np
+
+    cpu = series_matrix(metrics, resource_ids, 'CPUUtilization')
+    connections = series_matrix(metrics, resource_ids, 'DatabaseConnections')
+    cpu_days = (~np.isnan(cpu)).sum(axis=1)
+    connection_days = (~np.isnan(connections)).sum(axis=1)
+    peak_connections = np.nan_to_num(connections, nan=-np.inf).max(axis=1)
+
+    return {
+        'datapoints': connection_days,
+        'cpu_avg': _row_means(cpu),
+        'cpu_max': np.where(cpu_days > 0, np.nan_to_num(cpu, nan=-np.inf).max(axis=1), np.nan),
+        'connections_max': np.where(connection_days > 0, peak_connections, np.nan),
+        # No connection on any of enough known days
+        'idle': (connection_days >= MIN_DATAPOINTS) & (peak_connections <= IDLE_MAX_CONNECTIONS)
+    }
+
+
+def db_usage(metrics, db_instances):
+    """
+    Utilization stats and FreeStorageSpace trend fits for a batch of DB
+    instances whose DB_METRICS were resolved on `metrics`. Returns one dict
+    per instance.
+    """
+    if not db_instances:
+        return []
+
+    db_identifiers = [db_instance['DBInstanceIdentifier'] for db_instance in db_instances]
+    activity = activity_stats(metrics, db_identifiers)
+    forecast = storage_forecast(
+        series_matrix(metrics, db_identifiers, 'FreeStorageSpace'),
+        [db_instance['AllocatedStorage'] for db_instance in db_instances], MIN_STORAGE_GB
+    )
+    read_iops = _row_means(series_matrix(metrics, db_identifiers, 'ReadIOPS'))
+    write_iops = _row_means(series_matrix(metrics, db_identifiers, 'WriteIOPS'))
+
+    columns = {
+        'datapoints': activity['datapoints'].tolist(),
+        'idle': activity['idle'].tolist(),
+        'cpu_avg_percent': _rounded(activity['cpu_avg'], 2),
+        'cpu_max_percent': _rounded(activity['cpu_max'], 2),
+        'connections_max': _rounded(activity['connections_max'], 0),
+        'read_iops_avg': _rounded(read_iops, 2),
+        'write_iops_avg': _rounded(write_iops, 2),
+        'free_storage_gb': _rounded(forecast['free_gb'], 2),
+        'storage_growth_gb_per_day': _rounded(forecast['growth_gb_per_day'], 3),
+        'days_to_full': _rounded(forecast['days_to_full'], 0),
+        'reclaimable_gb': _rounded(forecast['reclaimable_gb'], 0)
+    }
+    return [{name: values[row] for name, values in columns.items()} for row in range(len(db_instances))]
+
+
+def cluster_usage(metrics, clusters):
+    """
+    Utilization stats and VolumeBytesUsed trend fits for a batch of DB
+    clusters whose CLUSTER_METRICS were resolved on `metrics`. Returns one
+    dict per cluster.
+    """
+    if not clusters:
+        return []
+
+    cluster_ids = [cluster['DBClusterIdentifier'] for cluster in clusters]
+    activity = activity_stats(metrics, cluster_ids)
+    trends = linear_trends(series_matrix(metrics, cluster_ids, 'VolumeBytesUsed') / GIB)
+
+    columns = {
+        'datapoints': activity['datapoints'].tolist(),
+        'idle': activity['idle'].tolist(),
+        'cpu_avg_percent': _rounded(activity['cpu_avg'], 2),
+        'cpu_max_percent': _rounded(activity['cpu_max'], 2),
+        'connections_max': _rounded(activity['connections_max'], 0),
+        'volume_used_gb': _rounded(trends['latest'], 2),
+        'storage_growth_gb_per_day': _rounded(trends['slope'], 3)
+    }
+    return [{name: values[row] for name, values in columns.items()} for row in range(len(clusters))]
+
+
+def _row_means(matrix):
+    import numpy as np
+
+    counts = (~np.isnan(matrix)).sum(axis=1)
+    return np.where(counts > 0, np.nansum(matrix, axis=1) / np.maximum(counts, 1), np.nan)
+
+
+def _rounded(values, digits):
+    """A 1-D array as a list of rounded floats, None where NaN or infinite."""
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.float64)
+    known = np.isfinite(values)
+    rounded = np.round(np.where(known, values, 0.0), digits).tolist()
+    return [value if is_known else None for value, is_known in zip(rounded, known.tolist())]
+
+
+def build_db_finding(db_instance, metrics, region, usage, prices):
+    """Build the finding for an RDS instance from its utilization stats, storage forecast and prices."""
+    db_identifier = db_instance['DBInstanceIdentifier']
+    allocated_storage = db_instance['AllocatedStorage']
+    status = db_instance['DBInstanceStatus']
+    create_time = db_instance.get('InstanceCreateTime')
+
+    debug(f"Analyzing RDS instance: {db_identifier} ({status})")
+
+    age_days = (datetime.now(create_time.tzinfo) - create_time).days if create_time else None
+
+    recommendation = f"{db_instance['DBInstanceClass']} {db_instance['Engine']}, {allocated_storage}GB " \
+                     f"{db_instance['StorageType']}"
+    if usage['free_storage_gb'] is not None:
+        recommendation += f", {usage['free_storage_gb']:.0f}GB free"
+        if usage['days_to_full'] is not None:
+            recommendation += f" (full in {usage['days_to_full']:.0f} days)"
+
+    # No findings from series that could not be fetched completely
+    metrics_failed = metrics.failed(db_identifier)
+    idle = usage['idle'] and not metrics_failed
+    reclaimable_gb = 0 if metrics_failed else usage['reclaimable_gb']
+
+    # Instance hours plus allocated storage; an idle database saves all of it,
+    # over-provisioned storage what migrating to the projected need saves
+    monthly_cost = db_monthly_cost(prices, region, db_instance)
+    monthly_savings = None
+    if monthly_cost is not None:
+        monthly_savings = 0.0
+        if idle:
+            monthly_savings = monthly_cost
+        elif reclaimable_gb:
+            storage_price = prices.monthly(
+                'rds-storage', region, db_instance['StorageType'], rds_deployment(db_instance['MultiAZ'])
+            ) or 0.0
+            monthly_savings = reclaimable_gb * storage_price
+
+    # Record the instance details
+    return Finding(
+        resource_id=db_identifier,
+        resource_type='RDS',
+        issue='rds_instance',
+        severity='info',
+        details=f'RDS instance with {allocated_storage}GB storage ({status})',
+        recommendation=recommendation,
+        metadata={
+            'instance_class': db_instance['DBInstanceClass'],
+            'engine': db_instance['Engine'],
+            'region': region,
+            'storage_gb': allocated_storage,
+            'storage_type': db_instance['StorageType'],
+            'multi_az': db_instance['MultiAZ'],
+            'status': status,
+            'cluster_id': db_instance.get('DBClusterIdentifier'),
+            'age_days': age_days,
+            'datapoints': usage['datapoints'],
+            'cpu_avg_percent': usage['cpu_avg_percent'],
+            'cpu_max_percent': usage['cpu_max_percent'],
+            'connections_max': usage['connections_max'],
+            'read_iops_avg': usage['read_iops_avg'],
+            'write_iops_avg': usage['write_iops_avg'],
+            'free_storage_gb': usage['free_storage_gb'],
+            'storage_growth_gb_per_day': usage['storage_growth_gb_per_day'],
+            'days_to_full': usage['days_to_full'],
+            'reclaimable_gb': reclaimable_gb,
+            'idle': idle,
+            'metrics_failed': metrics_failed
+        },
+        monthly_cost=monthly_cost,
+        monthly_savings=monthly_savings
+    )
+
+
+def build_cluster_finding(cluster, metrics, region, usage, prices, members):
+    """Build the finding for a DB cluster from its utilization stats, storage trend, prices and member instances."""
+    cluster_id = cluster['DBClusterIdentifier']
+    status = cluster['Status']
+    create_time = cluster.get('ClusterCreateTime')
+
+    debug(f"Analyzing RDS cluster: {cluster_id} ({status})")
+
+    age_days = (datetime.now(create_time.tzinfo) - create_time).days if create_time else None
+    metrics_failed = metrics.failed(cluster_id)
+    idle = usage['idle'] and not metrics_failed
+
+    # Member instance hours; an idle cluster saves all of them
+    monthly_cost = cluster_monthly_cost(prices, region, cluster, members)
+    monthly_savings = None
+    if monthly_cost is not None:
+        monthly_savings = monthly_cost if idle else 0.0
+
+    return Finding(
+        resource_id=cluster_id,
+        resource_type='RDS_CLUSTER',
+        issue='rds_cluster',
+        severity='info',
+        details=f"RDS cluster with {len(members)} instances ({status})",
+        recommendation=f"{cluster['Engine']} {cluster.get('EngineMode', 'provisioned')}, "
+                       f"{', '.join(sorted(member['DBInstanceClass'] for member in members)) or 'no instances'}",
+        metadata={
+            'engine': cluster['Engine'],
+            'engine_mode': cluster.get('EngineMode'),
+            'region': region,
+            'status': status,
+            'members': [member['DBInstanceIdentifier'] for member in members],
+            'member_count': len(members),
+            'age_days': age_days,
+            'datapoints': usage['datapoints'],
+            'cpu_avg_percent': usage['cpu_avg_percent'],
+            'cpu_max_percent': usage['cpu_max_percent'],
+            'connections_max': usage['connections_max'],
+            'volume_used_gb': usage['volume_used_gb'],
+            'storage_growth_gb_per_day': usage['storage_growth_gb_per_day'],
+            'billed_read_ios_30d': metrics.sum(cluster_id, 'VolumeReadIOPs'),
+            'billed_write_ios_30d': metrics.sum(cluster_id, 'VolumeWriteIOPs'),
+            'idle': idle,
+            'metrics_failed': metrics_failed
+        },
+        monthly_cost=monthly_cost,
+        monthly_savings=monthly_savings
+    )
+
+
+def cluster_monthly_cost(prices, region, cluster, members):
+    """On-demand cost of a DB cluster's member instances, or None when one of them has no price."""
+    total = 0.0
+    for member in members:
+        price = prices.monthly(
+            'rds', region, member['DBInstanceClass'], rds_engine(member['Engine']), rds_deployment(False)
+        )
+        if price is None:
+            return None
+        total += price
+    return total
+
+
+def db_monthly_cost(prices, region, db_instance):
+    """On-demand instance and storage cost of a DB instance, or None without an instance price."""
+    deployment = rds_deployment(db_instance['MultiAZ'])
+    instance_price = prices.monthly(
+        'rds', region, db_instance['DBInstanceClass'], rds_engine(db_instance['Engine']), deployment
+    )
+    if instance_price is None:
+        return None
+    storage_price = prices.monthly('rds-storage', region, db_instance['StorageType'], deployment) or 0.0
+    return instance_price + db_instance['AllocatedStorage'] * storage_price
+
+
+if __name__ == "__main__":
+    print(lambda_handler({}, {}))
@@ -1,233 +1,481 @@
-import boto3
 import json
-from datetime import datetime, timedelta
-from decimal import Decimal
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
+from botocore.exceptions import ClientError
+from cost_optimizer.accounts import account_clients, account_id, resolve_accounts, scan_accounts, scope
+from cost_optimizer.checkpoint import ScanCheckpoint
+from cost_optimizer.clients import shared_pool
+from cost_optimizer.fanout import coordinate, is_fan_out, shard_ids, shard_worker
+from cost_optimizer.findings import Finding
+from cost_optimizer.metric_cache import MetricDayCache, use_metric_cache
+from cost_optimizer.metrics import MetricQueryEngine
+from cost_optimizer.output import FindingsOutput, to_json
+from cost_optimizer.pipeline import FindingEmitter, run_pipeline
+from cost_optimizer.pricing import shared_index
+from cost_optimizer.ratelimit import api_stats, reset_stats
+from cost_optimizer.rollups import RollupStore, use_rollups
+from cost_optimizer.rules import shared_rules
+from cost_optimizer.sink import FindingSink
+from cost_optimizer.state import ScanState, is_incremental
+from cost_optimizer.telemetry import debug, emit_metrics, reset_metrics
+from cost_optimizer.s3_inventory import STORAGE_TYPE_CLASSES, get_inventory_breakdown
+from cost_optimizer.resources import iter_buckets, iter_objects, chunked
+
+# Buckets analyzed per batch; their metric queries are split into 500-query requests
+BATCH_SIZE = 100
+
+# Buckets analyzed in parallel, overridable per invocation with event['concurrency']
+DEFAULT_CONCURRENCY = int(os.environ.get('S3_CONCURRENCY', '16'))
+
+# Storage class breakdown source: 'inventory' reads S3 Inventory reports and falls
+# back to per-StorageType CloudWatch metrics, 'listing' counts listed objects
+STORAGE_BREAKDOWN = os.environ.get('S3_STORAGE_BREAKDOWN', 'inventory')
+
+# Cap on objects listed per bucket for the 'listing' storage class breakdown
+MAX_LISTED_OBJECTS = int(os.environ.get('S3_MAX_LISTED_OBJECTS', '100000'))
+
+# All four must be on (for the bucket or its account) to rule out public access
+PUBLIC_ACCESS_BLOCK_SETTINGS = ('BlockPublicAcls', 'IgnorePublicAcls', 'BlockPublicPolicy', 'RestrictPublicBuckets')
+
+# Rough API calls per bucket for sharding: location, inventory, versioning, public access, metrics
+BUCKET_WEIGHT = 8
+
+
+@shard_worker
 def lambda_handler(event, context):
     """
     Analyze S3 buckets - check all buckets with basic useful metrics.
+
+    Scans the buckets of the accounts in event['accounts'] / SCAN_ACCOUNTS
+    (default: own account).
     """
-    s3 = boto3.client('s3')
-    cloudwatch = boto3.client('cloudwatch')
-    dynamodb = boto3.resource('dynamodb')
-    table = dynamodb.Table('CostOptimizerFindings')
-    
-    findings = []
-    
+    event = event or {}
+    concurrency = int(event.get('concurrency') or DEFAULT_CONCURRENCY)
+
+    # S3 and CloudWatch clients per bucket region, created on first use and
+    # kept across warm invocations
+    clients = shared_pool(max_pool_connections=concurrency)
+    reset_stats()
+    reset_metrics()
+    dynamodb = clients.client('dynamodb')
+
+    incremental = is_incremental(event)
+    metric_cache = use_metric_cache(event)
+    # Daily per-bucket series for trend queries (see cost_optimizer.rollups)
+    rollups = RollupStore(dynamodb) if use_rollups(event) else None
+    output = None
+
     try:
-        # Get all S3 buckets
-        response = s3.list_buckets()
-        
-        for bucket in response['Buckets']:
-            bucket_name = bucket['Name']
-            creation_date = bucket['CreationDate']
-            
-            print(f"Analyzing S3 bucket: {bucket_name}")
-            
-            # Get bucket region
-            try:
-                location = s3.get_bucket_location(Bucket=bucket_name)
-                region = location['LocationConstraint'] or 'us-east-1'
-            except Exception as e:
-                print(f"Error getting location for {bucket_name}: {str(e)}")
-                region = 'unknown'
-            
-            # Get bucket size and object count
-            bucket_size_bytes, object_count = get_bucket_size(cloudwatch, bucket_name)
-            bucket_size_gb = bucket_size_bytes / (1024**3)
-            
-            # Get storage class breakdown
-            storage_classes = get_storage_class_breakdown(s3, bucket_name)
-            
-            # Check versioning
-            versioning_status = get_versioning_status(s3, bucket_name)
-            
-            # Check public access
-            is_public = check_public_access(s3, bucket_name)
-            
-            # Get request metrics (last 7 days)
-            get_requests = get_request_metrics(cloudwatch, bucket_name, 'GetRequests')
-            put_requests = get_request_metrics(cloudwatch, bucket_name, 'PutRequests')
-            
-            # Calculate bucket age
-            age_days = (datetime.now(creation_date.tzinfo) - creation_date).days
-            
-            # Record the bucket with metrics
-            finding = {
-                "id": bucket_name,
-                'resource_id': bucket_name,
-                'resource_type': 'S3',
-                'issue': 's3_bucket',
-                'severity': 'info',
-                'details': f'S3 Bucket: {bucket_name}',
-                'recommendation': f'Size: {bucket_size_gb:.2f}GB, Objects: {object_count:,}',
-                'metadata': {
-                    'bucket_name': bucket_name,
-                    'region': region,
-                    'age_days': age_days,
-                    'size_gb': Decimal(str(round(bucket_size_gb, 2))),
-                    'object_count': object_count,
-                    'storage_classes': storage_classes,
-                    'versioning_enabled': versioning_status,
-                    'is_public': is_public,
-                    'get_requests_7d': int(get_requests),
-                    'put_requests_7d': int(put_requests),
-                    'creation_date': creation_date.isoformat()
-                },
-                'timestamp': datetime.now().isoformat()
-            }
-            findings.append(finding)
-        
-        # Store findings in DynamoDB
-        for finding in findings:
-            table.put_item(Item=finding)
-        
+        accounts = resolve_accounts(event)
+        if is_fan_out(event):
+            # Coordinator: list buckets and analyze them in parallel shards
+            return coordinate(
+                clients, 's3', event, context, ['global'],
+                lambda region, account=None: shard_resources(account_clients(clients, account).client('s3')),
+                lambda_handler, accounts=accounts
+            )
+
+        checkpoint = ScanCheckpoint(dynamodb, 's3', event, context)
+        output = FindingsOutput(clients, 's3', event, context)
+        checkpoint.restore(output)
+        prices = shared_index(clients)
+
+        # Findings are written to DynamoDB in batches as they are produced
+        with FindingSink(dynamodb) as sink, ThreadPoolExecutor(max_workers=concurrency) as executor:
+            def scan(region, account=None):
+                return analyze_buckets(
+                    clients, sink, output, prices, checkpoint, executor, incremental, shard_ids(event),
+                    metric_cache, rollups, account
+                )
+
+            report = {}
+            if accounts:
+                report['accounts'] = scan_accounts(accounts, ['global'], scan)
+            else:
+                scan('global')
+        output.close()
+
+        # Only once the findings are written, so a resumed scan never skips any
+        checkpoint.close(clients, output, event, context)
+
+        write_stats = sink.stats()
+        print(f"Wrote {write_stats['items_written']} findings: {write_stats}")
+
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                'findings_count': len(findings),
-                'message': f'Analyzed {len(findings)} S3 buckets',
-                'findings': findings
-            }, default=str)
+            'body': to_json(output.summary(
+                message=f'Analyzed {output.count} S3 buckets' + (f' of {len(accounts)} accounts' if accounts else ''),
+                **report,
+                write_stats=write_stats,
+                api_stats=api_stats(),
+                checkpoint=checkpoint.summary(event)
+            ))
         }
-        
+
     except Exception as e:
         print(f"Error analyzing S3 buckets: {str(e)}")
+        if output:
+            output.abort()
         return {
             'statusCode': 500,
             'body': json.dumps({
                 'error': str(e)
             })
         }
+    finally:
+        # One set of EMF metrics per invocation
+        emit_metrics('s3', output.count if output else None)
 
 
-def get_bucket_size(cloudwatch, bucket_name):
-    """Get bucket size in bytes and number of objects from CloudWatch."""
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=1)
-    
+def analyze_buckets(clients, sink, output, prices, checkpoint, executor, incremental=False, resource_ids=None,
+                    metric_cache=False, rollups=None, account=None):
+    """Analyze the buckets of an account (the own one by default), or only `resource_ids` for a shard."""
+    dynamodb = clients.client('dynamodb')
+    scan_clients = account_clients(clients, account)
+    # Severity, issue and recommendation from the rules file (see cost_optimizer.rules)
+    rules = shared_rules(clients)
+    state = ScanState(dynamodb, account_id=account_id(account)) if incremental else None
+    # Per metric region; closed days of metrics come from earlier runs
+    metric_caches = {} if metric_cache else None
+    emitter = FindingEmitter(sink, output, state, rollups, account_id(account), timestamp=checkpoint.timestamp)
+    # Checkpoint key and log label, with the account when scanning another
+    target = scope('global', account)
+    api_calls = 0
+    metric_regions = set()
+    # Block Public Access settings of the whole account, read once
+    account_block = get_account_public_access_block(scan_clients, account)
+
+    def enrich(batch):
+        # Incremental mode skips buckets analyzed recently (see bucket_config)
+        if state:
+            batch = state.changed(batch, bucket_key, bucket_config)
+
+        # Analyze the buckets in this batch in parallel
+        bucket_details = list(executor.map(
+            lambda bucket: get_bucket_details(scan_clients, bucket['Name'], account_block), batch
+        ))
+
+        # Bucket size, object count and request metrics are fetched per batch and
+        # region, since S3 metrics live in the bucket's own region
+        metrics_by_region = {}
+        for bucket, details in zip(batch, bucket_details):
+            region = details['client_region']
+            if region not in metrics_by_region:
+                cache = None
+                if metric_caches is not None:
+                    cache = metric_caches.setdefault(
+                        region, MetricDayCache(dynamodb, region, account_id=account_id(account))
+                    )
+                metrics_by_region[region] = MetricQueryEngine(
+                    scan_clients.client('cloudwatch', region), days=7, cache=cache
+                )
+            queue_bucket_metrics(
+                metrics_by_region[region], bucket['Name'],
+                storage_types=details['inventory'] is None
+            )
+        for metrics in metrics_by_region.values():
+            metrics.resolve()
+        return batch, bucket_details, metrics_by_region
+
+    def evaluate(enriched):
+        nonlocal api_calls
+        batch, bucket_details, metrics_by_region = enriched
+        api_calls += sum(metrics.api_calls for metrics in metrics_by_region.values())
+        metric_regions.update(metrics_by_region)
+        findings = rules.apply([
+            build_bucket_finding(bucket, details, metrics_by_region[details['client_region']], prices)
+            for bucket, details in zip(batch, bucket_details)
+        ])
+        if state:
+            state.record_unreported(map(bucket_key, batch), findings)
+        return findings
+
+    # Stream all S3 buckets page by page, from the checkpoint when resuming
+    cursor = checkpoint.cursor(target)
+    s3 = scan_clients.client('s3')
+    if run_pipeline(
+        chunked(iter_buckets(s3, cursor=cursor, names=resource_ids), BATCH_SIZE), enrich, evaluate, emitter,
+        **checkpoint.tracking(target, cursor)
+    ):
+        checkpoint.finish(target)
+
+    print(f"Fetched metrics for {emitter.count} buckets of {target} in {len(metric_regions)} regions "
+          f"with {api_calls} GetMetricData calls")
+    if state:
+        print(f"Incremental scan of {target}: {state.stats()}")
+    for region, cache in (metric_caches or {}).items():
+        print(f"Metric cache for {region}: {cache.stats()}")
+    return emitter.count
+
+
+def shard_resources(s3):
+    """Bucket names with their weight for a sharded scan."""
+    return [(bucket['Name'], BUCKET_WEIGHT) for bucket in iter_buckets(s3)]
+
+
+def bucket_key(bucket):
+    """Scan state key for a bucket."""
+    return f"S3#{bucket['Name']}"
+
+
+def bucket_config(bucket):
+    """
+    Configuration attributes that decide whether a bucket needs a full scan.
+    list_buckets only exposes the name and creation date, so other config
+    changes are picked up when the state record reaches its max age.
+    """
+    return {
+        'name': bucket['Name'],
+        'creation_date': bucket['CreationDate']
+    }
+
+
+def get_bucket_details(clients, bucket_name, account_block=None):
+    """Get region, storage classes, versioning and public access for a bucket."""
+    debug(f"Analyzing S3 bucket: {bucket_name}")
+
+    # Get bucket region
     try:
-        # Get bucket size
-        size_response = cloudwatch.get_metric_statistics(
-            Namespace='AWS/S3',
-            MetricName='BucketSizeBytes',
-            Dimensions=[
-                {'Name': 'BucketName', 'Value': bucket_name},
-                {'Name': 'StorageType', 'Value': 'StandardStorage'}
-            ],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=86400,
-            Statistics=['Average']
-        )
-        
-        bucket_size = 0
-        if size_response['Datapoints']:
-            bucket_size = size_response['Datapoints'][0]['Average']
-        
-        # Get object count
-        count_response = cloudwatch.get_metric_statistics(
-            Namespace='AWS/S3',
-            MetricName='NumberOfObjects',
-            Dimensions=[
-                {'Name': 'BucketName', 'Value': bucket_name},
-                {'Name': 'StorageType', 'Value': 'AllStorageTypes'}
-            ],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=86400,
-            Statistics=['Average']
-        )
-        
-        object_count = 0
-        if count_response['Datapoints']:
-            object_count = int(count_response['Datapoints'][0]['Average'])
-        
-        return bucket_size, object_count
-        
+        location = clients.client('s3').get_bucket_location(Bucket=bucket_name)
+        region = location['LocationConstraint'] or 'us-east-1'
     except Exception as e:
-        print(f"Error getting bucket size for {bucket_name}: {str(e)}")
-        return 0, 0
+        debug(f"Error getting location for {bucket_name}: {str(e)}")
+        region = 'unknown'
+
+    # Talk to the bucket in its own region, falling back to the default one
+    client_region = region if region != 'unknown' else clients.region
+    s3 = clients.client('s3', client_region)
+
+    # Storage class breakdown
+    inventory = None
+    storage_classes = {}
+    if STORAGE_BREAKDOWN == 'listing':
+        storage_classes = get_storage_class_breakdown(s3, bucket_name)
+    else:
+        try:
+            inventory = get_inventory_breakdown(s3, bucket_name)
+        except Exception as e:
+            debug(f"Error reading inventory for {bucket_name}: {str(e)}")
+
+    versioning_enabled, versioning_check_failed = get_versioning_status(s3, bucket_name)
+    is_public, public_check_failed = check_public_access(s3, bucket_name, account_block)
+    return {
+        'region': region,
+        'client_region': client_region,
+        'inventory': inventory,
+        'storage_classes': storage_classes,
+        'versioning_enabled': versioning_enabled,
+        'versioning_check_failed': versioning_check_failed,
+        'is_public': is_public,
+        'public_check_failed': public_check_failed
+    }
+
+
+def build_bucket_finding(bucket, details, metrics, prices):
+    """Build the finding for a bucket from its details, resolved metrics and prices."""
+    bucket_name = bucket['Name']
+    creation_date = bucket['CreationDate']
+
+    # Bytes per storage class from S3 Inventory when available, else CloudWatch
+    inventory = details['inventory']
+    if inventory:
+        class_bytes = inventory.class_bytes()
+        storage_classes = inventory.class_objects()
+        object_count = inventory.objects
+        top_prefixes = [
+            {'prefix': prefix, 'objects': objects, 'size_gb': round(size / (1024**3), 2)}
+            for prefix, objects, size in inventory.top_prefixes()
+        ]
+        breakdown_source = 'inventory'
+    else:
+        class_bytes = get_storage_class_bytes(metrics, bucket_name)
+        storage_classes = details['storage_classes']
+        object_count = int(metrics.latest(bucket_name, 'NumberOfObjects'))
+        top_prefixes = []
+        breakdown_source = 'cloudwatch'
+
+    bucket_size_bytes = sum(class_bytes.values())
+    bucket_size_gb = bucket_size_bytes / (1024**3)
+    get_requests = metrics.sum(bucket_name, 'GetRequests')
+    put_requests = metrics.sum(bucket_name, 'PutRequests')
+
+    # Calculate bucket age
+    age_days = (datetime.now(creation_date.tzinfo) - creation_date).days
+
+    # Without request metrics there is no telling whether the bucket is read
+    metrics_failed = metrics.failed(bucket_name)
+    monthly_cost, monthly_savings = bucket_monthly_cost(
+        prices, details['region'], class_bytes, None if metrics_failed else get_requests
+    )
+
+    # Record the bucket with metrics
+    return Finding(
+        resource_id=bucket_name,
+        resource_type='S3',
+        issue='s3_bucket',
+        severity='info',
+        details=f'S3 Bucket: {bucket_name}',
+        recommendation=f'Size: {bucket_size_gb:.2f}GB, Objects: {object_count:,}',
+        metadata={
+            'bucket_name': bucket_name,
+            'region': details['region'],
+            'age_days': age_days,
+            'size_gb': round(bucket_size_gb, 2),
+            'object_count': object_count,
+            'storage_classes': storage_classes,
+            'storage_class_gb': {
+                storage_class: round(size / (1024**3), 2)
+                for storage_class, size in class_bytes.items()
+            },
+            'storage_breakdown_source': breakdown_source,
+            'top_prefixes': top_prefixes,
+            'versioning_enabled': details['versioning_enabled'],
+            'versioning_check_failed': details['versioning_check_failed'],
+            'is_public': details['is_public'],
+            'public_check_failed': details['public_check_failed'],
+            'get_requests_7d': int(get_requests),
+            'put_requests_7d': int(put_requests),
+            'metrics_failed': metrics_failed,
+            'creation_date': creation_date.isoformat()
+        },
+        monthly_cost=monthly_cost,
+        monthly_savings=monthly_savings
+    )
+
+
+def bucket_monthly_cost(prices, region, class_bytes, get_requests):
+    """
+    Storage cost of a bucket's storage classes, and what moving STANDARD data
+    of a bucket without GET requests to STANDARD_IA would save (none when
+    `get_requests` is unknown). (None, None) when a storage class has no price.
+    """
+    standard_price = prices.monthly('s3', region, 'STANDARD')
+    if standard_price is None:
+        return None, None
+
+    monthly_cost = 0.0
+    for storage_class, size in class_bytes.items():
+        gb_price = prices.monthly('s3', region, storage_class)
+        if gb_price is None:
+            return None, None
+        monthly_cost += size / (1024**3) * gb_price
+
+    monthly_savings = 0.0
+    standard_gb = class_bytes.get('STANDARD', 0) / (1024**3)
+    if standard_gb and get_requests == 0:
+        infrequent_price = prices.monthly('s3', region, 'STANDARD_IA')
+        if infrequent_price is not None:
+            monthly_savings = max(standard_gb * (standard_price - infrequent_price), 0.0)
+    return monthly_cost, monthly_savings
+
+
+def queue_bucket_metrics(metrics, bucket_name, storage_types=True):
+    """Queue bucket size per storage type, object count and GET/PUT request queries for a bucket."""
+    if storage_types:
+        for storage_type in STORAGE_TYPE_CLASSES:
+            metrics.add(bucket_name, 'AWS/S3', 'BucketSizeBytes', [
+                {'Name': 'BucketName', 'Value': bucket_name},
+                {'Name': 'StorageType', 'Value': storage_type}
+            ], 'Average', key=f'BucketSizeBytes:{storage_type}')
+    metrics.add(bucket_name, 'AWS/S3', 'NumberOfObjects', [
+        {'Name': 'BucketName', 'Value': bucket_name},
+        {'Name': 'StorageType', 'Value': 'AllStorageTypes'}
+    ], 'Average')
+    
+    # Request metrics (last 7 days)
+    for metric_name in ('GetRequests', 'PutRequests'):
+        metrics.add(bucket_name, 'AWS/S3', metric_name, [
+            {'Name': 'BucketName', 'Value': bucket_name}
+        ], 'Sum')
+
+
+def get_storage_class_bytes(metrics, bucket_name):
+    """Bytes per storage class from the per-StorageType BucketSizeBytes metrics."""
+    class_bytes = {}
+    for storage_type, storage_class in STORAGE_TYPE_CLASSES.items():
+        size = metrics.latest(bucket_name, f'BucketSizeBytes:{storage_type}')
+        if size:
+            class_bytes[storage_class] = class_bytes.get(storage_class, 0) + size
+    return class_bytes
 
 
 def get_storage_class_breakdown(s3, bucket_name):
-    """Get breakdown of storage classes in the bucket (sample of first 1000 objects)."""
+    """Get breakdown of storage classes in the bucket (up to MAX_LISTED_OBJECTS objects)."""
     storage_classes = {}
     
     try:
-        response = s3.list_objects_v2(Bucket=bucket_name, MaxKeys=1000)
-        
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                storage_class = obj.get('StorageClass', 'STANDARD')
-                storage_classes[storage_class] = storage_classes.get(storage_class, 0) + 1
+        for obj in iter_objects(s3, bucket_name, max_objects=MAX_LISTED_OBJECTS):
+            storage_class = obj.get('StorageClass', 'STANDARD')
+            storage_classes[storage_class] = storage_classes.get(storage_class, 0) + 1
         
         return storage_classes
         
     except Exception as e:
-        print(f"Error getting storage classes for {bucket_name}: {str(e)}")
+        debug(f"Error getting storage classes for {bucket_name}: {str(e)}")
         return {}
 
 
 def get_versioning_status(s3, bucket_name):
-    """Check if versioning is enabled on the bucket."""
+    """Whether versioning is enabled on the bucket, and whether the check failed."""
     try:
         response = s3.get_bucket_versioning(Bucket=bucket_name)
-        status = response.get('Status', 'Disabled')
-        return status == 'Enabled'
+        return response.get('Status', 'Disabled') == 'Enabled', False
     except Exception as e:
         print(f"Error checking versioning for {bucket_name}: {str(e)}")
-        return False
+        return False, True
 
 
-def check_public_access(s3, bucket_name):
-    """Check if bucket has public access."""
+def get_account_public_access_block(clients, account=None):
+    """
+    The account's Block Public Access settings: {} when it has none, None
+    when they could not be read.
+    """
     try:
-        response = s3.get_public_access_block(Bucket=bucket_name)
-        config = response['PublicAccessBlockConfiguration']
-        
-        # If all public access is blocked, bucket is not public
-        all_blocked = (
-            config.get('BlockPublicAcls', False) and
-            config.get('IgnorePublicAcls', False) and
-            config.get('BlockPublicPolicy', False) and
-            config.get('RestrictPublicBuckets', False)
-        )
-        
-        return not all_blocked
-        
+        if account:
+            owner = account['account_id']
+        else:
+            owner = clients.client('sts').get_caller_identity()['Account']
+        response = clients.client('s3control').get_public_access_block(AccountId=owner)
+        return response['PublicAccessBlockConfiguration']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchPublicAccessBlockConfiguration':
+            return {}
+        print(f"Error checking account public access block: {str(e)}")
     except Exception as e:
-        # If no public access block is configured, assume potentially public
-        print(f"Error checking public access for {bucket_name}: {str(e)}")
-        return True
+        print(f"Error checking account public access block: {str(e)}")
+    return None
 
 
-def get_request_metrics(cloudwatch, bucket_name, metric_name, days=7):
-    """Get total S3 requests (GET or PUT) over the last 7 days."""
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=days)
-    
+def check_public_access(s3, bucket_name, account_block=None):
+    """
+    Whether the bucket may be public - Block Public Access is not fully on
+    for it, counting the account's settings - and whether the check failed.
+    """
     try:
-        response = cloudwatch.get_metric_statistics(
-            Namespace='AWS/S3',
-            MetricName=metric_name,
-            Dimensions=[
-                {'Name': 'BucketName', 'Value': bucket_name}
-            ],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=86400,  # 1 day
-            Statistics=['Sum']
-        )
-        
-        if response['Datapoints']:
-            total_requests = sum(d['Sum'] for d in response['Datapoints'])
-            return total_requests
-        
-        return 0
+        config = s3.get_public_access_block(Bucket=bucket_name)['PublicAccessBlockConfiguration']
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchPublicAccessBlockConfiguration':
+            print(f"Error checking public access for {bucket_name}: {str(e)}")
+            return False, True
+        config = {}
     except Exception as e:
-        print(f"Error getting request metrics for {bucket_name}: {str(e)}")
-        return 0
+        print(f"Error checking public access for {bucket_name}: {str(e)}")
+        return False, True
+
+    # A setting applies when it is on for either the bucket or the account
+    all_blocked = all(
+        config.get(setting, False) or (account_block or {}).get(setting, False)
+        for setting in PUBLIC_ACCESS_BLOCK_SETTINGS
+    )
+    if all_blocked:
+        return False, False
+    if account_block is None:
+        # The account's settings may still block what the bucket's leave open
+        return False, True
+    return True, False
+
 
 if __name__ == "__main__":
     print(lambda_handler({}, {}))
@@ -0,0 +1,454 @@
+import json
+import os
+from datetime import datetime, timezone
+
+from cost_optimizer.accounts import account_clients, account_id, resolve_accounts, scan_accounts, scope
+from cost_optimizer.checkpoint import ScanCheckpoint
+from cost_optimizer.clients import shared_pool
+from cost_optimizer.findings import Finding
+from cost_optimizer.inventory import shared_snapshot
+from cost_optimizer.output import FindingsOutput, to_json
+from cost_optimizer.pipeline import FindingEmitter, run_pipeline
+from cost_optimizer.pricing import shared_index
+from cost_optimizer.ratelimit import api_stats, reset_stats
+from cost_optimizer.rollups import RollupStore, use_rollups
+from cost_optimizer.rules import shared_rules
+from cost_optimizer.sink import FindingSink
+from cost_optimizer.telemetry import debug, emit_metrics, reset_metrics
+from cost_optimizer.regions import resolve_regions, scan_regions
+from cost_optimizer.resources import (
+    chunked, iter_db_instances, iter_db_snapshots, iter_images, iter_snapshots, iter_volumes
+)
+
+# One batch is one describe_snapshots page
+BATCH_SIZE = 1000
+
+# Snapshots older than this (and not backing an AMI) are reported as stale
+STALE_DAYS = int(os.environ.get('SNAPSHOT_STALE_DAYS', '180'))
+
+# Source volume id of snapshots copied from another snapshot or imported
+UNKNOWN_VOLUME_ID = 'vol-ffffffff'
+
+GIB = 1024 ** 3
+
+
+def lambda_handler(event, context):
+    """
+    Analyze EBS and RDS snapshots and Elastic IPs - find orphaned, stale and
+    duplicate snapshots and addresses nothing is using.
+
+    Scans the regions in event['regions'] / SCAN_REGIONS (default: own region),
+    of the accounts in event['accounts'] / SCAN_ACCOUNTS (default: own account).
+    """
+    event = event or {}
+    clients = shared_pool()
+    reset_stats()
+    reset_metrics()
+    dynamodb = clients.client('dynamodb')
+    # Daily per-resource series for trend queries (see cost_optimizer.rollups)
+    rollups = RollupStore(dynamodb) if use_rollups(event) else None
+
+    output = None
+
+    try:
+        regions = resolve_regions(event, clients)
+        accounts = resolve_accounts(event)
+
+        checkpoint = ScanCheckpoint(dynamodb, 'snapshot', event, context)
+        prices = shared_index(clients)
+        output = FindingsOutput(clients, 'snapshot', event, context)
+        checkpoint.restore(output)
+
+        # Findings are written to DynamoDB in batches as they are produced
+        with FindingSink(dynamodb) as sink:
+            def scan(region, account=None):
+                return analyze_region(clients, region, sink, output, prices, checkpoint, rollups, account)
+
+            if accounts:
+                report = {'accounts': scan_accounts(accounts, regions, scan)}
+            else:
+                report = {'regions': scan_regions(regions, scan)}
+        output.close()
+
+        # Only once the findings are written, so a resumed scan never skips any
+        checkpoint.close(clients, output, event, context)
+
+        write_stats = sink.stats()
+        print(f"Wrote {write_stats['items_written']} findings: {write_stats}")
+
+        return {
+            'statusCode': 200,
+            'body': to_json(output.summary(
+                message=f'Found {output.count} unused snapshots and addresses in {len(regions)} regions' + (
+                    f' of {len(accounts)} accounts' if accounts else ''
+                ),
+                **report,
+                write_stats=write_stats,
+                api_stats=api_stats(),
+                checkpoint=checkpoint.summary(event)
+            ))
+        }
+
+    except Exception as e:
+        print(f"Error analyzing snapshots: {str(e)}")
+        if output:
+            output.abort()
+        return {
+            'statusCode': 500,
+            'body': json.dumps({
+                'error': str(e)
+            })
+        }
+    finally:
+        # One set of EMF metrics per invocation
+        emit_metrics('snapshot', output.count if output else None)
+
+
+def analyze_region(clients, region, sink, output, prices, checkpoint, rollups=None, account=None):
+    """
+    Analyze the snapshots and Elastic IPs in one region (of another account).
+
+    The id sets to join against (live volumes and instances, AMI block
+    devices, DB instances) are built once; snapshot listings are then
+    streamed page by page and probed against them, so memory grows with
+    the number of live resources and snapshot lineages, not snapshots.
+    """
+    pool = account_clients(clients, account)
+    ec2 = pool.client('ec2', region)
+    rds = pool.client('rds', region)
+    # Volumes and instances, shared with the EC2 and EBS analyzers
+    inventory = shared_snapshot(clients, region, account=account)
+    # Severity, issue and recommendation from the rules file (see cost_optimizer.rules)
+    rules = shared_rules(clients)
+    emitter = FindingEmitter(sink, output, None, rollups, account_id(account))
+    # Checkpoint key and log label of the region, with the account when scanning another
+    target = scope(region, account)
+    now = datetime.now(timezone.utc)
+
+    if not analyze_ebs_snapshots(ec2, inventory, region, emitter, prices, rules, checkpoint, target, now):
+        return emitter.count
+    if not checkpoint.cursor(f'{target}/addresses').done:
+        # One describe_addresses call returns every address of the region
+        emitter(rules.apply([
+            build_address_finding(address, region, prices, inventory) for address in unused_addresses(ec2, inventory)
+        ]))
+        checkpoint.finish(f'{target}/addresses')
+    analyze_db_snapshots(rds, region, emitter, prices, rules, checkpoint, target, now)
+    return emitter.count
+
+
+def analyze_ebs_snapshots(ec2, inventory, region, emitter, prices, rules, checkpoint, target, now):
+    """Stream the region's EBS snapshots against its volumes and AMIs. False when the scan was stopped."""
+    # The account's own snapshots, from the checkpoint when resuming
+    key = f'{target}/snapshots'
+    cursor = checkpoint.cursor(key)
+    if cursor.done:
+        return True
+    # Lineages need every snapshot of a volume, so only a listing of the region from the start has them all
+    complete = not (cursor.token or cursor.skip)
+
+    ami_snapshots = image_snapshot_ids(ec2)
+    lineages = {}
+    counts = {'snapshots': 0, 'orphaned': 0, 'stale': 0}
+    # Volumes created after the inventory was taken, confirmed live with EC2
+    newer_volumes = set()
+
+    def volume_exists(volume_id):
+        return volume_id in inventory.volume_by_id or volume_id in newer_volumes
+
+    def evaluate(batch):
+        batch = [snapshot for snapshot in batch if snapshot['State'] == 'completed']
+        newer_volumes.update(volumes_since(ec2, batch, inventory))
+        findings = []
+        for snapshot in batch:
+            counts['snapshots'] += 1
+            volume_id = snapshot['VolumeId']
+            image_id = ami_snapshots.get(snapshot['SnapshotId'])
+            if volume_id != UNKNOWN_VOLUME_ID:
+                add_to_lineage(lineages, volume_id, snapshot)
+            issue = snapshot_issue(snapshot, volume_exists(volume_id), image_id, now)
+            if issue:
+                counts[issue.split('_')[0]] += 1
+                findings.append(build_snapshot_finding(snapshot, issue, region, prices, now))
+        return rules.apply(findings)
+
+    if not run_pipeline(
+        chunked(iter_snapshots(ec2, cursor=cursor, page_size=BATCH_SIZE), BATCH_SIZE), lambda batch: batch,
+        evaluate, emitter, **checkpoint.tracking(key, cursor)
+    ):
+        return False
+    checkpoint.finish(key)
+
+    print(f"Joined {counts['snapshots']} snapshots in {target} against {len(inventory.volume_by_id)} volumes "
+          f"and {len(ami_snapshots)} AMI snapshots: {counts['orphaned']} orphaned, {counts['stale']} stale")
+    if complete:
+        emitter(rules.apply([
+            build_lineage_finding(volume_id, lineage, region, prices, volume_exists(volume_id))
+            for volume_id, lineage in lineages.items() if lineage['duplicates']
+        ]))
+    elif lineages:
+        print(f"Skipping snapshot lineages of {target}: the listing was resumed part-way")
+    return True
+
+
+def analyze_db_snapshots(rds, region, emitter, prices, rules, checkpoint, target, now):
+    """Stream the region's manual RDS snapshots against its DB instances."""
+    db_instance_ids = {db['DBInstanceIdentifier'] for db in iter_db_instances(rds)}
+
+    def evaluate(batch):
+        findings = []
+        for snapshot in batch:
+            if snapshot['Status'] != 'available':
+                continue
+            issue = snapshot_issue(
+                snapshot, snapshot['DBInstanceIdentifier'] in db_instance_ids, None, now, 'SnapshotCreateTime'
+            )
+            if issue:
+                findings.append(build_db_snapshot_finding(snapshot, 'db_' + issue, region, prices, now))
+        return rules.apply(findings)
+
+    key = f'{target}/db-snapshots'
+    cursor = checkpoint.cursor(key)
+    if run_pipeline(
+        chunked(iter_db_snapshots(rds, cursor=cursor), BATCH_SIZE), lambda batch: batch, evaluate, emitter,
+        **checkpoint.tracking(key, cursor)
+    ):
+        checkpoint.finish(key)
+
+
+def volumes_since(ec2, snapshots, inventory):
+    """
+    Ids of the live source volumes of snapshots taken after the inventory.
+
+    A volume missing from the inventory, which warm invocations reuse for up
+    to INVENTORY_MAX_AGE_SECONDS (30 minutes by default), may just be newer
+    than it; only snapshots taken before the inventory prove their volume
+    was gone, so the others' volumes are looked up with EC2.
+    """
+    volume_ids = {
+        snapshot['VolumeId'] for snapshot in snapshots
+        if snapshot['VolumeId'] != UNKNOWN_VOLUME_ID and snapshot['VolumeId'] not in inventory.volume_by_id
+        and snapshot['StartTime'].timestamp() >= inventory.created_at
+    }
+    live = set()
+    # At most 200 values per describe_volumes filter
+    for ids in chunked(sorted(volume_ids), 200):
+        live.update(volume['VolumeId'] for volume in iter_volumes(ec2, volume_ids=ids))
+    return live
+
+
+def image_snapshot_ids(ec2):
+    """{snapshot id: AMI id} for the block devices of the account's own AMIs."""
+    snapshots = {}
+    for image in iter_images(ec2):
+        for mapping in image.get('BlockDeviceMappings', []):
+            snapshot_id = mapping.get('Ebs', {}).get('SnapshotId')
+            if snapshot_id:
+                snapshots[snapshot_id] = image['ImageId']
+    return snapshots
+
+
+def snapshot_issue(snapshot, source_exists, image_id, now, time_field='StartTime'):
+    """'orphaned_snapshot', 'stale_snapshot' or None for a snapshot not backing an AMI."""
+    if image_id:
+        # Deleted with the AMI that uses it
+        return None
+    if not source_exists and snapshot.get('VolumeId') != UNKNOWN_VOLUME_ID:
+        return 'orphaned_snapshot'
+    if (now - snapshot[time_field]).days > STALE_DAYS:
+        return 'stale_snapshot'
+    return None
+
+
+def snapshot_storage_gb(snapshot):
+    """
+    Stored size of a snapshot: its full size when EBS reports it, otherwise
+    the source volume's size. Snapshots are incremental, so either is an
+    upper bound on what deleting one snapshot of a lineage frees.
+    """
+    if snapshot.get('FullSnapshotSizeInBytes'):
+        return round(snapshot['FullSnapshotSizeInBytes'] / GIB, 2), 'full_snapshot_size'
+    return snapshot['VolumeSize'], 'volume_size'
+
+
+def add_to_lineage(lineages, volume_id, snapshot):
+    """Count a snapshot into its source volume's lineage: snapshots, days with one, same-day extras."""
+    lineage = lineages.get(volume_id)
+    if lineage is None:
+        lineage = lineages[volume_id] = {
+            'count': 0, 'duplicates': 0, 'duplicate_gb': 0.0, 'days': set(), 'newest': snapshot['StartTime']
+        }
+    day = snapshot['StartTime'].date().toordinal()
+    lineage['count'] += 1
+    if day in lineage['days']:
+        lineage['duplicates'] += 1
+        lineage['duplicate_gb'] += snapshot_storage_gb(snapshot)[0]
+    else:
+        lineage['days'].add(day)
+    lineage['newest'] = max(lineage['newest'], snapshot['StartTime'])
+
+
+def build_snapshot_finding(snapshot, issue, region, prices, now):
+    """Build the finding for an orphaned or stale EBS snapshot."""
+    snapshot_id = snapshot['SnapshotId']
+    volume_id = snapshot['VolumeId']
+    storage_gb, size_source = snapshot_storage_gb(snapshot)
+    tier = snapshot.get('StorageTier', 'standard')
+    age_days = (now - snapshot['StartTime']).days
+
+    debug(f"Flagging EBS snapshot: {snapshot_id} ({issue})")
+
+    monthly_cost = None
+    gb_price = prices.monthly('ebs-snapshot', region, tier)
+    if gb_price is not None:
+        monthly_cost = storage_gb * gb_price
+
+    if issue == 'orphaned_snapshot':
+        severity = 'medium'
+        recommendation = f'Source volume {volume_id} no longer exists and no AMI uses it - delete if not needed'
+    else:
+        severity = 'low'
+        recommendation = (f'{age_days} days old - delete or move to the archive tier'
+                          if tier == 'standard' else f'{age_days} days old - delete if not needed')
+
+    return Finding(
+        resource_id=snapshot_id,
+        resource_type='EBS_SNAPSHOT',
+        issue=issue,
+        severity=severity,
+        details=f'EBS Snapshot: {snapshot_id} of {volume_id} ({storage_gb}GB)',
+        recommendation=recommendation,
+        metadata={
+            'region': region,
+            'volume_id': volume_id,
+            'storage_gb': storage_gb,
+            'size_source': size_source,
+            'volume_size_gb': snapshot['VolumeSize'],
+            'storage_tier': tier,
+            'age_days': age_days,
+            'description': snapshot.get('Description', ''),
+            'start_time': snapshot['StartTime'].isoformat()
+        },
+        monthly_cost=monthly_cost,
+        monthly_savings=monthly_cost
+    )
+
+
+def build_lineage_finding(volume_id, lineage, region, prices, volume_exists):
+    """Build the finding for a volume with more than one snapshot on the same day."""
+    storage_gb = round(lineage['duplicate_gb'], 2)
+    monthly_cost = None
+    gb_price = prices.monthly('ebs-snapshot', region, 'standard')
+    if gb_price is not None:
+        monthly_cost = storage_gb * gb_price
+
+    return Finding(
+        resource_id=volume_id,
+        resource_type='EBS_SNAPSHOT_LINEAGE',
+        issue='duplicate_snapshots',
+        severity='low',
+        details=f"Snapshots of {volume_id}: {lineage['count']} on {len(lineage['days'])} days",
+        recommendation=(f"{lineage['duplicates']} snapshots were taken on a day that already had one - "
+                        f"check for overlapping backup policies"),
+        metadata={
+            'region': region,
+            'volume_exists': volume_exists,
+            'snapshot_count': lineage['count'],
+            'snapshot_days': len(lineage['days']),
+            'duplicate_count': lineage['duplicates'],
+            'storage_gb': storage_gb,
+            'newest_snapshot': lineage['newest'].isoformat()
+        },
+        # Same-day snapshots share most blocks; their own size is an upper bound
+        monthly_cost=monthly_cost,
+        monthly_savings=monthly_cost
+    )
+
+
+def build_db_snapshot_finding(snapshot, issue, region, prices, now):
+    """Build the finding for an orphaned or stale manual RDS snapshot."""
+    snapshot_id = snapshot['DBSnapshotIdentifier']
+    db_instance_id = snapshot['DBInstanceIdentifier']
+    storage_gb = snapshot['AllocatedStorage']
+    age_days = (now - snapshot['SnapshotCreateTime']).days
+
+    debug(f"Flagging RDS snapshot: {snapshot_id} ({issue})")
+
+    monthly_cost = None
+    gb_price = prices.monthly('rds-snapshot', region)
+    if gb_price is not None:
+        monthly_cost = storage_gb * gb_price
+
+    if issue == 'db_orphaned_snapshot':
+        severity = 'medium'
+        recommendation = f'DB instance {db_instance_id} no longer exists - delete if the data is not needed'
+    else:
+        severity = 'low'
+        recommendation = f'{age_days} days old - delete or export to S3'
+
+    return Finding(
+        resource_id=snapshot_id,
+        resource_type='RDS_SNAPSHOT',
+        issue=issue,
+        severity=severity,
+        details=f'RDS Snapshot: {snapshot_id} of {db_instance_id} ({storage_gb}GB)',
+        recommendation=recommendation,
+        metadata={
+            'region': region,
+            'db_instance_id': db_instance_id,
+            'engine': snapshot.get('Engine'),
+            'storage_gb': storage_gb,
+            'age_days': age_days,
+            'create_time': snapshot['SnapshotCreateTime'].isoformat()
+        },
+        monthly_cost=monthly_cost,
+        monthly_savings=monthly_cost
+    )
+
+
+def unused_addresses(ec2, inventory):
+    """Elastic IPs not associated with anything, or associated with a stopped instance."""
+    addresses = []
+    for address in ec2.describe_addresses()['Addresses']:
+        instance_id = address.get('InstanceId')
+        if not address.get('AssociationId') and not address.get('NetworkInterfaceId'):
+            addresses.append(address)
+        elif instance_id and inventory.instance_state(instance_id) == 'stopped':
+            addresses.append(address)
+    return addresses
+
+
+def build_address_finding(address, region, prices, inventory):
+    """Build the finding for an unassociated Elastic IP or one held by a stopped instance."""
+    public_ip = address['PublicIp']
+    instance_id = address.get('InstanceId') or None
+    monthly_cost = prices.monthly('eip', region)
+
+    if instance_id:
+        issue, severity = 'elastic_ip_on_stopped_instance', 'low'
+        recommendation = f'Held by stopped instance {instance_id} - release it if the instance is not needed'
+    else:
+        issue, severity = 'unattached_elastic_ip', 'medium'
+        recommendation = 'Not associated with anything - release the address'
+
+    return Finding(
+        resource_id=address.get('AllocationId', public_ip),
+        resource_type='EIP',
+        issue=issue,
+        severity=severity,
+        details=f'Elastic IP: {public_ip}',
+        recommendation=recommendation,
+        metadata={
+            'region': region,
+            'public_ip': public_ip,
+            'instance_id': instance_id,
+            'instance_state': inventory.instance_state(instance_id) if instance_id else None,
+            'domain': address.get('Domain')
+        },
+        monthly_cost=monthly_cost,
+        monthly_savings=monthly_cost
+    )
+
+
+if __name__ == "__main__":
+    print(lambda_handler({}, {}))
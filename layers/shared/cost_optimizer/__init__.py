@@ -0,0 +1,6 @@
+"""
+Shared helpers for the cost optimizer analyzers.
+
+Packaged as a Lambda layer (see SharedLayer in template.yaml) so every
+analyzer function can import from `cost_optimizer`.
+"""
@@ -0,0 +1,187 @@
+"""
+Organization-wide scan mode: analyze other accounts through assumed roles.
+
+event['accounts'] or SCAN_ACCOUNTS lists the accounts to scan, as account
+ids or role ARNs (a list, or a comma-separated string), or as
+{'account_id' or 'role_arn', 'external_id'} objects. The role is always
+SCAN_ROLE_NAME, the only one the analyzers may assume, so an account id is
+enough. Each role is assumed with STS from the analyzer's own account and
+gets its own ClientPool, whose credentials refresh themselves before they
+expire. Pools (and so credentials) are kept across warm invocations.
+
+Every (account, region) pair is scanned on one bounded worker pool. The
+analyzer's own account keeps the findings table, scan state, caches and
+artifacts; findings are tagged with the account they belong to.
+
+Usage in a handler:
+    accounts = resolve_accounts(event)
+    if accounts:
+        account_report = scan_accounts(accounts, regions, lambda region, account: analyze_region(..., account=account))
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from cost_optimizer.clients import ClientPool
+from cost_optimizer.regions import scan_regions
+
+# (account, region) pairs scanned at the same time
+DEFAULT_ACCOUNT_WORKERS = int(os.environ.get('ACCOUNT_WORKERS', '16'))
+
+# Lifetime of assumed-role credentials; they are refreshed well before it ends
+ASSUME_ROLE_DURATION_SECONDS = int(os.environ.get('ASSUME_ROLE_DURATION_SECONDS', '3600'))
+
+SESSION_NAME = os.environ.get('ASSUME_ROLE_SESSION_NAME', 'cost-optimizer')
+
+# Role assumed in every scanned account; the execution role may assume no other (ScanRoleName)
+SCAN_ROLE_NAME = os.environ.get('SCAN_ROLE_NAME', 'CostOptimizerScanRole')
+
+
+def parse_account(value, role_name=SCAN_ROLE_NAME):
+    """
+    An account from an account id, a role ARN or an {'account_id' or
+    'role_arn', 'external_id'} object. Role ARNs must name `role_name`.
+    """
+    if isinstance(value, str):
+        value = {'role_arn': value} if value.startswith('arn:') else {'account_id': value}
+    account = dict(value)
+
+    if 'role_arn' not in account:
+        account_id = str(account.get('account_id', ''))
+        if len(account_id) != 12 or not account_id.isdigit():
+            raise ValueError(f"Not an account id: {account_id}")
+        account['account_id'] = account_id
+        account['role_arn'] = f'arn:aws:iam::{account_id}:role/{role_name}'
+        return account
+
+    # arn:aws:iam::123456789012:role/Name
+    parts = account['role_arn'].split(':')
+    if len(parts) < 6 or parts[2] != 'iam' or not parts[5].startswith('role/'):
+        raise ValueError(f"Not a role ARN: {account['role_arn']}")
+    if parts[5] != f'role/{role_name}':
+        # Assuming it would fail with AccessDenied in the middle of the scan
+        raise ValueError(f"Role {account['role_arn']} is not the scan role {role_name}")
+    account['account_id'] = parts[4]
+    return account
+
+
+def resolve_accounts(event):
+    """
+    Accounts to scan from event['accounts'] or SCAN_ACCOUNTS (JSON list or
+    comma-separated account ids or role ARNs). Empty when only the
+    analyzer's own account is scanned. A shard worker scans its shard's
+    account only.
+    """
+    shard = event.get('shard')
+    if shard:
+        return [shard['account']] if shard.get('account') else []
+
+    accounts = event.get('accounts') or os.environ.get('SCAN_ACCOUNTS', '')
+    if isinstance(accounts, str):
+        accounts = accounts.strip()
+        if accounts.startswith('['):
+            accounts = json.loads(accounts)
+        else:
+            accounts = [arn.strip() for arn in accounts.split(',') if arn.strip()]
+    return [parse_account(account) for account in accounts]
+
+
+def account_id(account):
+    """Id of an account to scan, None for the analyzer's own account."""
+    return account['account_id'] if account else None
+
+
+def scope(region, account=None):
+    """Key of a region of an account, for checkpoints and caches: 'us-east-1' or '123456789012/us-east-1'."""
+    return f"{account['account_id']}/{region}" if account else region
+
+
+def assumed_role_session(sts, role_arn, external_id=None, region=None,
+                         duration_seconds=ASSUME_ROLE_DURATION_SECONDS):
+    """
+    A boto3 session on a role's credentials, assumed with the `sts` client
+    and assumed again by botocore shortly before they expire.
+    """
+    import boto3
+    import botocore.session
+    from botocore.credentials import CredentialProvider, CredentialResolver, RefreshableCredentials
+
+    def assume():
+        params = {'RoleArn': role_arn, 'RoleSessionName': SESSION_NAME, 'DurationSeconds': duration_seconds}
+        if external_id:
+            params['ExternalId'] = external_id
+        credentials = sts.assume_role(**params)['Credentials']
+        expiration = credentials['Expiration']
+        if not isinstance(expiration, datetime):
+            expiration = datetime.now(timezone.utc) + timedelta(seconds=duration_seconds)
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': expiration.isoformat()
+        }
+
+    # Assumed once up front, so a role that cannot be assumed fails here
+    credentials = RefreshableCredentials.create_from_metadata(
+        metadata=assume(), refresh_using=assume, method='sts-assume-role'
+    )
+
+    class AssumedRoleProvider(CredentialProvider):
+        METHOD = 'sts-assume-role'
+
+        def load(self):
+            return credentials
+
+    # The role's credentials are the session's only credential source
+    session = botocore.session.Session()
+    session.register_component('credential_provider', CredentialResolver([AssumedRoleProvider()]))
+    return boto3.session.Session(botocore_session=session, region_name=region)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_role_locks = {}
+
+
+def account_clients(clients, account):
+    """
+    The ClientPool of an account to scan (`clients` itself for the
+    analyzer's own account), assuming its role on first use. Pools are
+    shared by every thread and kept for the life of the container.
+    """
+    if not account:
+        return clients
+    key = (account['role_arn'], account.get('external_id'))
+    pool = _pools.get(key)
+    if pool is not None:
+        return pool
+
+    with _pools_lock:
+        lock = _role_locks.setdefault(key, threading.Lock())
+    with lock:
+        pool = _pools.get(key)
+        if pool is None:
+            session = assumed_role_session(
+                clients.client('sts'), account['role_arn'], account.get('external_id'), clients.region
+            )
+            pool = ClientPool(session, clients.max_pool_connections, account_id=account['account_id'])
+            _pools[key] = pool
+    return pool
+
+
+def scan_accounts(accounts, regions, analyze_region, max_workers=DEFAULT_ACCOUNT_WORKERS):
+    """
+    Call analyze_region(region, account) for every account and region on
+    one worker pool of `max_workers`. Returns {account_id: {region: report}}
+    with each region's findings count, wall time and error (if any); an
+    account whose role cannot be assumed reports the error in every region.
+    """
+    targets = {scope(region, account): (region, account) for account in accounts for region in regions}
+    report = scan_regions(list(targets), lambda target: analyze_region(*targets[target]), max_workers)
+
+    account_report = {}
+    for target, region_report in sorted(report.items()):
+        region, account = targets[target]
+        account_report.setdefault(account['account_id'], {})[region] = region_report
+    return account_report
@@ -0,0 +1,211 @@
+"""
+Time-budget checkpointing for resumable scans.
+
+A scan that would run into the Lambda timeout stops a little before it
+(CHECKPOINT_RESERVE_SECONDS), and saves a checkpoint in the scan state table:
+a listing cursor per region (page token plus resources already taken from
+that page) and the partial findings totals. A follow-up invocation with
+event['resume'] set to the scan id picks up right after the last batch whose
+findings were written, so no resource is analyzed twice or skipped.
+
+Deployed analyzers invoke themselves asynchronously to continue
+(CHECKPOINT_AUTO_RESUME). Locally, run_locally() does the same with a
+FakeContext:
+
+    responses = run_locally(lambda_handler, {'regions': ['us-east-1']}, budget_seconds=5)
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from cost_optimizer.resources import ListingCursor
+from cost_optimizer.state import DEFAULT_STATE_TABLE
+
+# Stop this long before the deadline to flush findings and save the checkpoint
+DEFAULT_RESERVE_SECONDS = float(os.environ.get('CHECKPOINT_RESERVE_SECONDS', '30'))
+
+# Give up continuing a scan after this many invocations
+MAX_INVOCATIONS = int(os.environ.get('CHECKPOINT_MAX_INVOCATIONS', '20'))
+
+AUTO_RESUME = os.environ.get('CHECKPOINT_AUTO_RESUME', 'true').lower() in ('1', 'true', 'yes')
+
+# Checkpoints of abandoned scans expire through the state table's TTL
+CHECKPOINT_TTL_SECONDS = 7 * 86400
+
+
+class TimeBudget:
+    """Remaining invocation time from the Lambda context, minus a reserve."""
+
+    def __init__(self, context=None, reserve_seconds=DEFAULT_RESERVE_SECONDS):
+        self.context = context
+        self.reserve_seconds = reserve_seconds
+
+    def remaining_seconds(self):
+        """Seconds left before the reserve, None without a Lambda context."""
+        get_remaining = getattr(self.context, 'get_remaining_time_in_millis', None)
+        if get_remaining is None:
+            return None
+        return get_remaining() / 1000.0 - self.reserve_seconds
+
+    def expired(self):
+        remaining = self.remaining_seconds()
+        return remaining is not None and remaining <= 0
+
+
+class FakeContext:
+    """Stand-in for the Lambda context with a wall-clock time budget, for local runs."""
+
+    def __init__(self, budget_seconds, request_id=None):
+        self.deadline = time.monotonic() + budget_seconds
+        self.aws_request_id = request_id or uuid.uuid4().hex
+        self.invoked_function_arn = None
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self.deadline - time.monotonic()) * 1000))
+
+
+class ScanCheckpoint:
+    """
+    Track how far a scan got and save or continue it when time runs out.
+
+    Usage:
+        checkpoint = ScanCheckpoint(dynamodb, 'ec2', event, context)
+        checkpoint.restore(output)
+        ...per region:
+            cursor = checkpoint.cursor(region)
+            if run_pipeline(chunked(iter_instances(ec2, cursor=cursor), n), ...,
+                            **checkpoint.tracking(region, cursor)):
+                checkpoint.finish(region)
+        ...after the sink is flushed and the output closed:
+        checkpoint.close(clients, output, event, context)
+    """
+
+    def __init__(self, dynamodb, analyzer, event, context=None, table_name=DEFAULT_STATE_TABLE):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        reserve = float(event.get('checkpoint_reserve_seconds', DEFAULT_RESERVE_SECONDS))
+        self.budget = TimeBudget(context, reserve)
+        self.resumed = bool(event.get('resume'))
+        self.scan_id = event.get('resume') or getattr(context, 'aws_request_id', None) or uuid.uuid4().hex
+        self.key = f'CHECKPOINT#{analyzer}#{self.scan_id}'
+        # Shard findings carry their fan-out's start time, so a shard that runs again overwrites them
+        self.timestamp = (event.get('shard') or {}).get('timestamp')
+        self.interrupted = False
+        self.continued = False
+        self._lock = threading.Lock()
+
+        self.data = {'invocation': 1, 'regions': {}, 'output': None}
+        if self.resumed:
+            self.data = self.load()
+            self.data['invocation'] += 1
+
+    def load(self):
+        """Fetch the saved checkpoint of the scan being resumed."""
+        response = self.dynamodb.get_item(TableName=self.table_name, Key={'id': {'S': self.key}})
+        if 'Item' not in response:
+            # Starting over would duplicate the findings already written
+            raise ValueError(f'No checkpoint for scan {self.scan_id}')
+        return json.loads(response['Item']['checkpoint']['S'])
+
+    def restore(self, output):
+        """Carry the findings totals of earlier invocations over to this one's output."""
+        if self.data['output']:
+            output.restore(self.data['output'])
+
+    def cursor(self, region):
+        """Listing cursor to resume a region's resources from."""
+        return ListingCursor(self.data['regions'].get(region))
+
+    def tracking(self, region, cursor):
+        """run_pipeline() keyword arguments that keep the region's position up to date."""
+        return {
+            'position': cursor.position,
+            'on_emitted': lambda position: self.update(region, position),
+            'should_stop': self.should_stop
+        }
+
+    def update(self, region, position):
+        with self._lock:
+            self.data['regions'][region] = position
+
+    def finish(self, region):
+        """Mark every resource of a region as analyzed."""
+        self.update(region, {'token': None, 'skip': 0, 'done': True})
+
+    def should_stop(self):
+        """True once the time budget is spent; the scan then ends early."""
+        if not self.interrupted and self.budget.expired():
+            print(f"Time budget spent, checkpointing scan {self.scan_id}")
+            self.interrupted = True
+        return self.interrupted
+
+    def close(self, clients, output, event, context=None):
+        """
+        Save the checkpoint and schedule the next invocation when the scan was
+        interrupted, or drop the checkpoint of a resumed scan that completed.
+        Call once the findings of the emitted batches are written.
+        """
+        if not self.interrupted:
+            if self.resumed:
+                self.dynamodb.delete_item(TableName=self.table_name, Key={'id': {'S': self.key}})
+            return
+
+        self.data['output'] = output.checkpoint()
+        self.dynamodb.put_item(TableName=self.table_name, Item={
+            'id': {'S': self.key},
+            'checkpoint': {'S': json.dumps(self.data)},
+            'expires_at': {'N': str(int(time.time()) + CHECKPOINT_TTL_SECONDS)}
+        })
+
+        function_arn = getattr(context, 'invoked_function_arn', None)
+        # Shard workers are continued by their coordinator (see cost_optimizer.fanout)
+        if not AUTO_RESUME or not function_arn or event.get('shard'):
+            return
+        if self.data['invocation'] >= MAX_INVOCATIONS:
+            print(f"Scan {self.scan_id} not continued after {self.data['invocation']} invocations")
+            return
+        try:
+            clients.client('lambda').invoke(
+                FunctionName=function_arn,
+                InvocationType='Event',
+                Payload=json.dumps(self.resume_event(event)).encode()
+            )
+            self.continued = True
+        except Exception as e:
+            print(f"Error continuing scan {self.scan_id}: {str(e)}")
+
+    def resume_event(self, event):
+        """The event that continues this scan."""
+        return dict(event, resume=self.scan_id)
+
+    def summary(self, event):
+        """Response body field describing the checkpoint."""
+        summary = {
+            'scan_id': self.scan_id,
+            'invocation': self.data['invocation'],
+            'status': 'interrupted' if self.interrupted else 'complete'
+        }
+        if self.interrupted:
+            summary['continued'] = self.continued
+            summary['resume_event'] = self.resume_event(event)
+        return summary
+
+
+def run_locally(handler, event=None, budget_seconds=60, max_invocations=MAX_INVOCATIONS):
+    """
+    Run a handler with a FakeContext of `budget_seconds`, resuming it until
+    the scan completes. Returns the parsed response bodies.
+    """
+    event = dict(event or {})
+    bodies = []
+    for _ in range(max_invocations):
+        response = handler(event, FakeContext(budget_seconds))
+        body = json.loads(response['body'])
+        bodies.append(body)
+        checkpoint = body.get('checkpoint') or {}
+        if response['statusCode'] != 200 or checkpoint.get('status') != 'interrupted':
+            break
+        event = checkpoint['resume_event']
+    return bodies
@@ -0,0 +1,79 @@
+import threading
+
+import boto3
+from botocore.config import Config
+
+from cost_optimizer import ratelimit, telemetry
+
+# Synchronous Lambda invokes wait for the whole run of the invoked function
+SERVICE_READ_TIMEOUTS = {'lambda': 900}
+
+
+class ClientPool:
+    """
+    Lazily create boto3 clients per (service, region) and reuse them.
+
+    boto3 clients are thread-safe once built, but building them from a shared
+    session is not, so creation happens under a lock. Every client is paced
+    by the shared rate limiter of its service and region, which also owns
+    retries (see cost_optimizer.ratelimit), and instrumented by
+    cost_optimizer.telemetry.
+
+    Usage:
+        clients = ClientPool(max_pool_connections=32)
+        s3 = clients.client('s3', 'eu-west-1')
+    """
+
+    def __init__(self, session=None, max_pool_connections=10, account_id=None):
+        self._session = session or boto3.session.Session()
+        self.max_pool_connections = max_pool_connections
+        # Set for pools on another account's credentials, which get their own rate limiters
+        self.account_id = account_id
+        self._config = Config(
+            max_pool_connections=max_pool_connections,
+            retries={'mode': 'standard', 'total_max_attempts': 1}
+        )
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    @property
+    def region(self):
+        """The session's default region."""
+        return self._session.region_name
+
+    def client(self, service, region=None):
+        """Return the cached client for a service and region, creating it on first use."""
+        key = (service, region or self.region)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    config = self._config
+                    if service in SERVICE_READ_TIMEOUTS:
+                        config = config.merge(Config(read_timeout=SERVICE_READ_TIMEOUTS[service]))
+                    client = self._session.client(service, region_name=key[1], config=config)
+                    ratelimit.attach(client, service, key[1], self.account_id)
+                    telemetry.attach(client)
+                    self._clients[key] = client
+        return client
+
+
+_shared_pools = {}
+_shared_lock = threading.Lock()
+
+
+def shared_pool(max_pool_connections=10):
+    """
+    Return a module-scope ClientPool that lives for the life of the Lambda
+    container, so warm invocations reuse the session, endpoint data and
+    clients built by earlier ones.
+    """
+    pool = _shared_pools.get(max_pool_connections)
+    if pool is None:
+        with _shared_lock:
+            pool = _shared_pools.get(max_pool_connections)
+            if pool is None:
+                pool = ClientPool(max_pool_connections=max_pool_connections)
+                _shared_pools[max_pool_connections] = pool
+    return pool
@@ -0,0 +1,563 @@
+"""
+Sharded fan-out for very large fleets.
+
+A coordinator invocation only lists resource ids (cheap describe/list
+calls), splits them into shards of about equal weight and has workers
+analyze the shards in parallel. Workers are asynchronous invocations of the
+analyzer function itself with event['shard'] set, or handler calls on a
+local thread pool when there is no function to invoke (local runs and
+tests). Wall time then follows the slowest shard rather than the fleet size.
+
+The coordinator never waits on a worker. Every shard has an item in the scan
+state table with the event to run it with, its status and, once a worker
+returns, its report (see shard_worker). The coordinator polls these items
+and keeps up to SHARD_WORKERS shards running. Failed and lost shards are run
+again, and shards whose worker ran out of time are continued from their
+checkpoint (see cost_optimizer.checkpoint). When the coordinator's own time
+budget is spent it continues in a new invocation with
+event['fan_out_resume'], and the reports collected so far stay in the table.
+
+All findings of a fan-out are stamped with its start time, so a shard that
+runs again overwrites the items it already wrote, and only the report of
+its latest attempt is merged. When scanning other accounts (see
+cost_optimizer.accounts), every account's regions are listed and sharded,
+and each shard carries its account.
+
+Usage in a handler:
+    @shard_worker
+    def lambda_handler(event, context):
+        if is_fan_out(event):
+            return coordinate(clients, 'ec2', event, context, regions, list_resources, lambda_handler)
+"""
+import functools
+import heapq
+import json
+import math
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from cost_optimizer.accounts import scope
+from cost_optimizer.checkpoint import CHECKPOINT_TTL_SECONDS, DEFAULT_RESERVE_SECONDS, MAX_INVOCATIONS, TimeBudget
+from cost_optimizer.clients import shared_pool
+from cost_optimizer.output import merge_aggregates, to_json
+from cost_optimizer.state import DEFAULT_STATE_TABLE, MAX_KEYS_PER_GET
+from cost_optimizer.sink import FindingSink
+
+# Target shard weight; weights are roughly API calls per resource
+DEFAULT_SHARD_WEIGHT = float(os.environ.get('SHARD_WEIGHT', '600'))
+
+# describe_* filters take at most 200 values, so a worker can list its shard in one go
+MAX_SHARD_RESOURCES = 200
+
+DEFAULT_SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', '32'))
+MAX_SHARD_ATTEMPTS = int(os.environ.get('SHARD_MAX_ATTEMPTS', '3'))
+
+# How often the coordinator reads the shard items
+POLL_SECONDS = float(os.environ.get('SHARD_POLL_SECONDS', '5'))
+
+# A running shard whose worker has not reported for this long is run again
+# (the function timeout plus a margin, Lambda's own retries heartbeat too)
+SHARD_TIMEOUT_SECONDS = float(os.environ.get('SHARD_TIMEOUT_SECONDS', '360'))
+
+# Options of the coordinator's event that are passed on to the workers
+WORKER_EVENT_KEYS = (
+    'incremental', 'metric_cache', 'rollups', 'output', 'page_size', 'concurrency', 'checkpoint_reserve_seconds'
+)
+
+# Shard statuses that need nothing more from the coordinator
+SETTLED = ('complete', 'error')
+
+
+def is_fan_out(event):
+    """Check event['fan_out'] or FAN_OUT for coordinator mode (never for a shard worker)."""
+    if event.get('shard'):
+        return False
+    value = event.get('fan_out', os.environ.get('FAN_OUT', 'false'))
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def shard_ids(event):
+    """The resource ids a shard worker should analyze, None outside a shard."""
+    shard = event.get('shard')
+    return shard['ids'] if shard else None
+
+
+def plan_shards(resources, shard_weight=DEFAULT_SHARD_WEIGHT, max_resources=MAX_SHARD_RESOURCES):
+    """
+    Split {region: [(resource_id, weight), ...]} into shards of about
+    `shard_weight` and at most `max_resources` ids. Within a region the
+    heaviest resources are placed first, each on the lightest shard, so
+    shards differ by at most about one resource's weight.
+
+    Returns a list of {'shard_id', 'region', 'ids', 'weight'}.
+    """
+    shards = []
+    for region, items in sorted(resources.items()):
+        if not items:
+            continue
+        total = sum(weight for _, weight in items)
+        count = max(math.ceil(total / shard_weight), math.ceil(len(items) / max_resources), 1)
+
+        # (weight, index, ids) per shard, lightest first
+        open_shards = [(0.0, index, []) for index in range(count)]
+        full_shards = []
+        for resource_id, weight in sorted(items, key=lambda item: -item[1]):
+            load, index, ids = heapq.heappop(open_shards)
+            ids.append(resource_id)
+            if len(ids) < max_resources:
+                heapq.heappush(open_shards, (load + weight, index, ids))
+            else:
+                full_shards.append((load + weight, index, ids))
+
+        for load, index, ids in sorted(open_shards + full_shards, key=lambda shard: shard[1]):
+            if ids:
+                shards.append({'shard_id': f'{region}-{index}', 'region': region, 'ids': ids, 'weight': load})
+    return shards
+
+
+class LambdaInvoker:
+    """Start a shard on an asynchronous invocation of a Lambda function."""
+
+    def __init__(self, lambda_client, function_name):
+        self.lambda_client = lambda_client
+        self.function_name = function_name
+
+    def __call__(self, event):
+        self.lambda_client.invoke(
+            FunctionName=self.function_name,
+            InvocationType='Event',
+            Payload=to_json(event).encode()
+        )
+
+
+_local_executor = None
+
+
+class LocalInvoker:
+    """Start a shard on a local thread pool by calling the handler, for local runs and tests."""
+
+    def __init__(self, handler, max_workers=DEFAULT_SHARD_WORKERS):
+        global _local_executor
+        self.handler = handler
+        # Shared across invocations, so shards outlive a coordinator that continues
+        if _local_executor is None:
+            _local_executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __call__(self, event):
+        _local_executor.submit(self.handler, json.loads(to_json(event)), None)
+
+
+def shard_worker(handler):
+    """
+    Decorate an analyzer handler so that a shard worker records in its shard
+    item that it is running, and what it returned. Other invocations run the
+    handler unchanged.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        shard = (event or {}).get('shard') or {}
+        if not shard.get('fan_out'):
+            return handler(event, context)
+
+        dynamodb = shared_pool().client('dynamodb')
+        _update_shard(dynamodb, shard, 'running')
+        try:
+            response = handler(event, context)
+        except Exception as e:
+            _update_shard(dynamodb, shard, 'failed', {'error': str(e)})
+            raise
+        _update_shard(dynamodb, shard, *shard_result(response))
+        return response
+
+    return wrapper
+
+
+def shard_result(response):
+    """Status and report of a shard worker's handler response."""
+    body = response.get('body')
+    if isinstance(body, str):
+        body = json.loads(body)
+    body = body or {}
+    if response.get('statusCode') != 200:
+        return 'failed', {'error': body.get('error', f"status {response.get('statusCode')}")}
+
+    checkpoint = body.get('checkpoint') or {}
+    if checkpoint.get('status') == 'interrupted':
+        return 'interrupted', {'resume_event': checkpoint['resume_event']}
+
+    artifacts = list(body.get('previous_artifacts', []))
+    if body.get('artifact'):
+        artifacts.append(body['artifact']['uri'])
+    return 'complete', {
+        'findings_count': body.get('findings_count', 0),
+        'aggregates': body.get('aggregates', {}),
+        'artifacts': artifacts
+    }
+
+
+def _update_shard(dynamodb, shard, status, report=None):
+    """Record a worker's status (and report) unless the coordinator has started a newer attempt."""
+    names = {'#status': 'status'}
+    values = {
+        ':status': {'S': status},
+        ':now': {'N': str(round(time.time(), 3))},
+        ':attempt': {'N': str(shard['attempt'])}
+    }
+    expression = 'SET #status = :status, updated_at = :now'
+    if report is not None:
+        expression += ', report = :report'
+        values[':report'] = {'S': to_json(report)}
+
+    try:
+        dynamodb.update_item(
+            TableName=DEFAULT_STATE_TABLE,
+            Key={'id': {'S': f"{shard['fan_out']}#{shard['shard_id']}"}},
+            UpdateExpression=expression,
+            ConditionExpression='attempt = :attempt',
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        print(f"Shard {shard['shard_id']} attempt {shard['attempt']} was superseded, not recording it")
+    except Exception as e:
+        print(f"Error recording shard {shard['shard_id']}: {str(e)}")
+
+
+class FanOut:
+    """
+    The coordinator's view of a fan-out: its run item and one item per shard
+    in the scan state table. Coordinator invocations of one fan-out share
+    them, so a continuation picks up the shards where the last one left.
+    """
+
+    def __init__(self, dynamodb, analyzer, event, context=None, table_name=DEFAULT_STATE_TABLE):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.budget = TimeBudget(context, float(event.get('checkpoint_reserve_seconds', DEFAULT_RESERVE_SECONDS)))
+        self.resumed = bool(event.get('fan_out_resume'))
+        self.fan_out_id = event.get('fan_out_resume') or getattr(context, 'aws_request_id', None) or uuid.uuid4().hex
+        self.key = f'FANOUT#{analyzer}#{self.fan_out_id}'
+        self.shards = {}
+        self.continued = False
+
+        self.data = {
+            # Naive UTC, as finding timestamps are
+            'started': time.time(), 'timestamp': datetime.now(timezone.utc).replace(tzinfo=None).isoformat(),
+            'invocation': 1,
+            'shard_ids': [], 'resources': 0, 'listing_errors': {}, 'summary': None
+        }
+        if self.resumed:
+            self.data = self.load()
+            self.data['invocation'] += 1
+
+    def load(self):
+        """Fetch the run item of the fan-out being continued."""
+        response = self.dynamodb.get_item(TableName=self.table_name, Key={'id': {'S': self.key}})
+        if 'Item' not in response:
+            raise ValueError(f'No fan-out {self.fan_out_id}')
+        return json.loads(response['Item']['fan_out']['S'])
+
+    def save(self):
+        self.dynamodb.put_item(TableName=self.table_name, Item={
+            'id': {'S': self.key},
+            'fan_out': {'S': to_json(self.data)},
+            'expires_at': {'N': str(int(time.time()) + CHECKPOINT_TTL_SECONDS)}
+        })
+
+    def start(self, shards, event, resources, listing_errors):
+        """Write the run item and a pending item per shard, each with the worker event to run it with."""
+        base_event = {key: value for key, value in event.items() if key in WORKER_EVENT_KEYS}
+        self.data.update(shard_ids=[shard['shard_id'] for shard in shards], resources=resources,
+                         listing_errors=listing_errors)
+        for shard in shards:
+            # Findings of every shard get the same timestamp, so reruns overwrite them
+            shard.update(fan_out=self.key, timestamp=self.data['timestamp'], attempt=0)
+            self.shards[shard['shard_id']] = {
+                'status': 'pending', 'event': dict(base_event, shard=shard), 'attempt': 0, 'failures': 0,
+                'continuations': 0, 'updated_at': time.time(), 'started_at': None, 'report': None, 'error': None
+            }
+
+        self.save()
+        with FindingSink(self.dynamodb, table_name=self.table_name, workers=2) as sink:
+            for shard_id in self.shards:
+                sink.write_item(self._item(shard_id))
+
+    def refresh(self):
+        """Read the items of the shards that are not settled yet."""
+        keys = [shard_id for shard_id in self.data['shard_ids']
+                if self.shards.get(shard_id, {}).get('status') not in SETTLED]
+        for start in range(0, len(keys), MAX_KEYS_PER_GET):
+            request = {self.table_name: {
+                'Keys': [{'id': {'S': f'{self.key}#{shard_id}'}} for shard_id in keys[start:start + MAX_KEYS_PER_GET]],
+                # Never act on a status older than the coordinator's own last write
+                'ConsistentRead': True
+            }}
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table_name, []):
+                    shard_id = item['id']['S'][len(self.key) + 1:]
+                    self.shards[shard_id] = {
+                        'status': item['status']['S'],
+                        'event': json.loads(item['event']['S']),
+                        'attempt': int(item['attempt']['N']),
+                        'failures': int(item['failures']['N']),
+                        'continuations': int(item['continuations']['N']),
+                        'updated_at': float(item['updated_at']['N']),
+                        'started_at': float(item['started_at']['N']) if 'started_at' in item else None,
+                        'report': json.loads(item['report']['S']) if 'report' in item else None,
+                        'error': item['error']['S'] if 'error' in item else None
+                    }
+                request = response.get('UnprocessedKeys')
+
+    def collect(self, invoke, max_workers=DEFAULT_SHARD_WORKERS, max_attempts=MAX_SHARD_ATTEMPTS):
+        """
+        Start, retry and continue shards until every one is settled (True) or
+        the time budget is spent (False).
+        """
+        while True:
+            self.refresh()
+            now = time.time()
+            pending = []
+            for shard_id in self.data['shard_ids']:
+                shard = self.shards[shard_id]
+                status = shard['status']
+                if status == 'running' and now - shard['updated_at'] > SHARD_TIMEOUT_SECONDS:
+                    status, shard['report'] = 'failed', {'error': 'No report from the worker'}
+
+                if status == 'failed':
+                    shard['failures'] += 1
+                    error = (shard['report'] or {}).get('error')
+                    print(f"Shard {shard_id} attempt {shard['attempt']} failed: {error}")
+                    if shard['failures'] >= max_attempts:
+                        self._settle(shard_id, 'error', error)
+                    else:
+                        self._dispatch(shard_id, invoke)
+                elif status == 'interrupted':
+                    # The worker checkpointed before its deadline: continue where it stopped
+                    if shard['continuations'] + 1 >= MAX_INVOCATIONS:
+                        self._settle(shard_id, 'error', f"Not completed after {shard['attempt']} invocations")
+                    else:
+                        shard['continuations'] += 1
+                        shard['event'] = shard['report']['resume_event']
+                        self._dispatch(shard_id, invoke)
+                elif status == 'pending':
+                    pending.append(shard_id)
+
+            running = sum(1 for shard in self.shards.values() if shard['status'] == 'running')
+            for shard_id in pending[:max(0, max_workers - running)]:
+                self._dispatch(shard_id, invoke)
+
+            if all(self.shards[shard_id]['status'] in SETTLED for shard_id in self.data['shard_ids']):
+                return True
+            if self.budget.expired():
+                return False
+            time.sleep(POLL_SECONDS)
+
+    def _dispatch(self, shard_id, invoke):
+        shard = self.shards[shard_id]
+        shard['attempt'] += 1
+        # Only reports of this attempt are recorded from now on
+        shard['event'] = dict(shard['event'], shard=dict(shard['event']['shard'], attempt=shard['attempt']))
+        shard.update(status='running', updated_at=time.time(), report=None)
+        if shard['started_at'] is None:
+            shard['started_at'] = shard['updated_at']
+        self._put(shard_id)
+        try:
+            invoke(shard['event'])
+        except Exception as e:
+            shard.update(status='failed', report={'error': str(e)})
+            self._put(shard_id)
+
+    def _settle(self, shard_id, status, error=None):
+        self.shards[shard_id].update(status=status, error=error, updated_at=time.time())
+        self._put(shard_id)
+
+    def _item(self, shard_id):
+        shard = self.shards[shard_id]
+        item = {
+            'id': {'S': f'{self.key}#{shard_id}'},
+            'status': {'S': shard['status']},
+            'event': {'S': to_json(shard['event'])},
+            'attempt': {'N': str(shard['attempt'])},
+            'failures': {'N': str(shard['failures'])},
+            'continuations': {'N': str(shard['continuations'])},
+            'updated_at': {'N': str(round(shard['updated_at'], 3))},
+            'expires_at': {'N': str(int(time.time()) + CHECKPOINT_TTL_SECONDS)}
+        }
+        if shard['started_at'] is not None:
+            item['started_at'] = {'N': str(round(shard['started_at'], 3))}
+        if shard['report'] is not None:
+            item['report'] = {'S': to_json(shard['report'])}
+        if shard['error']:
+            item['error'] = {'S': shard['error']}
+        return item
+
+    def _put(self, shard_id):
+        self.dynamodb.put_item(TableName=self.table_name, Item=self._item(shard_id))
+
+    def continue_later(self, clients, event, context):
+        """Save the run item and continue collecting in a new invocation of the function."""
+        self.save()
+        function_arn = getattr(context, 'invoked_function_arn', None)
+        if not function_arn:
+            return
+        if self.data['invocation'] >= MAX_INVOCATIONS:
+            print(f"Fan-out {self.fan_out_id} not continued after {self.data['invocation']} invocations")
+            return
+        try:
+            clients.client('lambda').invoke(
+                FunctionName=function_arn,
+                InvocationType='Event',
+                Payload=to_json(self.resume_event(event)).encode()
+            )
+            self.continued = True
+        except Exception as e:
+            print(f"Error continuing fan-out {self.fan_out_id}: {str(e)}")
+
+    def resume_event(self, event):
+        """The event that continues this fan-out."""
+        return dict(event, fan_out_resume=self.fan_out_id)
+
+    def checkpoint_summary(self, event, complete):
+        """Response body field in the shape of ScanCheckpoint.summary(), so run_locally() continues it too."""
+        summary = {
+            'scan_id': self.fan_out_id,
+            'invocation': self.data['invocation'],
+            'status': 'complete' if complete else 'interrupted'
+        }
+        if not complete:
+            summary['continued'] = self.continued
+            summary['resume_event'] = self.resume_event(event)
+        return summary
+
+    def reports(self):
+        """A report per shard: where it ran, attempts, continuations, wall time and error (if any)."""
+        reports = {}
+        for shard_id in self.data['shard_ids']:
+            shard = self.shards[shard_id]
+            worker_shard = shard['event']['shard']
+            report = {
+                'region': worker_shard['region'], 'resources': len(worker_shard['ids']),
+                'weight': worker_shard['weight'], 'attempts': shard['attempt'],
+                'continuations': shard['continuations'], 'retries': shard['failures'],
+                'seconds': round(shard['updated_at'] - (shard['started_at'] or shard['updated_at']), 2)
+            }
+            if worker_shard.get('account'):
+                report['account_id'] = worker_shard['account']['account_id']
+            if shard['status'] == 'error':
+                report['error'] = shard['error']
+            reports[shard_id] = report
+        return reports
+
+
+def coordinate(clients, analyzer, event, context, regions, list_resources, handler,
+               max_resources=MAX_SHARD_RESOURCES, accounts=None):
+    """
+    Fan an analyzer's scan out over shards and return the handler response.
+
+    list_resources(region) returns [(resource_id, weight), ...] for a region;
+    with `accounts` it is called as list_resources(region, account) for
+    every account. Shards run on invocations of the current function when
+    it has an ARN in the context, otherwise in-process through `handler`.
+    A coordinator that runs out of time answers with the progress so far
+    and a checkpoint to continue from.
+    """
+    fan_out = FanOut(clients.client('dynamodb'), analyzer, event, context)
+    if fan_out.data['summary']:
+        # A repeated continuation of a fan-out that already completed
+        return {'statusCode': 200, 'body': to_json(fan_out.data['summary'])}
+
+    if not fan_out.resumed:
+        shards, resources, listing_errors = plan_targets(analyzer, event, regions, list_resources, max_resources,
+                                                         accounts)
+        fan_out.start(shards, event, resources, listing_errors)
+        print(f"Planned {len(shards)} {analyzer} shards over {resources} resources as fan-out {fan_out.fan_out_id}")
+
+    function_arn = getattr(context, 'invoked_function_arn', None)
+    max_workers = int(event.get('shard_workers') or DEFAULT_SHARD_WORKERS)
+    if function_arn:
+        invoke = LambdaInvoker(clients.client('lambda'), function_arn)
+    else:
+        invoke = LocalInvoker(handler, max_workers)
+
+    if not fan_out.collect(invoke, max_workers):
+        fan_out.continue_later(clients, event, context)
+        settled = sum(1 for shard in fan_out.shards.values() if shard['status'] in ('complete', 'error'))
+        return {'statusCode': 200, 'body': to_json({
+            'message': f'Collected {settled} of {len(fan_out.shards)} {analyzer} shards so far',
+            'fan_out_id': fan_out.fan_out_id,
+            'checkpoint': fan_out.checkpoint_summary(event, complete=False)
+        })}
+
+    findings_count = 0
+    aggregates = {}
+    artifacts = []
+    for shard in fan_out.shards.values():
+        if shard['status'] != 'complete':
+            continue
+        findings_count += shard['report']['findings_count']
+        merge_aggregates(aggregates, shard['report']['aggregates'])
+        artifacts += shard['report']['artifacts']
+
+    reports = fan_out.reports()
+    failed = sorted(shard_id for shard_id, report in reports.items() if 'error' in report)
+    summary = {
+        'message': f'Analyzed {findings_count} {analyzer} resources in {len(reports)} shards',
+        'fan_out_id': fan_out.fan_out_id,
+        'findings_count': findings_count,
+        'aggregates': aggregates,
+        'shards': {
+            'count': len(reports),
+            'failed': failed,
+            'retried': sum(1 for report in reports.values() if report['retries']),
+            'slowest_seconds': max((report['seconds'] for report in reports.values()), default=0),
+            'seconds': round(time.time() - fan_out.data['started'], 2)
+        },
+        'shard_report': reports,
+        'checkpoint': fan_out.checkpoint_summary(event, complete=True)
+    }
+    if fan_out.data['listing_errors']:
+        summary['listing_errors'] = fan_out.data['listing_errors']
+    if artifacts:
+        summary['artifacts'] = artifacts
+
+    # Kept until the TTL, so a repeated continuation returns the same summary
+    fan_out.data['summary'] = summary
+    fan_out.save()
+    return {'statusCode': 200, 'body': to_json(summary)}
+
+
+def plan_targets(analyzer, event, regions, list_resources, max_resources=MAX_SHARD_RESOURCES, accounts=None):
+    """
+    List the resources of every (account, region) and plan their shards.
+    Returns the shards, the number of resources and the listing error per
+    account that could not be listed.
+    """
+    targets = {scope(region, account): (region, account) for account in accounts or [None] for region in regions}
+    listing_errors = {}
+
+    def list_target(target):
+        region, account = targets[target]
+        if not account:
+            return list_resources(region)
+        try:
+            return list_resources(region, account)
+        except Exception as e:
+            # One account that cannot be listed does not stop the others
+            print(f"Error listing {analyzer} resources of {target}: {str(e)}")
+            listing_errors[target] = str(e)
+            return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(DEFAULT_SHARD_WORKERS, len(targets)))) as executor:
+        resources = dict(zip(targets, executor.map(list_target, targets)))
+
+    shard_weight = float(event.get('shard_weight') or DEFAULT_SHARD_WEIGHT)
+    shards = plan_shards(resources, shard_weight, max_resources)
+    for shard in shards:
+        shard['region'], account = targets[shard['region']]
+        if account:
+            shard['account'] = account
+    return shards, sum(len(ids) for ids in resources.values()), listing_errors
@@ -0,0 +1,195 @@
+"""
+Compact finding records.
+
+Analyzers build Finding records with plain Python values; they are only
+turned into DynamoDB items (Decimal numbers, flat dict) at the sink.
+
+With COMPACT_FINDINGS the findings table holds compact items instead,
+built directly in the low-level wire format: short attribute names, the
+time as epoch microseconds (the `ts` sort key), and details,
+recommendation and metadata as one JSON payload, zlib-compressed when that
+makes it smaller. decode_item() reads either layout back as the to_item()
+dict.
+"""
+import json
+import os
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from cost_optimizer.output import to_json
+
+# Write compact items (the table's sort key must then be `ts`, a number)
+COMPACT_FINDINGS = os.environ.get('COMPACT_FINDINGS', 'false').lower() in ('1', 'true', 'yes')
+
+# Payloads shorter than this are stored as plain JSON
+COMPRESS_MIN_BYTES = 200
+
+# Preset deflate dictionary of the compressed payload: the metadata field
+# names and common values the analyzers write. Items are decoded with the
+# dictionary they were written with, so it must never change; a new one
+# needs a new payload attribute next to 'z'.
+PAYLOAD_DICTIONARY = (
+    '{"d":"","r":"","m":{}}false,true,null,available,running,stopped,in-use,gp2,gp3,STANDARD,' + ''.join(
+        f'"{name}":' for name in (
+            'age_days', 'attached_storage_gb', 'attached_to', 'attached_volumes', 'billed_read_ios_30d',
+            'billed_write_ios_30d', 'bucket_name', 'cluster_id', 'connections_max', 'cpu_avg_percent',
+            'cpu_max_percent', 'cpu_p50_percent', 'cpu_p95_percent', 'cpu_p99_percent', 'cpu_peak_to_mean',
+            'create_time', 'creation_date', 'datapoints', 'days_to_full', 'db_instance_id', 'description', 'domain',
+            'duplicate_count', 'engine', 'engine_mode', 'free_storage_gb', 'get_requests_7d', 'idle',
+            'idle_hours_fraction', 'instance_class', 'instance_id', 'instance_name', 'instance_state',
+            'instance_type', 'iops', 'is_attached', 'is_public', 'launch_time', 'member_count', 'members',
+            'metrics_failed', 'multi_az', 'network_in_mb', 'network_out_mb', 'newest_snapshot', 'object_count',
+            'objects', 'prefix', 'public_ip', 'put_requests_7d', 'read_gb_7d', 'read_iops_avg', 'read_ops_7d',
+            'reclaimable_gb', 'recommended_type', 'region', 'size_gb', 'size_source', 'snapshot_count',
+            'snapshot_days', 'start_time', 'state', 'status', 'storage_breakdown_source', 'storage_class_gb',
+            'storage_classes', 'storage_gb', 'storage_growth_gb_per_day', 'storage_tier', 'storage_type',
+            'throughput_mbps', 'top_prefixes', 'versioning_enabled', 'volume_exists', 'volume_id', 'volume_name',
+            'volume_size_gb', 'volume_type', 'volume_used_gb', 'write_gb_7d', 'write_iops_avg', 'write_ops_7d'
+        )
+    )
+).encode()
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _now():
+    # Naive UTC: the findings table's sort key format (Lambda's local time is UTC)
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+
+
+@dataclass(slots=True)
+class Finding:
+    """One finding for one resource."""
+
+    resource_id: str
+    resource_type: str
+    issue: str
+    severity: str
+    details: str
+    recommendation: str
+    metadata: dict = field(default_factory=dict)
+    # Estimated USD per month, None when there is no price for the resource
+    monthly_cost: float = None
+    monthly_savings: float = None
+    timestamp: str = field(default_factory=_now)
+    # Account of the resource when scanning other accounts, None for the analyzer's own
+    account_id: str = None
+
+    @property
+    def state_key(self):
+        """Scan state key of the resource, e.g. 'EC2#i-0123'."""
+        return f'{self.resource_type}#{self.resource_id}'
+
+    def to_item(self):
+        """The finding as a DynamoDB item."""
+        item = {
+            'id': self.resource_id,
+            'resource_id': self.resource_id,
+            'resource_type': self.resource_type,
+            'issue': self.issue,
+            'severity': self.severity,
+            'details': self.details,
+            'recommendation': self.recommendation,
+            'metadata': to_dynamodb(self.metadata),
+            'timestamp': self.timestamp
+        }
+        if self.monthly_cost is not None:
+            item['estimated_monthly_cost'] = Decimal(str(round(self.monthly_cost, 2)))
+        if self.monthly_savings is not None:
+            item['potential_monthly_savings'] = Decimal(str(round(self.monthly_savings, 2)))
+        if self.account_id is not None:
+            item['account_id'] = self.account_id
+        return item
+
+    def to_compact_item(self, compress=True):
+        """The finding as a compact DynamoDB item in low-level (wire) format."""
+        item = {
+            'id': {'S': self.resource_id},
+            'ts': {'N': str(epoch_micros(self.timestamp))},
+            't': {'S': self.resource_type},
+            'i': {'S': self.issue},
+            's': {'S': self.severity}
+        }
+        payload = to_json({'d': self.details, 'r': self.recommendation, 'm': self.metadata}).encode()
+        packed = _compress(payload) if compress and len(payload) >= COMPRESS_MIN_BYTES else None
+        if packed is not None and len(packed) < len(payload):
+            item['z'] = {'B': packed}
+        else:
+            item['p'] = {'S': payload.decode()}
+        if self.monthly_cost is not None:
+            item['c'] = {'N': str(Decimal(str(round(self.monthly_cost, 2))))}
+        if self.monthly_savings is not None:
+            item['sv'] = {'N': str(Decimal(str(round(self.monthly_savings, 2))))}
+        if self.account_id is not None:
+            item['a'] = {'S': self.account_id}
+        return item
+
+
+def to_dynamodb(value):
+    """Convert floats (also nested in dicts and lists) to Decimal for DynamoDB."""
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {key: to_dynamodb(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_dynamodb(item) for item in value]
+    return value
+
+
+def _compress(payload):
+    # Raw deflate: the attribute tells what it holds, so no zlib header and checksum
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=PAYLOAD_DICTIONARY)
+    return compressor.compress(payload) + compressor.flush()
+
+
+def _decompress(packed):
+    decompressor = zlib.decompressobj(-15, zdict=PAYLOAD_DICTIONARY)
+    return decompressor.decompress(packed) + decompressor.flush()
+
+
+def epoch_micros(timestamp):
+    """Epoch microseconds of an ISO timestamp (UTC when it has no offset), exactly."""
+    moment = datetime.fromisoformat(timestamp)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def from_epoch_micros(micros):
+    """The naive UTC ISO timestamp of epoch microseconds, as _now() writes it."""
+    return (EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+def decode_item(item):
+    """
+    A findings table item in low-level format as the to_item() dict, whichever
+    layout it was written in. Numbers are Decimal, as boto3 reads them.
+    """
+    if 'ts' not in item:
+        from boto3.dynamodb.types import TypeDeserializer
+        deserializer = TypeDeserializer()
+        return {key: deserializer.deserialize(value) for key, value in item.items()}
+
+    payload = _decompress(item['z']['B']) if 'z' in item else item['p']['S']
+    payload = json.loads(payload, parse_float=Decimal, parse_int=Decimal)
+    decoded = {
+        'id': item['id']['S'],
+        'resource_id': item['id']['S'],
+        'resource_type': item['t']['S'],
+        'issue': item['i']['S'],
+        'severity': item['s']['S'],
+        'details': payload['d'],
+        'recommendation': payload['r'],
+        'metadata': payload['m'],
+        'timestamp': from_epoch_micros(int(item['ts']['N']))
+    }
+    if 'c' in item:
+        decoded['estimated_monthly_cost'] = Decimal(item['c']['N'])
+    if 'sv' in item:
+        decoded['potential_monthly_savings'] = Decimal(item['sv']['N'])
+    if 'a' in item:
+        decoded['account_id'] = item['a']['S']
+    return decoded
@@ -0,0 +1,91 @@
+"""
+Vectorized linear-trend forecasts over daily metric series.
+
+A (resources x days) array, NaN where a day has no datapoint, is fitted by
+least squares for all rows at once. Storage projections (days until free
+space runs out, storage needed over a horizon and what could be reclaimed)
+then follow from the slopes in single array operations.
+
+NumPy is imported lazily so the other analyzers do not pay for it.
+"""
+import os
+
+# Days of growth the projected storage must cover
+HORIZON_DAYS = int(os.environ.get('STORAGE_FORECAST_DAYS', '90'))
+
+# Projected usage is kept below this fraction of the storage it needs
+STORAGE_HEADROOM = 1.25
+
+# Series with fewer daily datapoints get no forecast
+MIN_DATAPOINTS = 14
+
+GIB = 1024 ** 3
+
+
+def linear_trends(series):
+    """
+    Least-squares fit per row of a (resources x days) array.
+
+    Returns a dict of 1-D arrays: datapoints, slope (per day, NaN with
+    fewer than 2 datapoints) and latest (newest known value, NaN if none).
+    """
+    import numpy as np
+
+    series = np.asarray(series, dtype=np.float64)
+    x = np.arange(series.shape[1], dtype=np.float64)[None, :]
+    observed = ~np.isnan(series)
+    counts = observed.sum(axis=1)
+    safe = np.maximum(counts, 1)
+
+    mean_x = np.where(observed, x, 0).sum(axis=1) / safe
+    mean_y = np.where(observed, series, 0).sum(axis=1) / safe
+    dx = np.where(observed, x - mean_x[:, None], 0)
+    dy = np.where(observed, series - mean_y[:, None], 0)
+    variance = (dx * dx).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes = (dx * dy).sum(axis=1) / variance
+    slopes[(counts < 2) | (variance == 0)] = np.nan
+
+    last = series.shape[1] - 1 - np.argmax(observed[:, ::-1], axis=1)
+    latest = series[np.arange(series.shape[0]), last] if series.shape[1] else np.full(series.shape[0], np.nan)
+    latest[counts == 0] = np.nan
+
+    return {'datapoints': counts, 'slope': slopes, 'latest': latest}
+
+
+def storage_forecast(free_bytes, allocated_gb, min_storage_gb=0, horizon_days=HORIZON_DAYS,
+                     headroom=STORAGE_HEADROOM, min_datapoints=MIN_DATAPOINTS):
+    """
+    Storage projections per row of a (resources x days) free space array in
+    bytes, for resources with `allocated_gb` of storage.
+
+    Returns a dict of 1-D arrays: datapoints, free_gb (newest), growth_gb_per_day
+    (of used storage), days_to_full (inf when usage is not growing) and
+    reclaimable_gb (allocated storage beyond the projected need, never below
+    `min_storage_gb`). Rows with fewer than `min_datapoints` days are NaN, and
+    reclaim nothing.
+    """
+    import numpy as np
+
+    trends = linear_trends(np.asarray(free_bytes, dtype=np.float64) / GIB)
+    allocated_gb = np.asarray(allocated_gb, dtype=np.float64)
+    known = trends['datapoints'] >= min_datapoints
+
+    free_gb = np.where(known, np.clip(trends['latest'], 0, None), np.nan)
+    # Free space shrinks as usage grows
+    growth = np.where(known, -trends['slope'], np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        days_to_full = np.where(growth > 0, free_gb / growth, np.inf)
+    days_to_full[~known] = np.nan
+
+    used_gb = allocated_gb - free_gb
+    needed_gb = np.maximum((used_gb + np.clip(growth, 0, None) * horizon_days) * headroom, min_storage_gb)
+    reclaimable_gb = np.where(known, np.floor(np.clip(allocated_gb - needed_gb, 0, None)), 0.0)
+
+    return {
+        'datapoints': trends['datapoints'],
+        'free_gb': free_gb,
+        'growth_gb_per_day': growth,
+        'days_to_full': days_to_full,
+        'reclaimable_gb': reclaimable_gb
+    }
@@ -0,0 +1,232 @@
+"""
+Shared EC2 inventory snapshot for the EC2 and EBS analyzers.
+
+Instances (in every state) and volumes are described once per region and
+kept as compact records with hash indexes for the joins between them: the
+volumes attached to an instance, and the instance (and its state) behind a
+volume. Both analyzers enumerate from the snapshot instead of describing
+the same resources again.
+
+A snapshot is reused for INVENTORY_MAX_AGE_SECONDS: by warm invocations
+from memory, and by the other analyzer, shard workers and resumed scans of
+the same run from INVENTORY_SNAPSHOT (s3://bucket/prefix or a local
+directory) when it is set. Other accounts (see cost_optimizer.accounts) get
+snapshots of their own, described through the account's assumed role.
+
+Usage:
+    snapshot = shared_snapshot(clients, region)
+    for volume in snapshot.iter_volumes(cursor=cursor):
+        state = snapshot.instance_state(volume['Attachments'][0]['InstanceId'])
+"""
+import gzip
+import json
+import os
+import threading
+import time
+from bisect import bisect_right
+from datetime import datetime
+
+from cost_optimizer.accounts import account_clients, scope
+from cost_optimizer.output import to_json
+from cost_optimizer.resources import ListingCursor, iter_instances, iter_volumes
+from cost_optimizer.telemetry import record_phase
+
+# 's3://bucket/prefix' or a local directory; empty keeps snapshots in memory only
+DEFAULT_LOCATION = os.environ.get('INVENTORY_SNAPSHOT', '')
+
+# Snapshots older than this are described again
+DEFAULT_MAX_AGE_SECONDS = int(os.environ.get('INVENTORY_MAX_AGE_SECONDS', '1800'))
+
+# Fields of the describe_instances / describe_volumes records the analyzers read
+INSTANCE_FIELDS = ('InstanceId', 'InstanceType', 'State', 'LaunchTime', 'Tags')
+VOLUME_FIELDS = ('VolumeId', 'VolumeType', 'Size', 'State', 'CreateTime', 'Iops', 'Throughput', 'Tags')
+ATTACHMENT_FIELDS = ('InstanceId', 'Device', 'State', 'DeleteOnTermination')
+
+# Timestamps to restore when a snapshot is read back from JSON
+DATETIME_FIELDS = ('LaunchTime', 'CreateTime')
+
+
+def _compact(record, fields):
+    return {field: record[field] for field in fields if field in record}
+
+
+def compact_instance(instance):
+    """Only the fields of a describe_instances record that the analyzers use."""
+    compact = _compact(instance, INSTANCE_FIELDS)
+    compact['State'] = {'Name': instance['State']['Name']}
+    return compact
+
+
+def compact_volume(volume):
+    """Only the fields of a describe_volumes record that the analyzers use."""
+    compact = _compact(volume, VOLUME_FIELDS)
+    compact['Attachments'] = [_compact(attachment, ATTACHMENT_FIELDS) for attachment in volume['Attachments']]
+    return compact
+
+
+class InventorySnapshot:
+    """
+    Instances and volumes of one region, sorted by id, with hash indexes.
+
+    Listings resume from a ListingCursor whose token is the last id
+    returned, so a scan continues correctly even from a newer snapshot.
+    """
+
+    def __init__(self, region, instances, volumes, created_at=None):
+        self.region = region
+        self.created_at = created_at or time.time()
+        self.instances = sorted(instances, key=lambda instance: instance['InstanceId'])
+        self.volumes = sorted(volumes, key=lambda volume: volume['VolumeId'])
+        self._instance_ids = [instance['InstanceId'] for instance in self.instances]
+        self._volume_ids = [volume['VolumeId'] for volume in self.volumes]
+
+        self.instance_by_id = dict(zip(self._instance_ids, self.instances))
+        self.volume_by_id = dict(zip(self._volume_ids, self.volumes))
+        self.volumes_by_instance = {}
+        for volume in self.volumes:
+            for attachment in volume['Attachments']:
+                self.volumes_by_instance.setdefault(attachment['InstanceId'], []).append(volume)
+
+    @classmethod
+    def describe(cls, ec2, region):
+        """Build a snapshot from one pass over describe_instances and describe_volumes."""
+        instances = [compact_instance(instance) for instance in iter_instances(ec2, states=None)]
+        volumes = [compact_volume(volume) for volume in iter_volumes(ec2)]
+        return cls(region, instances, volumes)
+
+    def age_seconds(self):
+        return time.time() - self.created_at
+
+    def instance_state(self, instance_id):
+        """State name of an instance ('running', 'stopped', ...), None if unknown."""
+        instance = self.instance_by_id.get(instance_id)
+        return instance['State']['Name'] if instance else None
+
+    def attached_volumes(self, instance_id):
+        """Volumes attached to an instance."""
+        return self.volumes_by_instance.get(instance_id, [])
+
+    def iter_instances(self, states=('running',), cursor=None, instance_ids=None):
+        """Yield instances in the given states (all with states=None), optionally only the given ids."""
+        def wanted(instance):
+            return not states or instance['State']['Name'] in states
+        yield from _iter_after(self.instances, self._instance_ids, cursor, instance_ids, wanted)
+
+    def iter_volumes(self, cursor=None, volume_ids=None):
+        """Yield every volume, or only the given ones."""
+        yield from _iter_after(self.volumes, self._volume_ids, cursor, volume_ids)
+
+    def to_dict(self):
+        return {
+            'region': self.region,
+            'created_at': self.created_at,
+            'instances': self.instances,
+            'volumes': self.volumes
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        for record in data['instances'] + data['volumes']:
+            for field in DATETIME_FIELDS:
+                if field in record:
+                    record[field] = datetime.fromisoformat(record[field])
+        return cls(data['region'], data['instances'], data['volumes'], data['created_at'])
+
+
+def _iter_after(records, ids, cursor=None, only_ids=None, wanted=None):
+    cursor = cursor or ListingCursor()
+    if cursor.done:
+        return
+    only_ids = set(only_ids) if only_ids else None
+
+    # Resume right after the last id returned
+    start = bisect_right(ids, cursor.token) if cursor.token else 0
+    for index in range(start, len(records)):
+        record = records[index]
+        if only_ids is not None and ids[index] not in only_ids:
+            continue
+        if wanted is not None and not wanted(record):
+            continue
+        cursor.token, cursor.skip = ids[index], 0
+        yield record
+    cursor.done = True
+
+
+_snapshots = {}
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def shared_snapshot(clients, region, location=DEFAULT_LOCATION, max_age_seconds=DEFAULT_MAX_AGE_SECONDS,
+                    account=None):
+    """
+    Return the region's snapshot (of another account when `account` is
+    set): from memory or `location` while it is younger than
+    `max_age_seconds`, otherwise described again (and saved to `location`).
+    Concurrent callers for a region share a single describe.
+    """
+    key = scope(region, account)
+    snapshot = _snapshots.get(key)
+    if snapshot is not None and snapshot.age_seconds() < max_age_seconds:
+        return snapshot
+
+    with _locks_lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        snapshot = _snapshots.get(key)
+        if snapshot is None or snapshot.age_seconds() >= max_age_seconds:
+            snapshot = _load(clients, key, location) if location else None
+            if snapshot is None or snapshot.age_seconds() >= max_age_seconds:
+                started = time.perf_counter()
+                ec2 = account_clients(clients, account).client('ec2', region)
+                snapshot = InventorySnapshot.describe(ec2, region)
+                record_phase('enumerate', time.perf_counter() - started)
+                print(f"Described {len(snapshot.instances)} instances and {len(snapshot.volumes)} volumes in {key}")
+                if location:
+                    _save(clients, snapshot, key, location)
+            _snapshots[key] = snapshot
+    return snapshot
+
+
+def _snapshot_path(location, key):
+    return f"{location.rstrip('/')}/{key}.json.gz"
+
+
+def _load(clients, key, location):
+    path = _snapshot_path(location, key)
+    try:
+        if path.startswith('s3://'):
+            bucket, _, key = path[len('s3://'):].partition('/')
+            s3 = clients.client('s3')
+            try:
+                body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+            except s3.exceptions.NoSuchKey:
+                return None
+        else:
+            if not os.path.exists(path):
+                return None
+            with open(path, 'rb') as f:
+                body = f.read()
+        return InventorySnapshot.from_dict(json.loads(gzip.decompress(body)))
+    except Exception as e:
+        print(f"Error loading inventory snapshot {path}: {str(e)}")
+        return None
+
+
+def _save(clients, snapshot, key, location):
+    path = _snapshot_path(location, key)
+    body = gzip.compress(to_json(snapshot.to_dict()).encode())
+    try:
+        if path.startswith('s3://'):
+            bucket, _, key = path[len('s3://'):].partition('/')
+            clients.client('s3').put_object(
+                Bucket=bucket, Key=key, Body=body, ContentType='application/json', ContentEncoding='gzip'
+            )
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed, so readers never see half a file
+            with open(f'{path}.tmp', 'wb') as f:
+                f.write(body)
+            os.replace(f'{path}.tmp', path)
+    except Exception as e:
+        print(f"Error saving inventory snapshot {path}: {str(e)}")
@@ -0,0 +1,157 @@
+"""
+Per-day CloudWatch datapoint cache across runs.
+
+Closed UTC days cannot change once their datapoints have settled, so a
+MetricQueryEngine given a MetricDayCache only fetches the days it has not
+seen yet (normally just the newest one) and rebuilds the rest of its window
+from the cache. Each series (region, namespace, metric, dimensions, stat
+and period) is one item in the scan state table, with a compact binary
+entry per day: uint16 minute offsets followed by float64 values.
+
+Days older than METRIC_CACHE_MAX_DAYS are evicted when a series is
+written, and series that are no longer written expire through the table's
+TTL. GetMetricData is billed per metric, so the cache saves datapoint pages
+(and time) rather than metric charges; it pays off most for 30 or 90 day
+windows of hourly data.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from cost_optimizer.sink import FindingSink
+from cost_optimizer.state import DEFAULT_STATE_TABLE, MAX_KEYS_PER_GET
+
+# Days kept per series; windows can be at most this long
+DEFAULT_MAX_DAYS = int(os.environ.get('METRIC_CACHE_MAX_DAYS', '90'))
+
+# A closed day is cached once it ended this long ago (late datapoints)
+SETTLE_SECONDS = 3600
+
+# Days without datapoints are cached only once this old, as some metrics
+# (S3 storage) are published a day or more late
+EMPTY_SETTLE_SECONDS = 2 * 86400
+
+
+def use_metric_cache(event):
+    """Check event['metric_cache'] or METRIC_CACHE for the datapoint cache."""
+    value = event.get('metric_cache', os.environ.get('METRIC_CACHE', 'false'))
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def day_start(day):
+    """Midnight UTC of a 'YYYY-MM-DD' day."""
+    return datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+
+
+def window_days(end_time, days):
+    """The `days` UTC days before end_time (a midnight), oldest first."""
+    return [(end_time - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(days, 0, -1)]
+
+
+def encode_day(timestamps, values, start):
+    """Pack a day's datapoints as minute offsets from `start` and values."""
+    minutes = array('H', (int((timestamp - start).total_seconds() // 60) for timestamp in timestamps))
+    return minutes.tobytes() + array('d', values).tobytes()
+
+
+def decode_day(data, start):
+    """Timestamps and values of a day packed by encode_day()."""
+    count = len(data) // 10
+    minutes = array('H')
+    minutes.frombytes(data[:count * 2])
+    values = array('d')
+    values.frombytes(data[count * 2:])
+    return [start + timedelta(minutes=minute) for minute in minutes], list(values)
+
+
+class MetricDayCache:
+    """
+    Load and store cached days of metric series for one region.
+
+    Usage:
+        cache = MetricDayCache(dynamodb, region)
+        engine = MetricQueryEngine(cloudwatch, days=30, cache=cache)
+    """
+
+    def __init__(self, dynamodb, region, table_name=DEFAULT_STATE_TABLE, max_days=DEFAULT_MAX_DAYS, account_id=None):
+        self.dynamodb = dynamodb
+        self.region = region
+        self.account_id = account_id
+        self.table_name = table_name
+        self.max_days = max_days
+        self._lock = threading.Lock()
+
+        self.cached_days = 0
+        self.fetched_days = 0
+
+    def window_end(self):
+        """Midnight UTC today: windows cover closed days only."""
+        return datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def series_key(self, metric_stat):
+        """State table key of a GetMetricData MetricStat's series."""
+        metric = metric_stat['Metric']
+        identity = [
+            self.region, metric['Namespace'], metric['MetricName'],
+            sorted((dimension['Name'], dimension['Value']) for dimension in metric['Dimensions']),
+            metric_stat['Stat'], metric_stat['Period']
+        ]
+        if self.account_id:
+            # Resource names (DB instances) repeat across accounts
+            identity.append(self.account_id)
+        digest = hashlib.blake2b(json.dumps(identity).encode(), digest_size=12).hexdigest()
+        return f'METRICS#{digest}'
+
+    def load(self, keys):
+        """Cached days per series key: {key: {day: packed bytes}}."""
+        cached = {}
+        keys = list(dict.fromkeys(keys))
+        for start in range(0, len(keys), MAX_KEYS_PER_GET):
+            request = {self.table_name: {
+                'Keys': [{'id': {'S': key}} for key in keys[start:start + MAX_KEYS_PER_GET]]
+            }}
+            while request:
+                try:
+                    response = self.dynamodb.batch_get_item(RequestItems=request)
+                except Exception as e:
+                    # Without the cache the whole window is simply fetched
+                    print(f"Error loading metric cache: {str(e)}")
+                    break
+                for item in response['Responses'].get(self.table_name, []):
+                    days = item.get('days', {}).get('M', {})
+                    cached[item['id']['S']] = {day: value['B'] for day, value in days.items()}
+                request = response.get('UnprocessedKeys')
+        return cached
+
+    def save(self, series):
+        """Write series given as {key: {day: packed bytes}}, dropping days past max_days."""
+        if not series:
+            return
+        oldest = (self.window_end() - timedelta(days=self.max_days)).strftime('%Y-%m-%d')
+        expires_at = int(time.time()) + self.max_days * 86400
+        with FindingSink(self.dynamodb, table_name=self.table_name, workers=2) as sink:
+            for key, days in series.items():
+                sink.write({
+                    'id': key,
+                    'days': {day: data for day, data in days.items() if day >= oldest},
+                    'expires_at': expires_at
+                })
+
+    def is_settled(self, day, has_datapoints):
+        """True when a closed day's datapoints can be cached."""
+        ended_ago = time.time() - (day_start(day) + timedelta(days=1)).timestamp()
+        return ended_ago >= (SETTLE_SECONDS if has_datapoints else EMPTY_SETTLE_SECONDS)
+
+    def count(self, cached_days, fetched_days):
+        with self._lock:
+            self.cached_days += cached_days
+            self.fetched_days += fetched_days
+
+    def stats(self):
+        """Series-days read from the cache and fetched from CloudWatch."""
+        with self._lock:
+            return {'cached_days': self.cached_days, 'fetched_days': self.fetched_days}
@@ -0,0 +1,220 @@
+from datetime import datetime, timedelta, timezone
+
+from cost_optimizer.metric_cache import decode_day, day_start, encode_day, window_days
+
+# GetMetricData accepts at most 500 metric queries per request
+MAX_QUERIES_PER_REQUEST = 500
+
+
+class MetricQueryEngine:
+    """
+    Collect CloudWatch metric queries for a whole run and resolve them
+    through GetMetricData in batches, instead of one GetMetricStatistics
+    call per resource and metric.
+
+    Usage:
+        engine = MetricQueryEngine(cloudwatch, days=7)
+        engine.add(instance_id, 'AWS/EC2', 'CPUUtilization',
+                   [{'Name': 'InstanceId', 'Value': instance_id}], 'Average')
+        engine.resolve()
+        cpu = engine.average(instance_id, 'CPUUtilization')
+
+    With a MetricDayCache the window is the last `days` closed UTC days, and
+    only the days missing from the cache are fetched.
+    """
+
+    def __init__(self, cloudwatch, days=7, period=86400, cache=None):
+        self.cloudwatch = cloudwatch
+        self.days = days
+        self.period = period
+        self.cache = cache
+        self.api_calls = 0
+        self.failed_queries = 0
+        self.end_time = None
+        self._pending = []
+        self._queries = {}
+        self._values = {}
+        self._timestamps = {}
+        self._failed = set()
+        self._failed_ids = set()
+        self._next_id = 0
+
+    def add(self, resource_id, namespace, metric_name, dimensions, stat, key=None):
+        """Queue a metric query for a resource. Returns the key used to read it back."""
+        key = key or metric_name
+        # Query ids must start with a lowercase letter
+        query_id = f'q{self._next_id}'
+        self._next_id += 1
+
+        self._pending.append({
+            'Id': query_id,
+            'MetricStat': {
+                'Metric': {
+                    'Namespace': namespace,
+                    'MetricName': metric_name,
+                    'Dimensions': dimensions
+                },
+                'Period': self.period,
+                'Stat': stat
+            },
+            'ReturnData': True
+        })
+        self._queries[query_id] = (resource_id, key)
+        return key
+
+    def resolve(self):
+        """Fetch every pending query, 500 at a time, following NextToken paging."""
+        if self.cache is not None:
+            self._resolve_cached()
+            return
+
+        end_time = self.end_time = datetime.now(timezone.utc)
+        start_time = end_time - timedelta(days=self.days)
+        self._fetch_all(self._pending, start_time, end_time)
+        self._pending = []
+
+    def _fetch_all(self, queries, start_time, end_time):
+        for start in range(0, len(queries), MAX_QUERIES_PER_REQUEST):
+            self._fetch_batch(queries[start:start + MAX_QUERIES_PER_REQUEST], start_time, end_time)
+
+    def _resolve_cached(self):
+        end_time = self.end_time = self.cache.window_end()
+        days = window_days(end_time, self.days)
+        pending, self._pending = self._pending, []
+        keys = {query['Id']: self.cache.series_key(query['MetricStat']) for query in pending}
+        cached = self.cache.load(keys.values())
+
+        # Cached days up to the first missing one are used, the rest is fetched
+        by_first_missing = {}
+        cached_days = 0
+        for query in pending:
+            series = cached.get(keys[query['Id']], {})
+            resource_key = self._queries[query['Id']]
+            for day in days:
+                if day not in series:
+                    by_first_missing.setdefault(day, []).append(query)
+                    break
+                timestamps, values = decode_day(series[day], day_start(day))
+                self._timestamps.setdefault(resource_key, []).extend(timestamps)
+                self._values.setdefault(resource_key, []).extend(values)
+                cached_days += 1
+
+        fetched_days = 0
+        for first_day, queries in by_first_missing.items():
+            self._fetch_all(queries, day_start(first_day), end_time)
+            fetched_days += len(queries) * (len(days) - days.index(first_day))
+
+        fetched_ids = {query['Id'] for queries in by_first_missing.values() for query in queries}
+        updates = {}
+        for query in pending:
+            resource_key = self._queries[query['Id']]
+            # Newest first, as fetched with ScanBy=TimestampDescending
+            points = sorted(
+                zip(self._timestamps.get(resource_key, []), self._values.get(resource_key, [])),
+                key=lambda point: point[0], reverse=True
+            )
+            self._timestamps[resource_key] = [timestamp for timestamp, _ in points]
+            self._values[resource_key] = [value for _, value in points]
+
+            if query['Id'] not in fetched_ids or query['Id'] in self._failed_ids:
+                continue
+            update = self._settled_days(points, days)
+            if update:
+                series = cached.get(keys[query['Id']], {})
+                updates[keys[query['Id']]] = dict(series, **update)
+
+        self.cache.save(updates)
+        self.cache.count(cached_days, fetched_days)
+
+    def _settled_days(self, points, days):
+        """Packed datapoints per window day that can be cached."""
+        by_day = {}
+        for timestamp, value in points:
+            by_day.setdefault(timestamp.strftime('%Y-%m-%d'), []).append((timestamp, value))
+
+        settled = {}
+        for day in days:
+            day_points = by_day.get(day, [])
+            if self.cache.is_settled(day, bool(day_points)):
+                settled[day] = encode_day(
+                    [timestamp for timestamp, _ in day_points], [value for _, value in day_points], day_start(day)
+                )
+        return settled
+
+    def _fetch_batch(self, batch, start_time, end_time):
+        request = {
+            'MetricDataQueries': batch,
+            'StartTime': start_time,
+            'EndTime': end_time,
+            'ScanBy': 'TimestampDescending'
+        }
+
+        while True:
+            try:
+                response = self.cloudwatch.get_metric_data(**request)
+            except Exception as e:
+                # Keep failed queries apart from metrics that really are zero
+                print(f"Error getting metric data for {len(batch)} queries: {str(e)}")
+                self._mark_failed(query['Id'] for query in batch)
+                return
+            self.api_calls += 1
+
+            for result in response['MetricDataResults']:
+                resource_key = self._queries.get(result['Id'])
+                if resource_key is None:
+                    continue
+                if result.get('StatusCode') in ('InternalError', 'Forbidden'):
+                    self._mark_failed([result['Id']])
+                self._values.setdefault(resource_key, []).extend(result['Values'])
+                self._timestamps.setdefault(resource_key, []).extend(result['Timestamps'])
+
+            next_token = response.get('NextToken')
+            if not next_token:
+                return
+            request['NextToken'] = next_token
+
+    def _mark_failed(self, query_ids):
+        for query_id in query_ids:
+            resource_key = self._queries.get(query_id)
+            if resource_key is not None:
+                self._failed.add(resource_key[0])
+            self._failed_ids.add(query_id)
+            self.failed_queries += 1
+
+    def clear(self):
+        """Drop resolved values so a long run can reuse the engine per batch."""
+        self._queries.clear()
+        self._values.clear()
+        self._timestamps.clear()
+        self._failed.clear()
+        self._failed_ids.clear()
+
+    def failed(self, resource_id):
+        """True when a query for the resource failed, so its zero values are unknown rather than zero."""
+        return resource_id in self._failed
+
+    def values(self, resource_id, key):
+        """All datapoint values for a resource metric, newest first."""
+        return self._values.get((resource_id, key), [])
+
+    def series(self, resource_id, key):
+        """Datapoint timestamps and values for a resource metric, newest first."""
+        return self._timestamps.get((resource_id, key), []), self.values(resource_id, key)
+
+    def sum(self, resource_id, key):
+        """Total of all datapoints, or 0.0 when there are none."""
+        return float(sum(self.values(resource_id, key)))
+
+    def average(self, resource_id, key):
+        """Mean of all datapoints, or 0.0 when there are none."""
+        values = self.values(resource_id, key)
+        if values:
+            return sum(values) / len(values)
+        return 0.0
+
+    def latest(self, resource_id, key):
+        """Most recent datapoint, or 0.0 when there are none."""
+        values = self.values(resource_id, key)
+        if values:
+            return values[0]
+        return 0.0
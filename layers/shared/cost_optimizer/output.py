@@ -0,0 +1,275 @@
+"""
+Handler output: findings inline in the response, or streamed as gzip NDJSON
+to S3 or a local path while they are produced.
+
+In artifact mode the response body only carries counts, aggregates, the
+artifact location and an optional first page with a cursor for the rest,
+so it stays small however many findings a run produces.
+"""
+import base64
+import gzip
+import io
+import json
+import os
+import threading
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+
+# 'inline', 's3://bucket/prefix' or a local directory
+DEFAULT_DESTINATION = os.environ.get('FINDINGS_OUTPUT', 'inline')
+
+# S3 multipart parts must be at least 5 MB (except the last one)
+PART_SIZE = 8 * 1024 * 1024
+
+
+def _json_default(value):
+    # Numbers stay numbers instead of going through str()
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+_encoder = json.JSONEncoder(separators=(',', ':'), default=_json_default)
+
+
+def to_json(value):
+    """Compact JSON with Decimal and datetime support."""
+    return _encoder.encode(value)
+
+
+class S3MultipartWriter:
+    """File-like object that uploads what is written to S3 in multipart parts."""
+
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        if len(self._buffer) >= PART_SIZE:
+            self._upload_part()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._upload_id is None:
+            # Small artifacts go up in a single request
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+            return
+        if self._buffer:
+            self._upload_part()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            MultipartUpload={'Parts': self._parts}
+        )
+
+    def abort(self):
+        if self._upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            response = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType='application/x-ndjson', ContentEncoding='gzip'
+            )
+            self._upload_id = response['UploadId']
+        part_number = len(self._parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            PartNumber=part_number, Body=bytes(self._buffer)
+        )
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self._buffer = bytearray()
+
+
+class FindingsOutput:
+    """
+    Collect the findings of a run for the handler response.
+
+    Usage:
+        output = FindingsOutput(clients, 'ec2', event, context)
+        output.add(finding)
+        ...
+        output.close()
+        body = output.summary(message='...')
+    """
+
+    def __init__(self, clients, analyzer, event, context=None, destination=None):
+        self.destination = destination or event.get('output') or DEFAULT_DESTINATION
+        self.page_size = int(event.get('page_size', 0))
+        self.count = 0
+        # Findings and artifacts of earlier invocations of a resumed scan
+        self.restored_count = 0
+        self.previous_artifacts = []
+        self.aggregates = {
+            'resource_type': {}, 'issue': {}, 'severity': {}, 'region': {},
+            'estimated_monthly_cost': 0.0, 'potential_monthly_savings': 0.0
+        }
+        self._inline = self.destination == 'inline'
+        self._findings = []
+        self._page = []
+        self._lock = threading.Lock()
+        self._raw = None
+        self._gzip = None
+        self.uri = None
+
+        if not self._inline:
+            run_id = getattr(context, 'aws_request_id', None) or uuid.uuid4().hex
+            name = f"{analyzer}/{datetime.now().strftime('%Y/%m/%d')}/{run_id}.ndjson.gz"
+            self._raw, self.uri = _open_artifact(clients, self.destination, name)
+            self._gzip = gzip.GzipFile(fileobj=self._raw, mode='wb')
+
+    def add(self, finding):
+        """Record a finding. Safe to call from several threads."""
+        line = None if self._inline else (to_json(finding) + '\n').encode()
+        with self._lock:
+            self.count += 1
+            self._aggregate(finding)
+            if self._inline:
+                self._findings.append(finding)
+                return
+            self._gzip.write(line)
+            if len(self._page) < self.page_size:
+                self._page.append(finding)
+
+    def close(self):
+        """Finish the artifact, if any."""
+        if self._gzip is not None:
+            self._gzip.close()
+            self._raw.close()
+            self._gzip = None
+
+    def abort(self):
+        """Drop a partially written artifact."""
+        if self._gzip is not None:
+            self._gzip = None
+            if isinstance(self._raw, S3MultipartWriter):
+                self._raw.abort()
+            else:
+                self._raw.close()
+
+    def checkpoint(self):
+        """Totals and artifacts so far, to carry over to a resumed scan."""
+        with self._lock:
+            return {
+                'count': self.count,
+                'aggregates': self.aggregates,
+                'artifacts': self.previous_artifacts + ([self.uri] if self.uri else [])
+            }
+
+    def restore(self, saved):
+        """Continue from the totals saved by checkpoint() in an earlier invocation."""
+        with self._lock:
+            self.count = self.restored_count = saved['count']
+            self.aggregates = saved['aggregates']
+            self.previous_artifacts = list(saved['artifacts'])
+
+    def summary(self, **extra):
+        """Response body fields: counts, aggregates and findings or an artifact pointer."""
+        body = dict(extra)
+        body['findings_count'] = self.count
+        body['aggregates'] = self.aggregates
+        if self._inline:
+            body['findings'] = self._findings
+            return body
+
+        artifact_count = self.count - self.restored_count
+        body['artifact'] = {'uri': self.uri, 'format': 'ndjson+gzip', 'findings_count': artifact_count}
+        if self.previous_artifacts:
+            body['previous_artifacts'] = self.previous_artifacts
+        if self.page_size:
+            next_cursor = None
+            if artifact_count > len(self._page):
+                next_cursor = encode_cursor(self.uri, len(self._page))
+            body['page'] = {'findings': self._page, 'next_cursor': next_cursor}
+        return body
+
+    def _aggregate(self, finding):
+        values = {
+            'resource_type': finding.get('resource_type'),
+            'issue': finding.get('issue'),
+            'severity': finding.get('severity'),
+            'region': (finding.get('metadata') or {}).get('region')
+        }
+        if finding.get('account_id') is not None:
+            values['account_id'] = finding['account_id']
+        for field, value in values.items():
+            if value is not None:
+                counts = self.aggregates.setdefault(field, {})
+                counts[value] = counts.get(value, 0) + 1
+        for field in ('estimated_monthly_cost', 'potential_monthly_savings'):
+            if finding.get(field) is not None:
+                self.aggregates[field] = round(self.aggregates[field] + float(finding[field]), 2)
+
+
+def merge_aggregates(totals, aggregates):
+    """Add FindingsOutput aggregates (e.g. of another shard) into `totals`."""
+    for field, value in aggregates.items():
+        if isinstance(value, dict):
+            counts = totals.setdefault(field, {})
+            for key, count in value.items():
+                counts[key] = counts.get(key, 0) + count
+        else:
+            totals[field] = round(totals.get(field, 0.0) + float(value), 2)
+    return totals
+
+
+def _open_artifact(clients, destination, name):
+    if destination.startswith('s3://'):
+        bucket, _, prefix = destination[len('s3://'):].partition('/')
+        key = f"{prefix.strip('/')}/{name}" if prefix.strip('/') else name
+        return S3MultipartWriter(clients.client('s3'), bucket, key), f's3://{bucket}/{key}'
+
+    path = os.path.join(destination, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return open(path, 'wb'), path
+
+
+def encode_cursor(uri, offset):
+    """Opaque cursor pointing at a line offset in an artifact."""
+    return base64.urlsafe_b64encode(json.dumps({'uri': uri, 'offset': offset}).encode()).decode()
+
+
+def read_page(clients, cursor, page_size=100):
+    """
+    Read the page of findings a cursor points at. Returns the findings and
+    the cursor for the following page (None at the end).
+    """
+    position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    uri, offset = position['uri'], position['offset']
+
+    if uri.startswith('s3://'):
+        bucket, _, key = uri[len('s3://'):].partition('/')
+        raw = clients.client('s3').get_object(Bucket=bucket, Key=key)['Body']
+    else:
+        raw = open(uri, 'rb')
+
+    findings = []
+    more = False
+    try:
+        lines = io.TextIOWrapper(gzip.GzipFile(fileobj=raw), encoding='utf-8')
+        for index, line in enumerate(lines):
+            if index < offset:
+                continue
+            if len(findings) == page_size:
+                more = True
+                break
+            findings.append(json.loads(line))
+    finally:
+        raw.close()
+
+    next_cursor = encode_cursor(uri, offset + len(findings)) if more else None
+    return findings, next_cursor
@@ -0,0 +1,212 @@
+"""
+Streaming analyzer pipeline: enumerate -> enrich -> evaluate -> sink.
+
+Each stage runs on its own thread(s) and hands batches to the next one over
+a bounded queue. A slow stage (CloudWatch, DynamoDB) holds the earlier ones
+back instead of letting batches pile up, so memory stays flat however many
+resources an account has, while enumeration, metric fetching and writing
+overlap.
+"""
+import queue
+import threading
+
+from cost_optimizer.findings import COMPACT_FINDINGS
+from cost_optimizer.telemetry import timed, timed_iter
+
+# Batches waiting between two stages
+DEFAULT_QUEUE_SIZE = 2
+
+# How often blocked stages check whether the pipeline was stopped
+POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class FindingEmitter:
+    """
+    Sink stage: turns Finding records into items, drops findings that did not
+    change since the last run (incremental mode) and writes the rest to the
+    FindingSink and FindingsOutput. Every finding, changed or not, is added
+    to the daily rollups when a RollupStore is given. Findings of another
+    account are tagged with its `account_id`, and all findings get
+    `timestamp` when one is given (a fan-out's start time, see
+    ScanCheckpoint.timestamp). With `compact` the table gets compact items
+    (see cost_optimizer.findings), the output the usual ones.
+    """
+
+    def __init__(self, sink, output, state=None, rollups=None, account_id=None, compact=COMPACT_FINDINGS,
+                 timestamp=None):
+        self.sink = sink
+        self.output = output
+        self.state = state
+        self.rollups = rollups
+        self.account_id = account_id
+        self.compact = compact
+        self.timestamp = timestamp
+        self.count = 0
+
+    def __call__(self, findings):
+        for finding in findings:
+            if self.account_id:
+                finding.account_id = self.account_id
+            if self.timestamp:
+                finding.timestamp = self.timestamp
+            if self.rollups:
+                self.rollups.record(finding)
+            item = finding.to_item()
+            if self.state and not self.state.record(finding.state_key, item):
+                continue
+            if self.compact:
+                self.sink.write_item(finding.to_compact_item())
+            else:
+                self.sink.write(item)
+            self.output.add(item)
+            self.count += 1
+        if self.state:
+            self.state.save()
+        if self.rollups:
+            self.rollups.save()
+
+
+def run_pipeline(batches, enrich, evaluate, emit, enrich_workers=1, queue_size=DEFAULT_QUEUE_SIZE,
+                 position=None, on_emitted=None, should_stop=None):
+    """
+    Run the stages over an iterable of resource batches:
+
+        enrich(batch)      -> enriched batch (metrics, details, ...), on `enrich_workers` threads
+        evaluate(enriched) -> list of Finding records
+        emit(findings)     -> on the calling thread, e.g. a FindingEmitter
+
+    Batches are emitted in enumeration order. For checkpointing, `position()`
+    is called right after each batch is enumerated and `on_emitted(value)`
+    gets its result once that batch was emitted; `should_stop()` is checked
+    before each emit and ends the run early when it returns True, dropping
+    the batches still in flight.
+
+    At most `queue_size + enrich_workers` batches are in flight between
+    enumeration and emit. A slow batch then holds enumeration back instead
+    of letting the batches after it pile up while they wait for their turn.
+
+    Returns True when every batch was emitted, False when stopped early. The
+    first error in any stage stops the pipeline and is raised here.
+    """
+    # Busy time of each stage is reported per phase (see cost_optimizer.telemetry)
+    batches = timed_iter('enumerate', batches)
+    enrich = timed('metrics', enrich)
+    evaluate = timed('build', evaluate)
+    emit = timed('write', emit)
+
+    pending = queue.Queue(queue_size)
+    enriched = queue.Queue(queue_size)
+    evaluated = queue.Queue(queue_size)
+    stop = threading.Event()
+    # Released as batches are emitted, so out-of-order ones cannot pile up
+    in_flight = threading.Semaphore(queue_size + enrich_workers)
+    errors = []
+
+    def run_stage(work):
+        try:
+            work()
+        except _Stopped:
+            pass
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    def enumerate_stage():
+        iterator = iter(batches)
+        sequence = 0
+        while True:
+            # Take a slot before reading the next batch, not after
+            _acquire(in_flight, stop)
+            batch = next(iterator, _DONE)
+            if batch is _DONE:
+                break
+            _put(pending, (sequence, position() if position else None, batch), stop)
+            sequence += 1
+        for _ in range(enrich_workers):
+            _put(pending, _DONE, stop)
+
+    def enrich_stage():
+        while (item := _get(pending, stop)) is not _DONE:
+            sequence, tag, batch = item
+            _put(enriched, (sequence, tag, enrich(batch)), stop)
+        _put(enriched, _DONE, stop)
+
+    def evaluate_stage():
+        done = 0
+        while done < enrich_workers:
+            item = _get(enriched, stop)
+            if item is _DONE:
+                done += 1
+                continue
+            sequence, tag, batch = item
+            _put(evaluated, (sequence, tag, evaluate(batch)), stop)
+        _put(evaluated, _DONE, stop)
+
+    threads = [threading.Thread(target=run_stage, args=(enumerate_stage,), daemon=True)]
+    threads += [threading.Thread(target=run_stage, args=(enrich_stage,), daemon=True) for _ in range(enrich_workers)]
+    threads.append(threading.Thread(target=run_stage, args=(evaluate_stage,), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    # Batches finished out of order (several enrich workers) wait here for their turn
+    waiting = {}
+    next_sequence = 0
+    completed = False
+    try:
+        while (item := _get(evaluated, stop)) is not _DONE:
+            sequence, tag, findings = item
+            waiting[sequence] = (tag, findings)
+            while next_sequence in waiting:
+                if should_stop and should_stop():
+                    raise _Stopped()
+                tag, findings = waiting.pop(next_sequence)
+                in_flight.release()
+                emit(findings)
+                if on_emitted:
+                    on_emitted(tag)
+                next_sequence += 1
+        completed = True
+    except _Stopped:
+        pass
+    except Exception as e:
+        errors.append(e)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return completed
+
+
+def _acquire(semaphore, stop):
+    while not stop.is_set():
+        if semaphore.acquire(timeout=POLL_SECONDS):
+            return
+    raise _Stopped()
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL_SECONDS)
+            return
+        except queue.Full:
+            pass
+    raise _Stopped()
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            pass
+    raise _Stopped()
@@ -0,0 +1,365 @@
+"""
+Offline pricing index for estimating the monthly cost of resources.
+
+AWS price list offer files (CSV or JSON, from the bulk API or
+pricing:GetPriceListFileUrl) are reduced once to the on-demand prices the
+analyzers need and written as a compact binary index: sorted 64-bit key
+hashes followed by monthly USD prices. The index is memory-mapped, so
+opening it is cheap and a lookup is one hash and one binary search.
+
+Keys (all lowercase), with prices per month:
+    ('ec2', region, instance_type)                     per instance (Linux, shared tenancy)
+    ('ebs', region, volume_type)                       per GB
+    ('ebs-iops', region, volume_type)                  per provisioned IOPS
+    ('ebs-throughput', region, volume_type)            per provisioned MiB/s
+    ('rds', region, instance_class, engine, deployment) per instance
+    ('rds-storage', region, storage_type, deployment)  per GB
+    ('s3', region, storage_class)                      per GB (first tier)
+    ('ebs-snapshot', region, tier)                     per GB ('standard' or 'archive')
+    ('rds-snapshot', region)                           per GB of backup storage beyond the free allowance
+    ('eip', region)                                    per idle public IPv4 address
+
+Build an index from downloaded offer files:
+    python -m cost_optimizer.pricing --output pricing.idx AmazonEC2.csv AmazonRDS.csv AmazonS3.csv AmazonVPC.csv
+"""
+import argparse
+import csv
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+# Index file, a local path or s3://bucket/key; empty disables cost estimates
+DEFAULT_INDEX = os.environ.get('PRICING_INDEX', '')
+
+# Warm invocations reuse the loaded index until it is this old
+DEFAULT_TTL_SECONDS = int(os.environ.get('PRICING_TTL_SECONDS', '86400'))
+
+HOURS_PER_MONTH = 730
+
+MAGIC = b'COPI'
+VERSION = 1
+HEADER = struct.Struct('<4sIQ')
+
+# Offer file CSV columns and the JSON attribute names they correspond to
+CSV_COLUMNS = {
+    'TermType': 'termType',
+    'Unit': 'unit',
+    'PricePerUnit': 'price',
+    'Currency': 'currency',
+    'StartingRange': 'beginRange',
+    'Product Family': 'productFamily',
+    'serviceCode': 'servicecode',
+    'Region Code': 'regionCode',
+    'Instance Type': 'instanceType',
+    'Operating System': 'operatingSystem',
+    'Tenancy': 'tenancy',
+    'Pre Installed S/W': 'preInstalledSw',
+    'License Model': 'licenseModel',
+    'CapacityStatus': 'capacitystatus',
+    'Volume API Name': 'volumeApiName',
+    'Volume Type': 'volumeType',
+    'Database Engine': 'databaseEngine',
+    'Deployment Option': 'deploymentOption',
+    'usageType': 'usagetype'
+}
+
+# EBS snapshot usage types (after the region prefix) and the storage tier they price
+EBS_SNAPSHOT_USAGE = {
+    'EBS:SnapshotUsage': 'standard',
+    'EBS:SnapshotArchiveStorage': 'archive'
+}
+
+# S3 'Volume Type' values and the storage class they price
+S3_VOLUME_TYPES = {
+    'Standard': 'standard',
+    'Standard - Infrequent Access': 'standard_ia',
+    'One Zone - Infrequent Access': 'onezone_ia',
+    'Reduced Redundancy': 'reduced_redundancy',
+    'Intelligent-Tiering Frequent Access': 'intelligent_tiering',
+    'Glacier Instant Retrieval': 'glacier_ir',
+    'Amazon Glacier': 'glacier',
+    'Glacier Flexible Retrieval': 'glacier',
+    'Glacier Deep Archive': 'deep_archive',
+    'Express One Zone': 'express_onezone'
+}
+
+# RDS 'Volume Type' values and the StorageType they price
+RDS_VOLUME_TYPES = {
+    'General Purpose': 'gp2',
+    'General Purpose-GP3': 'gp3',
+    'Provisioned IOPS': 'io1',
+    'Provisioned IOPS-IO2': 'io2',
+    'Magnetic': 'standard'
+}
+
+# DescribeDBInstances engines and the price list 'Database Engine' they map to
+RDS_ENGINES = {
+    'mysql': 'mysql',
+    'postgres': 'postgresql',
+    'mariadb': 'mariadb',
+    'aurora-mysql': 'aurora mysql',
+    'aurora-postgresql': 'aurora postgresql',
+    'oracle-ee': 'oracle',
+    'oracle-ee-cdb': 'oracle',
+    'oracle-se2': 'oracle',
+    'oracle-se2-cdb': 'oracle',
+    'sqlserver-ee': 'sql server',
+    'sqlserver-se': 'sql server',
+    'sqlserver-ex': 'sql server',
+    'sqlserver-web': 'sql server',
+    'db2-se': 'db2',
+    'db2-ae': 'db2'
+}
+
+
+def rds_engine(engine):
+    """Price list engine name for a DescribeDBInstances engine."""
+    return RDS_ENGINES.get(engine, engine)
+
+
+def rds_deployment(multi_az):
+    """Price list deployment option for an instance's MultiAZ flag."""
+    return 'multi-az' if multi_az else 'single-az'
+
+
+def _key_hash(parts):
+    key = '|'.join(str(part).lower() for part in parts)
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+
+
+def price_key(attributes):
+    """
+    The index key and monthly price for one offer file price dimension, or
+    None when it is not one the analyzers use.
+    """
+    if attributes.get('termType') != 'OnDemand' or attributes.get('currency', 'USD') != 'USD':
+        return None
+    try:
+        price = float(attributes.get('price') or 0)
+    except ValueError:
+        return None
+    region = attributes.get('regionCode')
+    if price <= 0 or not region:
+        return None
+
+    family = attributes.get('productFamily')
+    unit = attributes.get('unit', '').lower()
+    service = attributes.get('servicecode')
+    # Usage types carry a region prefix outside us-east-1 ('USW2-EBS:SnapshotUsage')
+    usage = attributes.get('usagetype', '').split('-', 1)[-1]
+
+    # Idle public IPv4 addresses moved from the EC2 to the VPC offer
+    if service in ('AmazonEC2', 'AmazonVPC') and family == 'IP Address' and unit == 'hrs':
+        if usage.endswith('IdleAddress'):
+            return ('eip', region), price * HOURS_PER_MONTH
+        return None
+
+    if service == 'AmazonEC2':
+        if family == 'Storage Snapshot' and unit == 'gb-mo' and usage in EBS_SNAPSHOT_USAGE:
+            return ('ebs-snapshot', region, EBS_SNAPSHOT_USAGE[usage]), price
+        if family == 'Compute Instance' and unit == 'hrs':
+            if (attributes.get('operatingSystem') == 'Linux' and attributes.get('tenancy') == 'Shared'
+                    and attributes.get('preInstalledSw') == 'NA' and attributes.get('capacitystatus') == 'Used'):
+                return ('ec2', region, attributes['instanceType']), price * HOURS_PER_MONTH
+        volume = attributes.get('volumeApiName')
+        if volume:
+            if family == 'Storage' and unit == 'gb-mo':
+                return ('ebs', region, volume), price
+            if family == 'System Operation' and unit == 'iops-mo':
+                return ('ebs-iops', region, volume), price
+            if family == 'Provisioned Throughput' and unit.endswith('ps-mo'):
+                # Throughput is priced per GiBps-mo in some files and MiBps-mo in others
+                return ('ebs-throughput', region, volume), price / 1024 if unit.startswith('gibps') else price
+
+    elif service == 'AmazonRDS':
+        if family == 'Storage Snapshot' and unit == 'gb-mo':
+            # Manual snapshots and backups beyond the free allowance (the instances' storage)
+            if usage.endswith('ChargedBackupUsage'):
+                return ('rds-snapshot', region), price
+            return None
+        deployment = attributes.get('deploymentOption', '').lower()
+        if deployment not in ('single-az', 'multi-az'):
+            return None
+        if family == 'Database Instance' and unit == 'hrs':
+            key = ('rds', region, attributes['instanceType'], attributes.get('databaseEngine', ''), deployment)
+            return key, price * HOURS_PER_MONTH
+        if family == 'Database Storage' and unit == 'gb-mo':
+            storage_type = RDS_VOLUME_TYPES.get(attributes.get('volumeType'))
+            if storage_type:
+                return ('rds-storage', region, storage_type, deployment), price
+
+    elif service == 'AmazonS3':
+        storage_class = S3_VOLUME_TYPES.get(attributes.get('volumeType'))
+        if family == 'Storage' and unit == 'gb-mo' and storage_class and float(attributes.get('beginRange') or 0) == 0:
+            return ('s3', region, storage_class), price
+
+    return None
+
+
+def iter_csv_offer(path):
+    """Price dimensions of a CSV offer file, as attribute dicts."""
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        # The column header follows a few metadata rows
+        for header in reader:
+            if header and header[0] == 'SKU':
+                break
+        else:
+            return
+        columns = [(index, CSV_COLUMNS[name]) for index, name in enumerate(header) if name in CSV_COLUMNS]
+        for row in reader:
+            yield {attribute: row[index] for index, attribute in columns if index < len(row)}
+
+
+def iter_json_offer(path):
+    """
+    Price dimensions of a JSON offer file, as attribute dicts. The whole
+    file is loaded, so prefer CSV for the large EC2 offer.
+    """
+    with open(path, encoding='utf-8') as f:
+        offer = json.load(f)
+
+    products = offer.get('products', {})
+    for sku, terms in offer.get('terms', {}).get('OnDemand', {}).items():
+        product = products.get(sku)
+        if product is None:
+            continue
+        base = dict(product.get('attributes', {}))
+        base['productFamily'] = product.get('productFamily')
+        base['termType'] = 'OnDemand'
+        for term in terms.values():
+            for dimension in term.get('priceDimensions', {}).values():
+                attributes = dict(base)
+                attributes['unit'] = dimension.get('unit', '')
+                attributes['price'] = dimension.get('pricePerUnit', {}).get('USD')
+                attributes['beginRange'] = dimension.get('beginRange', '0')
+                yield attributes
+
+
+def build_index(offer_paths, index_path):
+    """Reduce offer files to a pricing index file. Returns the number of prices."""
+    prices = {}
+    for path in offer_paths:
+        rows = iter_json_offer(path) if path.endswith('.json') else iter_csv_offer(path)
+        for attributes in rows:
+            entry = price_key(attributes)
+            if entry is None:
+                continue
+            key_hash = _key_hash(entry[0])
+            # Several license models and variants can match; keep the lowest price
+            if key_hash not in prices or entry[1] < prices[key_hash]:
+                prices[key_hash] = entry[1]
+
+    hashes = sorted(prices)
+    directory = os.path.dirname(os.path.abspath(index_path))
+    temporary = os.path.join(directory, f'.{os.path.basename(index_path)}.{os.getpid()}')
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(hashes)))
+        array('Q', hashes).tofile(f)
+        array('d', (prices[key_hash] for key_hash in hashes)).tofile(f)
+    os.replace(temporary, index_path)
+    return len(hashes)
+
+
+class PricingIndex:
+    """
+    Memory-mapped monthly price lookups. A missing index file gives an empty
+    index whose lookups return None.
+
+    Usage:
+        prices = PricingIndex('pricing.idx')
+        prices.monthly('ec2', 'us-east-1', 'm5.large')
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.loaded_at = time.monotonic()
+        self._mmap = None
+        self._hashes = ()
+        self._prices = ()
+
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, count = HEADER.unpack_from(self._mmap)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'Not a pricing index: {path}')
+            view = memoryview(self._mmap)
+            start = HEADER.size
+            self._hashes = view[start:start + count * 8].cast('Q')
+            self._prices = view[start + count * 8:start + count * 16].cast('d')
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def monthly(self, *key):
+        """Monthly USD price for a key, or None when it is not in the index."""
+        key_hash = _key_hash(key)
+        index = bisect_left(self._hashes, key_hash)
+        if index < len(self._hashes) and self._hashes[index] == key_hash:
+            return self._prices[index]
+        return None
+
+
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def shared_index(clients=None, location=DEFAULT_INDEX, ttl_seconds=DEFAULT_TTL_SECONDS):
+    """
+    Return a module-scope PricingIndex, so warm invocations reuse it. It is
+    reloaded (and downloaded again for s3:// locations) once older than
+    `ttl_seconds`. Errors give an empty index rather than failing the run.
+    """
+    global _shared_index
+    index = _shared_index
+    if index is not None and time.monotonic() - index.loaded_at < ttl_seconds:
+        return index
+
+    with _shared_lock:
+        index = _shared_index
+        if index is None or time.monotonic() - index.loaded_at >= ttl_seconds:
+            try:
+                index = PricingIndex(_local_index(clients, location))
+                print(f"Loaded pricing index with {len(index)} prices from {location or '(none)'}")
+            except Exception as e:
+                print(f"Error loading pricing index {location}: {str(e)}")
+                index = PricingIndex()
+            _shared_index = index
+    return index
+
+
+def _local_index(clients, location):
+    if not location.startswith('s3://'):
+        return location
+
+    bucket, _, key = location[len('s3://'):].partition('/')
+    path = f'/tmp/pricing-{int(time.time())}.idx'
+    clients.client('s3').download_file(bucket, key, path)
+
+    # Earlier downloads can be unlinked, their mappings stay valid until released
+    for name in os.listdir('/tmp'):
+        if name.startswith('pricing-') and name.endswith('.idx') and os.path.join('/tmp', name) != path:
+            os.remove(os.path.join('/tmp', name))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a pricing index from AWS price list offer files')
+    parser.add_argument('offers', nargs='+', help='Offer files (.csv or .json)')
+    parser.add_argument('--output', required=True, help='Index file to write')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    count = build_index(args.offers, args.output)
+    print(f"Wrote {count} prices to {args.output} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
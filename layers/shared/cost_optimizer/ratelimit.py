@@ -0,0 +1,216 @@
+"""
+Throttle-aware rate limiting for every AWS API call made through ClientPool.
+
+Each (service, region) gets one token bucket shared by all threads and
+clients (one per account, as API limits are, when scanning other accounts
+through assumed roles). Its rate adapts AIMD-style: every successful call raises it a
+little, a throttling error halves it. Retries are taken over from botocore
+and only happen while the service's retry budget (a fraction of its
+successful calls) allows, so a throttled service is not hammered further.
+
+Per-service counters are kept so a run can tell calls that returned nothing
+apart from calls that failed.
+"""
+import random
+import threading
+import time
+
+THROTTLE_ERRORS = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+    'RequestThrottled', 'SlowDown', 'BandwidthLimitExceeded', 'EC2ThrottledException',
+    'PriorRequestNotComplete', 'TransactionInProgressException'
+}
+TRANSIENT_STATUS_CODES = {500, 502, 503, 504}
+
+# Starting requests per second per service and region; the rate can grow to 4x
+SERVICE_RATES = {
+    'cloudwatch': 50.0,
+    'ec2': 20.0,
+    'rds': 10.0,
+    's3': 100.0,
+    'dynamodb': 100.0,
+    'sts': 20.0
+}
+DEFAULT_RATE = 20.0
+MAX_RATE_FACTOR = 4.0
+MIN_RATE = 0.5
+
+MAX_ATTEMPTS = 8
+BASE_DELAY = 0.1
+MAX_DELAY = 20.0
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose rate follows AIMD: +1 request/s per `rate` successes
+    (about +1/s every second at full speed) and halved on throttling, at
+    most once per `cooldown` seconds.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, max_rate=None, min_rate=MIN_RATE, cooldown=1.0):
+        self.rate = rate
+        self.max_rate = max_rate or rate * MAX_RATE_FACTOR
+        self.min_rate = min_rate
+        self.cooldown = cooldown
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # Allow bursts of up to one second's worth of requests
+                self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + 1.0 / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._last_decrease = now
+
+
+class RetryBudget:
+    """
+    Retries allowed as a fraction of successful calls: each success deposits
+    `ratio` tokens (up to `capacity`), each retry withdraws one.
+    """
+
+    def __init__(self, ratio=0.2, initial=10.0, capacity=100.0):
+        self.ratio = ratio
+        self.capacity = capacity
+        self._balance = initial
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def withdraw(self):
+        """Take a retry token. False when the budget is spent."""
+        with self._lock:
+            if self._balance < 1.0:
+                return False
+            self._balance -= 1.0
+            return True
+
+
+class ServiceThrottle:
+    """Limiter, retry budget and call counters for one service in one region."""
+
+    def __init__(self, service):
+        self.service = service
+        self.limiter = AdaptiveRateLimiter(SERVICE_RATES.get(service, DEFAULT_RATE))
+        self.budget = RetryBudget()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {
+                'calls': 0, 'succeeded': 0, 'errors': 0, 'failed': 0,
+                'throttles': 0, 'retries': 0, 'retry_budget_exhausted': 0
+            }
+
+    def count(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counters[name] += value
+
+    def before_send(self, **kwargs):
+        self.limiter.acquire()
+
+    def needs_retry(self, response=None, attempts=1, caught_exception=None, **kwargs):
+        """
+        botocore needs-retry handler: adapt the rate to the outcome of an
+        attempt and return the delay before retrying, or None to stop.
+        """
+        status, error_code = None, None
+        if response is not None:
+            status = response[0].status_code
+            error_code = response[1].get('Error', {}).get('Code')
+
+        throttled = error_code in THROTTLE_ERRORS or status == 429
+        transient = caught_exception is not None or status in TRANSIENT_STATUS_CODES
+
+        if not throttled and not transient:
+            self.limiter.on_success()
+            if error_code or (status is not None and status >= 300):
+                # Answered but refused (missing config, access denied, ...)
+                self.count(calls=1, errors=1)
+            else:
+                self.budget.deposit()
+                self.count(calls=1, succeeded=1)
+            return None
+
+        if throttled:
+            self.limiter.on_throttle()
+            self.count(throttles=1)
+
+        if attempts >= MAX_ATTEMPTS:
+            self.count(calls=1, failed=1)
+            return None
+        if not self.budget.withdraw():
+            self.count(calls=1, failed=1, retry_budget_exhausted=1)
+            return None
+
+        self.count(retries=1)
+        # Full jitter on top of the limiter's pacing
+        return random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempts)))
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        counters['rate_per_second'] = round(self.limiter.rate, 1)
+        return counters
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def service_throttle(service, region, account_id=None):
+    """The shared ServiceThrottle for a service and region (of another account when `account_id` is set)."""
+    key = (service, region, account_id)
+    throttle = _throttles.get(key)
+    if throttle is None:
+        with _throttles_lock:
+            throttle = _throttles.setdefault(key, ServiceThrottle(service))
+    return throttle
+
+
+def attach(client, service, region, account_id=None):
+    """Route a client's requests through the shared limiter and retry policy for its service."""
+    throttle = service_throttle(service, region, account_id)
+    service_id = client.meta.service_model.service_id.hyphenize()
+    client.meta.events.register(f'request-created.{service_id}', throttle.before_send)
+    # Registered first so it decides before botocore's own (disabled) retry handler
+    client.meta.events.register_first(f'needs-retry.{service_id}', throttle.needs_retry)
+    return client
+
+
+def api_stats():
+    """Call counters and current rate per 'service:region', or 'service:region:account' for other accounts."""
+    return {
+        ':'.join(part for part in key if part): throttle.stats() for key, throttle in list(_throttles.items())
+    }
+
+
+def reset_stats():
+    """Zero the counters at the start of an invocation; learned rates are kept."""
+    for throttle in list(_throttles.values()):
+        throttle.reset()
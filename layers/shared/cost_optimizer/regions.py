@@ -0,0 +1,71 @@
+"""
+Multi-region scan mode: run an analyzer's per-region function across
+regions on a worker pool and report on each region.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_REGION_WORKERS = int(os.environ.get('REGION_WORKERS', '8'))
+
+
+def resolve_regions(event, clients):
+    """
+    Get the regions to scan from event['regions'] or the SCAN_REGIONS
+    environment variable (list or comma-separated string). 'all' discovers
+    every enabled region with describe_regions. Defaults to the Lambda's
+    own region. A shard worker scans its shard's region only.
+    """
+    if event.get('shard'):
+        return [event['shard']['region']]
+
+    regions = event.get('regions') or os.environ.get('SCAN_REGIONS', '')
+    if isinstance(regions, str):
+        regions = [region.strip() for region in regions.split(',') if region.strip()]
+
+    if regions == ['all']:
+        response = clients.client('ec2').describe_regions(
+            Filters=[{'Name': 'opt-in-status', 'Values': ['opt-in-not-required', 'opted-in']}]
+        )
+        return sorted(region['RegionName'] for region in response['Regions'])
+
+    return regions or [clients.region]
+
+
+def scan_regions(regions, analyze_region, max_workers=DEFAULT_REGION_WORKERS):
+    """
+    Call analyze_region(region) for every region in parallel. It should
+    emit its findings itself and return how many it produced.
+
+    Returns a per-region report with the findings count, wall time and
+    error (if any). A failing region is reported and does not stop the others.
+    """
+    region_report = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(regions)))) as executor:
+        futures = {executor.submit(_timed_scan, analyze_region, region): region for region in regions}
+
+        for future in as_completed(futures):
+            region = futures[future]
+            findings_count, seconds, error = future.result()
+
+            region_report[region] = {
+                'findings_count': findings_count,
+                'seconds': round(seconds, 2)
+            }
+            if error:
+                region_report[region]['error'] = error
+
+    return region_report
+
+
+def _timed_scan(analyze_region, region):
+    started = time.monotonic()
+    try:
+        findings_count = analyze_region(region)
+        error = None
+    except Exception as e:
+        print(f"Error scanning region {region}: {str(e)}")
+        findings_count = 0
+        error = str(e)
+    return findings_count, time.monotonic() - started, error
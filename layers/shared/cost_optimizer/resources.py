@@ -0,0 +1,142 @@
+"""
+Streaming resource enumeration over boto3 paginators.
+
+Each generator yields one resource at a time as pages arrive, so callers
+can start analysis on the first page and never hold the full listing.
+"""
+from itertools import islice
+
+
+class ListingCursor:
+    """
+    Resumable position in a paginated listing: the service token of the page
+    holding the next resource and how many of that page's resources were
+    already yielded. Generators given a cursor keep it up to date and start
+    from it, so a listing can stop after any resource and be resumed later.
+    """
+
+    def __init__(self, position=None):
+        position = position or {}
+        self.token = position.get('token')
+        self.skip = position.get('skip', 0)
+        self.done = position.get('done', False)
+
+    def position(self):
+        """The current position as a JSON-serializable dict."""
+        return {'token': self.token, 'skip': self.skip, 'done': self.done}
+
+
+def _paginate(paginator, token_key, items_of, cursor=None, **kwargs):
+    cursor = cursor or ListingCursor()
+    if cursor.done:
+        return
+    if cursor.token:
+        kwargs[token_key] = cursor.token
+
+    page_token, skip = cursor.token, cursor.skip
+    for page in paginator.paginate(**kwargs):
+        for index, item in enumerate(items_of(page)):
+            if index < skip:
+                continue
+            cursor.token, cursor.skip = page_token, index + 1
+            yield item
+        page_token, skip = page.get(token_key), 0
+        cursor.token, cursor.skip = page_token, 0
+    cursor.done = True
+
+
+def iter_instances(ec2, states=('running',), cursor=None, instance_ids=None):
+    """Yield EC2 instances, filtered server-side by instance state and optionally by id."""
+    filters = []
+    if states:
+        filters.append({'Name': 'instance-state-name', 'Values': list(states)})
+    if instance_ids:
+        filters.append({'Name': 'instance-id', 'Values': list(instance_ids)})
+
+    def instances(page):
+        return [instance for reservation in page['Reservations'] for instance in reservation['Instances']]
+
+    yield from _paginate(ec2.get_paginator('describe_instances'), 'NextToken', instances, cursor, Filters=filters)
+
+
+def iter_volumes(ec2, cursor=None, volume_ids=None):
+    """Yield every EBS volume, or only the given ones."""
+    # Filters rather than VolumeIds, so volumes deleted in the meantime are simply missing
+    filters = [{'Name': 'volume-id', 'Values': list(volume_ids)}] if volume_ids else []
+    yield from _paginate(
+        ec2.get_paginator('describe_volumes'), 'NextToken', lambda page: page['Volumes'], cursor, Filters=filters
+    )
+
+
+def iter_db_instances(rds, cursor=None, db_instance_ids=None, db_cluster_ids=None):
+    """Yield every RDS DB instance, or only the given ones (or the members of the given clusters)."""
+    filters = [{'Name': 'db-instance-id', 'Values': list(db_instance_ids)}] if db_instance_ids else []
+    if db_cluster_ids:
+        filters.append({'Name': 'db-cluster-id', 'Values': list(db_cluster_ids)})
+    yield from _paginate(
+        rds.get_paginator('describe_db_instances'), 'Marker', lambda page: page['DBInstances'], cursor,
+        Filters=filters
+    )
+
+
+def iter_db_clusters(rds, cursor=None, db_cluster_ids=None):
+    """Yield every RDS DB cluster (Aurora and Multi-AZ DB clusters), or only the given ones."""
+    filters = [{'Name': 'db-cluster-id', 'Values': list(db_cluster_ids)}] if db_cluster_ids else []
+    yield from _paginate(
+        rds.get_paginator('describe_db_clusters'), 'Marker', lambda page: page['DBClusters'], cursor,
+        Filters=filters
+    )
+
+
+def iter_snapshots(ec2, cursor=None, page_size=1000):
+    """Yield the account's own EBS snapshots, `page_size` per describe_snapshots call."""
+    yield from _paginate(
+        ec2.get_paginator('describe_snapshots'), 'NextToken', lambda page: page['Snapshots'], cursor,
+        OwnerIds=['self'], PaginationConfig={'PageSize': page_size}
+    )
+
+
+def iter_images(ec2):
+    """Yield the account's own AMIs."""
+    yield from _paginate(
+        ec2.get_paginator('describe_images'), 'NextToken', lambda page: page['Images'], Owners=['self']
+    )
+
+
+def iter_db_snapshots(rds, cursor=None, snapshot_type='manual'):
+    """Yield RDS DB snapshots of a type ('manual', 'automated', ...)."""
+    yield from _paginate(
+        rds.get_paginator('describe_db_snapshots'), 'Marker', lambda page: page['DBSnapshots'], cursor,
+        SnapshotType=snapshot_type
+    )
+
+
+def iter_buckets(s3, cursor=None, names=None):
+    """Yield every S3 bucket, or only the named ones."""
+    buckets = _paginate(s3.get_paginator('list_buckets'), 'ContinuationToken', lambda page: page['Buckets'], cursor)
+    if names:
+        names = set(names)
+        buckets = (bucket for bucket in buckets if bucket['Name'] in names)
+    yield from buckets
+
+
+def iter_objects(s3, bucket_name, max_objects=None):
+    """Yield objects in a bucket, stopping after max_objects when given."""
+    paginator = s3.get_paginator('list_objects_v2')
+    pagination_config = {'PageSize': 1000}
+    if max_objects:
+        pagination_config['MaxItems'] = max_objects
+
+    for page in paginator.paginate(Bucket=bucket_name, PaginationConfig=pagination_config):
+        for obj in page.get('Contents', []):
+            yield obj
+
+
+def chunked(iterable, size):
+    """Group an iterable into lists of at most `size` items without reading ahead."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,203 @@
+"""
+Vectorized EC2 rightsizing over hourly CPU and network series.
+
+The series of a batch of instances are aligned into (instances x periods)
+NumPy arrays, and percentiles, peak-to-mean ratios and idle fractions are
+computed for all instances in single passes. Each instance then gets the
+smallest size in its family whose capacity keeps the projected p99 CPU
+under TARGET_PEAK_PERCENT.
+
+NumPy is imported lazily so the other analyzers do not pay for it.
+"""
+import math
+import os
+
+# Projected p99 CPU the recommended size should stay under
+TARGET_PEAK_PERCENT = float(os.environ.get('RIGHTSIZING_TARGET_PEAK', '80'))
+
+# An hour is idle when CPU and network traffic are both below these
+IDLE_CPU_PERCENT = 5.0
+IDLE_NETWORK_BYTES = 5 * 1024 * 1024
+
+# Instances with fewer hourly datapoints get no recommendation
+MIN_DATAPOINTS = 24
+
+PERCENTILES = (50, 95, 99)
+
+# Relative capacity per size (the EC2 normalization factors)
+SIZE_FACTORS = {
+    'nano': 0.25, 'micro': 0.5, 'small': 1, 'medium': 2, 'large': 4, 'xlarge': 8,
+    '2xlarge': 16, '3xlarge': 24, '4xlarge': 32, '6xlarge': 48, '8xlarge': 64,
+    '9xlarge': 72, '10xlarge': 80, '12xlarge': 96, '16xlarge': 128, '18xlarge': 144,
+    '24xlarge': 192, '32xlarge': 256, '48xlarge': 384
+}
+
+# Sizes that exist per family, smallest first; recommendations stay within
+# these, and families not listed get none. Metal sizes are never recommended.
+_BURSTABLE = ('nano', 'micro', 'small', 'medium', 'large', 'xlarge', '2xlarge')
+_TO_24XL = ('large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge', '16xlarge', '24xlarge')
+_TO_32XL = _TO_24XL + ('32xlarge',)
+_TO_48XL = _TO_32XL + ('48xlarge',)
+_GRAVITON = ('medium', 'large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge', '16xlarge')
+FAMILY_SIZES = {
+    **dict.fromkeys(('t2', 't3', 't3a', 't4g'), _BURSTABLE),
+    'm4': ('large', 'xlarge', '2xlarge', '4xlarge', '10xlarge', '16xlarge'),
+    'c4': ('large', 'xlarge', '2xlarge', '4xlarge', '8xlarge'),
+    'r4': ('large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '16xlarge'),
+    **dict.fromkeys((
+        'm5', 'm5d', 'm5a', 'm5ad', 'm5n', 'm5dn', 'c5a', 'c5ad',
+        'r5', 'r5d', 'r5a', 'r5ad', 'r5n', 'r5dn', 'r5b'
+    ), _TO_24XL),
+    'm5zn': ('large', 'xlarge', '2xlarge', '3xlarge', '6xlarge', '12xlarge'),
+    **dict.fromkeys(('c5', 'c5d'), (
+        'large', 'xlarge', '2xlarge', '4xlarge', '9xlarge', '12xlarge', '18xlarge', '24xlarge'
+    )),
+    'c5n': ('large', 'xlarge', '2xlarge', '4xlarge', '9xlarge', '18xlarge'),
+    **dict.fromkeys(('m6i', 'm6id', 'c6i', 'c6id', 'r6i', 'r6id'), _TO_32XL),
+    **dict.fromkeys(('m6a', 'c6a', 'r6a'), _TO_48XL),
+    **dict.fromkeys(('m6g', 'm6gd', 'c6g', 'c6gd', 'c6gn', 'r6g', 'r6gd', 'm7g', 'm7gd', 'c7g', 'c7gd', 'r7g', 'r7gd'),
+                    _GRAVITON),
+    **dict.fromkeys(('m7i', 'c7i', 'r7i'), _TO_24XL + ('48xlarge',)),
+    'm7i-flex': ('large', 'xlarge', '2xlarge', '4xlarge', '8xlarge'),
+    **dict.fromkeys(('m7a', 'c7a', 'r7a'), ('medium',) + _TO_48XL),
+}
+
+def series_matrix(metrics, resource_ids, key):
+    """
+    Align a metric's series for several resources on the engine's period
+    grid. Returns a (resources x periods) float array with NaN where a
+    period has no datapoint.
+    """
+    import numpy as np
+
+    periods = int(metrics.days * 86400 // metrics.period)
+    matrix = np.full((len(resource_ids), periods), np.nan)
+    if metrics.end_time is None:
+        return matrix
+    # The last column is the period ending at end_time (or holding it, for a rolling window)
+    end_slot = math.ceil(metrics.end_time.timestamp() / metrics.period) - 1
+
+    for row, resource_id in enumerate(resource_ids):
+        timestamps, values = metrics.series(resource_id, key)
+        if not values:
+            continue
+        slots = np.fromiter((timestamp.timestamp() for timestamp in timestamps), float, len(timestamps))
+        columns = periods - 1 - (end_slot - (slots // metrics.period).astype(np.int64))
+        in_range = (columns >= 0) & (columns < periods)
+        matrix[row, columns[in_range]] = np.asarray(values, dtype=float)[in_range]
+
+    return matrix
+
+
+def utilization_stats(cpu, network=None, idle_cpu=IDLE_CPU_PERCENT, idle_network=IDLE_NETWORK_BYTES):
+    """
+    Per-row utilization statistics of a (resources x periods) CPU array,
+    NaN meaning no datapoint. `network` is an optional array of the same
+    shape with the bytes in + out per period.
+
+    Returns a dict of 1-D arrays: datapoints, mean, p50, p95, p99, peak,
+    peak_to_mean and idle_fraction.
+    """
+    import numpy as np
+
+    valid = ~np.isnan(cpu)
+    counts = valid.sum(axis=1)
+    safe_counts = np.maximum(counts, 1)
+
+    # Sorting puts NaN last, so row i holds its counts[i] datapoints first
+    ordered = np.sort(cpu, axis=1)
+    positions = (np.maximum(counts, 1) - 1)[:, None] * (np.array(PERCENTILES) / 100.0)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.ceil(positions).astype(np.int64)
+    low_values = np.take_along_axis(ordered, lower, axis=1)
+    high_values = np.take_along_axis(ordered, upper, axis=1)
+    percentiles = low_values + (high_values - low_values) * (positions - lower)
+    percentiles = np.where(counts[:, None] > 0, percentiles, 0.0)
+
+    mean = np.where(valid, cpu, 0.0).sum(axis=1) / safe_counts
+    peak = np.where(counts > 0, np.take_along_axis(ordered, (safe_counts - 1)[:, None], axis=1)[:, 0], 0.0)
+    peak_to_mean = np.divide(peak, mean, out=np.zeros_like(peak), where=mean > 0)
+
+    idle = valid & (cpu < idle_cpu)
+    if network is not None:
+        idle &= np.isnan(network) | (network < idle_network)
+    idle_fraction = idle.sum(axis=1) / safe_counts
+
+    return {
+        'datapoints': counts,
+        'mean': mean,
+        'p50': percentiles[:, 0],
+        'p95': percentiles[:, 1],
+        'p99': percentiles[:, 2],
+        'peak': peak,
+        'peak_to_mean': peak_to_mean,
+        'idle_fraction': idle_fraction
+    }
+
+
+def recommend_types(instance_types, p99, datapoints, target=TARGET_PEAK_PERCENT, min_datapoints=MIN_DATAPOINTS):
+    """
+    The smallest instance type in each instance's family whose capacity keeps
+    the projected p99 CPU under `target`, or None when the current size is
+    already the right one (or the family or size is unknown, or there is too
+    little data). Only sizes in FAMILY_SIZES are recommended.
+    """
+    import numpy as np
+
+    families, factors = [], []
+    for instance_type in instance_types:
+        family, _, size = instance_type.partition('.')
+        families.append(family)
+        factors.append(SIZE_FACTORS.get(size, np.nan))
+    factors = np.array(factors, dtype=float)
+
+    # Capacity needed for the observed p99 to land at the target utilization
+    required = factors * np.asarray(p99, dtype=float) / target
+    eligible = ~np.isnan(factors) & (np.asarray(datapoints) >= min_datapoints)
+    family_array = np.array(families, dtype=object)
+
+    recommended = [None] * len(families)
+    for family in set(families):
+        sizes = FAMILY_SIZES.get(family)
+        if sizes is None:
+            continue
+        ladder = np.array([SIZE_FACTORS[size] for size in sizes])
+        choice = np.searchsorted(ladder, required, side='left').clip(max=len(ladder) - 1)
+        downsize = eligible & (family_array == family) & (ladder[choice] < factors)
+        for index in np.flatnonzero(downsize):
+            recommended[index] = f'{family}.{sizes[choice[index]]}'
+
+    return recommended
+
+
+def rightsize(metrics, instances):
+    """
+    Utilization statistics and a recommended type for a batch of instances
+    whose CPUUtilization (Average), NetworkIn and NetworkOut (Sum) series
+    were resolved on `metrics`. Returns one dict per instance.
+    """
+    if not instances:
+        return []
+
+    instance_ids = [instance['InstanceId'] for instance in instances]
+    cpu = series_matrix(metrics, instance_ids, 'CPUUtilization')
+    network = series_matrix(metrics, instance_ids, 'NetworkIn') + series_matrix(metrics, instance_ids, 'NetworkOut')
+
+    stats = utilization_stats(cpu, network)
+    recommended = recommend_types(
+        [instance['InstanceType'] for instance in instances], stats['p99'], stats['datapoints']
+    )
+
+    columns = {name: values.tolist() for name, values in stats.items()}
+    return [
+        {
+            'datapoints': columns['datapoints'][row],
+            'cpu_p50_percent': round(columns['p50'][row], 2),
+            'cpu_p95_percent': round(columns['p95'][row], 2),
+            'cpu_p99_percent': round(columns['p99'][row], 2),
+            'cpu_peak_to_mean': round(columns['peak_to_mean'][row], 2),
+            'idle_hours_fraction': round(columns['idle_fraction'][row], 3),
+            'recommended_type': recommended[row]
+        }
+        for row in range(len(instances))
+    ]
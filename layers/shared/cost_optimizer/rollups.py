@@ -0,0 +1,467 @@
+"""
+Per-resource daily rollups and a query API for trend and top-N questions.
+
+Findings accumulate one item per resource per run, so a question like
+"which volumes have been idle for 30 days" means scanning every finding
+ever written. The rollup stage instead keeps one item per resource in the
+rollups table (partition '<type>#<region>', or '<type>#<account>/<region>'
+for other accounts, sort key resource id) holding a columnar float32 array
+per field with one slot per day, plus one item per resource type and day
+with running totals over every account (partition 'AGGREGATE#<type>').
+
+Queries read a single partition with Query, align its series into
+(resources x days) NumPy arrays and answer in vectorized passes:
+
+    frame = load_frame(dynamodb, 'EBS', 'us-east-1')
+    idle_resources(frame, ['read_ops_7d', 'write_ops_7d'], days=30)
+    top_resources(frame, 'monthly_cost', n=10)
+    growing_resources(frame, 'size_gb', days=90)
+
+Or from the command line:
+    python -m cost_optimizer.rollups idle --type EBS --region us-east-1 \\
+        --fields read_ops_7d,write_ops_7d --days 30
+
+Missing days (runs that skipped a resource, failed metrics) are NaN and
+are left out of the statistics. NumPy is only imported by the queries.
+"""
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+
+from cost_optimizer.forecasting import linear_trends
+from cost_optimizer.sink import FindingSink
+from cost_optimizer.state import MAX_KEYS_PER_GET
+
+DEFAULT_ROLLUP_TABLE = os.environ.get('ROLLUP_TABLE', 'CostOptimizerRollups')
+
+# Days of history kept per resource
+DEFAULT_ROLLUP_DAYS = int(os.environ.get('ROLLUP_DAYS', '400'))
+
+# Finding metadata fields rolled up per resource type
+ROLLUP_FIELDS = {
+    'EC2': ('cpu_avg_percent', 'cpu_p95_percent', 'idle_hours_fraction', 'network_in_mb', 'network_out_mb'),
+    'EBS': ('size_gb', 'read_ops_7d', 'write_ops_7d', 'read_gb_7d', 'write_gb_7d'),
+    'RDS': ('storage_gb', 'free_storage_gb', 'cpu_avg_percent', 'connections_max', 'read_iops_avg', 'write_iops_avg'),
+    'RDS_CLUSTER': ('volume_used_gb', 'cpu_avg_percent', 'connections_max'),
+    'S3': ('size_gb', 'object_count', 'get_requests_7d', 'put_requests_7d'),
+    'EBS_SNAPSHOT': ('storage_gb', 'age_days'),
+    'RDS_SNAPSHOT': ('storage_gb', 'age_days')
+}
+# Rolled up for every type, from the finding's cost estimate
+COST_FIELDS = ('monthly_cost', 'monthly_savings')
+
+AGGREGATE_PREFIX = 'AGGREGATE#'
+
+
+def use_rollups(event):
+    """Check event['rollups'] or ROLLUPS for the rollup stage."""
+    value = event.get('rollups', os.environ.get('ROLLUPS', 'false'))
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def series_name(resource_type, region, account_id=None):
+    """Partition of a type's resources in a region (of another account when `account_id` is set)."""
+    return f'{resource_type}#{account_id}/{region}' if account_id else f'{resource_type}#{region}'
+
+
+def today():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+def _day_offset(start_day, day):
+    return (datetime.strptime(day, '%Y-%m-%d') - datetime.strptime(start_day, '%Y-%m-%d')).days
+
+
+def _shift_day(day, days):
+    return (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def _pack(values):
+    return array('f', values).tobytes()
+
+
+def _unpack(data):
+    values = array('f')
+    values.frombytes(data)
+    return values
+
+
+def _number(value):
+    """A finite float, or NaN for missing and non-numeric values."""
+    if isinstance(value, bool) or value is None:
+        return math.nan
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return math.nan
+    return value if math.isfinite(value) else math.nan
+
+
+def finding_values(finding):
+    """The rolled up fields of a Finding, NaN where unknown."""
+    metadata = finding.metadata or {}
+    values = {}
+    for name in ROLLUP_FIELDS.get(finding.resource_type, ()):
+        # Zeros from metric queries that failed are unknown, not idle
+        values[name] = math.nan if metadata.get('metrics_failed') else _number(metadata.get(name))
+    values['monthly_cost'] = _number(finding.monthly_cost)
+    values['monthly_savings'] = _number(finding.monthly_savings)
+    return values
+
+
+class RollupStore:
+    """
+    Add each run's findings to the per-resource series and per-type totals.
+    Used like ScanState: record() the findings of a batch, then save().
+
+    Re-running on the same day overwrites that day's slot, and the totals
+    only change by the difference, so they stay exact. Series that cannot
+    be read are not written that run, so their history is never lost.
+    """
+
+    def __init__(self, dynamodb, table_name=DEFAULT_ROLLUP_TABLE, max_days=DEFAULT_ROLLUP_DAYS):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.max_days = max_days
+        self._pending = []
+        self._lock = threading.Lock()
+
+        self.series_written = 0
+        self.series_skipped = 0
+
+    def record(self, finding):
+        """Queue today's values of a finding's resource."""
+        region = (finding.metadata or {}).get('region') or 'global'
+        with self._lock:
+            self._pending.append((
+                series_name(finding.resource_type, region, finding.account_id), finding.resource_id,
+                finding.resource_type, finding.issue, finding_values(finding)
+            ))
+
+    def save(self):
+        """Merge the queued values into their series and write them with the totals."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        day = today()
+        items, failed = self._load([(series, resource_id) for series, resource_id, *_ in pending])
+        if failed:
+            # Writing these without their history would replace it with a one-day series
+            print(f"Skipping today's values of {len(failed)} rollup series that could not be read")
+        deltas = {}
+        expires_at = int(time.time()) + self.max_days * 86400
+        written = 0
+        with FindingSink(self.dynamodb, table_name=self.table_name, workers=2) as sink:
+            for series, resource_id, resource_type, issue, values in pending:
+                if (series, resource_id) in failed:
+                    continue
+                written += 1
+                item, previous = self._merge(items.get((series, resource_id)), day, issue, values)
+                item.update({'series': series, 'resource_id': resource_id, 'expires_at': expires_at})
+                sink.write(item)
+                self._add_delta(deltas.setdefault(resource_type, {}), previous, issue, values)
+        self._apply_deltas(day, deltas)
+
+        with self._lock:
+            self.series_written += written
+            self.series_skipped += len(pending) - written
+
+    def _load(self, keys):
+        """The stored series items of `keys`, and the keys that could not be read."""
+        loaded = {}
+        failed = set()
+        keys = list(dict.fromkeys(keys))
+        for start in range(0, len(keys), MAX_KEYS_PER_GET):
+            request = {self.table_name: {'Keys': [
+                {'series': {'S': series}, 'resource_id': {'S': resource_id}}
+                for series, resource_id in keys[start:start + MAX_KEYS_PER_GET]
+            ]}}
+            while request:
+                try:
+                    response = self.dynamodb.batch_get_item(RequestItems=request)
+                except Exception as e:
+                    print(f"Error loading rollups: {str(e)}")
+                    failed.update(
+                        (key['series']['S'], key['resource_id']['S']) for key in request[self.table_name]['Keys']
+                    )
+                    break
+                for item in response['Responses'].get(self.table_name, []):
+                    loaded[(item['series']['S'], item['resource_id']['S'])] = item
+                request = response.get('UnprocessedKeys')
+        return loaded, failed
+
+    def _merge(self, item, day, issue, values):
+        """
+        The series item with today's values set, and what today's slot held
+        before ({} when empty) so the totals can be corrected.
+        """
+        start_day = item['start_day']['S'] if item else day
+        columns = {name: _unpack(data['B']) for name, data in item['fields']['M'].items()} if item else {}
+        length = max((len(column) for column in columns.values()), default=0)
+        offset = _day_offset(start_day, day)
+
+        previous = {}
+        if item and item.get('issue_day', {}).get('S') == day and offset < length:
+            previous = {name: column[offset] for name, column in columns.items()}
+            previous['issue'] = item['issue']['S']
+
+        length = max(length, offset + 1)
+        for name in set(columns) | set(values):
+            column = columns.setdefault(name, array('f'))
+            column.extend([math.nan] * (length - len(column)))
+            if name in values:
+                column[offset] = values[name]
+
+        # Keep the newest max_days slots
+        drop = length - self.max_days
+        if drop > 0:
+            columns = {name: column[drop:] for name, column in columns.items()}
+            start_day = _shift_day(start_day, drop)
+
+        return {
+            'start_day': start_day,
+            'fields': {name: column.tobytes() for name, column in columns.items()},
+            'issue': issue,
+            'issue_day': day
+        }, previous
+
+    def _add_delta(self, delta, previous, issue, values):
+        if not previous:
+            delta['resources'] = delta.get('resources', 0) + 1
+            delta[f'issue_{issue}'] = delta.get(f'issue_{issue}', 0) + 1
+        elif previous['issue'] != issue:
+            delta[f"issue_{previous['issue']}"] = delta.get(f"issue_{previous['issue']}", 0) - 1
+            delta[f'issue_{issue}'] = delta.get(f'issue_{issue}', 0) + 1
+        for name in COST_FIELDS:
+            new, old = values.get(name, math.nan), previous.get(name, math.nan)
+            change = (0.0 if math.isnan(new) else new) - (0.0 if math.isnan(old) else old)
+            delta[name] = delta.get(name, 0.0) + change
+
+    def _apply_deltas(self, day, deltas):
+        for resource_type, delta in deltas.items():
+            names, values, adds = {}, {}, []
+            for index, (name, value) in enumerate(sorted(delta.items())):
+                names[f'#a{index}'] = name
+                values[f':a{index}'] = {'N': str(round(value, 4))}
+                adds.append(f'#a{index} :a{index}')
+            try:
+                self.dynamodb.update_item(
+                    TableName=self.table_name,
+                    Key={'series': {'S': f'{AGGREGATE_PREFIX}{resource_type}'}, 'resource_id': {'S': day}},
+                    UpdateExpression='ADD ' + ', '.join(adds),
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues=values
+                )
+            except Exception as e:
+                print(f"Error updating {resource_type} rollup totals: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {'series_written': self.series_written, 'series_skipped': self.series_skipped}
+
+
+class RollupFrame:
+    """
+    The series of one partition aligned on a common day axis: `columns`
+    maps each field to a (resources x days) float array, NaN where unknown.
+    """
+
+    def __init__(self, resource_ids, days, columns, issues):
+        self.resource_ids = resource_ids
+        self.days = days
+        self.columns = columns
+        self.issues = issues
+
+    def __len__(self):
+        return len(self.resource_ids)
+
+    def window(self, name, days):
+        """The last `days` columns of a field."""
+        return self.columns[name][:, -days:]
+
+
+def load_frame(dynamodb, resource_type, region, table_name=DEFAULT_ROLLUP_TABLE, account_id=None):
+    """Query one '<type>#<region>' partition and align its series into a RollupFrame."""
+    import numpy as np
+
+    rows = []
+    request = {
+        'TableName': table_name,
+        'KeyConditionExpression': 'series = :series',
+        'ExpressionAttributeValues': {':series': {'S': series_name(resource_type, region, account_id)}}
+    }
+    while True:
+        response = dynamodb.query(**request)
+        for item in response['Items']:
+            fields = {name: np.frombuffer(data['B'], dtype=np.float32) for name, data in item['fields']['M'].items()}
+            rows.append((item['resource_id']['S'], item['start_day']['S'], item['issue']['S'], fields))
+        if 'LastEvaluatedKey' not in response:
+            break
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    if not rows:
+        return RollupFrame([], [], {name: np.empty((0, 0)) for name in _frame_fields(resource_type)}, [])
+
+    # Day axis from the oldest slot to the newest of any series
+    ends = [_shift_day(start_day, max(len(field) for field in fields.values()) - 1) for _, start_day, _, fields in rows]
+    first = min(start_day for _, start_day, _, _ in rows)
+    length = _day_offset(first, max(ends)) + 1
+    names = sorted({name for *_, fields in rows for name in fields} | set(_frame_fields(resource_type)))
+    columns = {name: np.full((len(rows), length), np.nan, dtype=np.float32) for name in names}
+
+    for row, (_, start_day, _, fields) in enumerate(rows):
+        offset = _day_offset(first, start_day)
+        for name, values in fields.items():
+            columns[name][row, offset:offset + len(values)] = values
+
+    return RollupFrame(
+        [resource_id for resource_id, *_ in rows], [_shift_day(first, index) for index in range(length)],
+        columns, [issue for _, _, issue, _ in rows]
+    )
+
+
+def _frame_fields(resource_type):
+    return ROLLUP_FIELDS.get(resource_type, ()) + COST_FIELDS
+
+
+def idle_resources(frame, fields, days=30, threshold=0.0, min_days=None):
+    """
+    Resources whose `fields` stayed at or below `threshold` on every known
+    day of the last `days`, with at least `min_days` known days (default
+    half the window). Returns [(resource_id, known_days, monthly_cost)],
+    most expensive first.
+    """
+    import numpy as np
+
+    if not len(frame):
+        return []
+    min_days = min_days if min_days is not None else max(1, days // 2)
+    idle = np.ones(len(frame), dtype=bool)
+    known = np.zeros(len(frame), dtype=np.int64)
+    for name in fields:
+        window = frame.window(name, days)
+        observed = ~np.isnan(window)
+        idle &= ~np.any(observed & (window > threshold), axis=1)
+        known = np.maximum(known, observed.sum(axis=1))
+    idle &= known >= min_days
+
+    cost = _latest(frame.window('monthly_cost', days))
+    rows = np.flatnonzero(idle)
+    rows = rows[np.argsort(-np.nan_to_num(cost[rows]), kind='stable')]
+    return [(frame.resource_ids[row], int(known[row]), _float(cost[row])) for row in rows]
+
+
+def top_resources(frame, field, n=10, days=1):
+    """The `n` resources with the highest mean of `field` over the last `days`: [(resource_id, mean)]."""
+    import numpy as np
+
+    if not len(frame):
+        return []
+    window = frame.window(field, days)
+    observed = ~np.isnan(window)
+    counts = observed.sum(axis=1)
+    means = np.where(counts > 0, np.nansum(window, axis=1) / np.maximum(counts, 1), np.nan)
+    rows = np.flatnonzero(~np.isnan(means))
+    rows = rows[np.argsort(-means[rows], kind='stable')][:n]
+    return [(frame.resource_ids[row], _float(means[row])) for row in rows]
+
+
+def trend_slopes(frame, field, days=30):
+    """Least-squares slope of `field` per day over the last `days`, per resource (NaN with < 2 known days)."""
+    return linear_trends(frame.window(field, days))['slope']
+
+
+def growing_resources(frame, field, n=10, days=30):
+    """The `n` resources whose `field` grows fastest per day over the last `days`: [(resource_id, slope)]."""
+    import numpy as np
+
+    if not len(frame):
+        return []
+    slopes = trend_slopes(frame, field, days)
+    rows = np.flatnonzero(~np.isnan(slopes))
+    rows = rows[np.argsort(-slopes[rows], kind='stable')][:n]
+    return [(frame.resource_ids[row], _float(slopes[row])) for row in rows]
+
+
+def type_totals(dynamodb, resource_type, start_day=None, end_day=None, table_name=DEFAULT_ROLLUP_TABLE):
+    """Daily totals of a resource type (resources, cost, savings, issue counts), oldest first."""
+    request = {
+        'TableName': table_name,
+        'KeyConditionExpression': 'series = :series AND resource_id BETWEEN :start AND :end',
+        'ExpressionAttributeValues': {
+            ':series': {'S': f'{AGGREGATE_PREFIX}{resource_type}'},
+            ':start': {'S': start_day or '0000-00-00'},
+            ':end': {'S': end_day or '9999-99-99'}
+        }
+    }
+    totals = []
+    while True:
+        response = dynamodb.query(**request)
+        for item in response['Items']:
+            day = {'day': item['resource_id']['S']}
+            for name, value in item.items():
+                if 'N' in value:
+                    number = float(value['N'])
+                    day[name] = int(number) if number.is_integer() else round(number, 2)
+            totals.append(day)
+        if 'LastEvaluatedKey' not in response:
+            return totals
+        request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _latest(window):
+    """Newest known value per row of a (resources x days) array."""
+    import numpy as np
+
+    observed = ~np.isnan(window)
+    last = window.shape[1] - 1 - np.argmax(observed[:, ::-1], axis=1)
+    values = window[np.arange(window.shape[0]), last]
+    values[~observed.any(axis=1)] = np.nan
+    return values
+
+
+def _float(value):
+    return None if math.isnan(value) else round(float(value), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query cost optimizer rollups')
+    parser.add_argument('query', choices=['idle', 'top', 'growing', 'totals'])
+    parser.add_argument('--type', required=True, help='Resource type (EC2, EBS, RDS, S3)')
+    parser.add_argument('--region', default=os.environ.get('AWS_REGION', 'us-east-1'),
+                        help="Region of the series ('global' for S3 buckets without one)")
+    parser.add_argument('--fields', default='monthly_cost', help='Comma-separated fields (one for top/growing)')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--threshold', type=float, default=0.0, help='idle: highest value that counts as idle')
+    parser.add_argument('-n', type=int, default=10, help='top/growing: number of resources')
+    parser.add_argument('--account', help='Account id of a scanned account (default: the analyzer\'s own)')
+    parser.add_argument('--table', default=DEFAULT_ROLLUP_TABLE)
+    args = parser.parse_args()
+
+    import boto3
+    dynamodb = boto3.client('dynamodb')
+    fields = args.fields.split(',')
+
+    if args.query == 'totals':
+        start_day = _shift_day(today(), -args.days)
+        result = type_totals(dynamodb, args.type, start_day, table_name=args.table)
+    else:
+        frame = load_frame(dynamodb, args.type, args.region, args.table, args.account)
+        if args.query == 'idle':
+            result = idle_resources(frame, fields, args.days, args.threshold)
+        elif args.query == 'top':
+            result = top_resources(frame, fields[0], args.n, args.days)
+        else:
+            result = growing_resources(frame, fields[0], args.n, args.days)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
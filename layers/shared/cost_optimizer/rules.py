@@ -0,0 +1,437 @@
+"""
+Declarative rules for finding severity, issue and recommendation.
+
+Rules are read from a JSON file (RULES_FILE, a local path or s3://bucket/key;
+the rules.json next to this module by default), grouped by resource type:
+
+    {"EC2": [{"name": "idle", "when": "cpu_p95_percent < 5 and age_days > 30",
+              "severity": "high", "recommendation": "Stop or downsize ({cpu_p95_percent:.1f}% p95 CPU)"}]}
+
+`when` is a Python-like expression over the finding's metadata fields plus
+issue, severity, monthly_cost and monthly_savings: comparisons (also `in`
+and `is None`), and/or/not and arithmetic. Each rule sets any of
+`severity`, `issue` and `recommendation` (a str.format template over the
+same fields, with missing values shown as 'n/a'), or drops the finding
+with `"skip": true`. The first matching rule of a type wins; findings no
+rule matches keep what the analyzer set.
+
+Expressions are compiled once into functions over NumPy columns. A batch of
+findings is turned into one array per referenced field, each rule yields a
+boolean mask for the whole batch, and only the matched findings are then
+touched one by one. Missing values are NaN (or None): they fail every
+comparison except `!=` and `is None`.
+
+Usage in an analyzer's evaluate stage:
+    rules = shared_rules(clients)
+    findings = rules.apply([build_finding(resource) for resource in batch])
+"""
+import ast
+import json
+import operator
+import os
+import string
+import threading
+import time
+
+# Rules file, a local path or s3://bucket/key; empty uses the bundled rules
+DEFAULT_RULES = os.environ.get('RULES_FILE', '')
+
+# Warm invocations reuse the compiled rules until they are this old
+DEFAULT_TTL_SECONDS = int(os.environ.get('RULES_TTL_SECONDS', '900'))
+
+BUNDLED_RULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules.json')
+
+SEVERITIES = ('info', 'low', 'medium', 'high', 'critical')
+
+# Finding attributes usable in expressions besides the metadata fields
+FINDING_FIELDS = ('resource_id', 'issue', 'severity', 'monthly_cost', 'monthly_savings')
+
+
+_COMPARISONS = {
+    ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+    ast.Eq: operator.eq, ast.NotEq: operator.ne
+}
+_ARITHMETIC = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.Mod: operator.mod
+}
+
+
+class TextColumn:
+    """
+    A text field as integer codes into its distinct values (-1 where the
+    value is missing), so equality and `in` tests against constants are
+    integer comparisons rather than string ones.
+    """
+
+    def __init__(self, values):
+        import numpy as np
+
+        index = {}
+        self.codes = np.fromiter(
+            (-1 if value is None else index.setdefault(value, len(index)) for value in values), np.int32, len(values)
+        )
+        self.index = index
+
+    def code_mask(self, values, invert=False):
+        """Rows whose value is one of `values` (with invert=True: is not, missing included)."""
+        import numpy as np
+
+        codes = [self.index[value] for value in values if isinstance(value, str) and value in self.index]
+        mask = np.isin(self.codes, codes) if codes else np.zeros(len(self.codes), bool)
+        return ~mask if invert else mask
+
+    def values(self):
+        """The column as objects, None where missing."""
+        import numpy as np
+
+        vocabulary = np.empty(len(self.index) + 1, dtype=object)
+        vocabulary[:-1] = list(self.index)
+        return vocabulary[self.codes]
+
+
+def compile_expression(source):
+    """
+    Compile a rule expression into (function of a columns dict returning a
+    boolean array, names of the fields it reads). Raises ValueError for
+    anything outside the rule language.
+
+    Comparisons and and/or results are cached in the columns dict, so the
+    rules of a set share the work of the subexpressions they repeat.
+    """
+    import numpy as np
+
+    names = set()
+
+    def cached(node, function):
+        key = ('expression', ast.dump(node))
+
+        def evaluate(columns):
+            if key not in columns:
+                columns[key] = function(columns)
+            return columns[key]
+        return evaluate
+
+    def build(node):
+        if isinstance(node, ast.BoolOp):
+            parts = [build(value) for value in node.values]
+            combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return cached(node, lambda columns: _reduce(combine, [_mask(part(columns)) for part in parts]))
+        if isinstance(node, ast.UnaryOp):
+            operand = build(node.operand)
+            if isinstance(node.op, ast.Not):
+                return lambda columns: np.logical_not(_mask(operand(columns)))
+            if isinstance(node.op, ast.USub):
+                return lambda columns: -_plain(operand(columns))
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+            left, right, op = build(node.left), build(node.right), _ARITHMETIC[type(node.op)]
+            return lambda columns: op(_plain(left(columns)), _plain(right(columns)))
+        if isinstance(node, ast.Compare):
+            parts, left = [], node.left
+            for op, right in zip(node.ops, node.comparators):
+                parts.append(_comparison(op, build(left), build(right), right))
+                left = right
+            return cached(node, lambda columns: _reduce(np.logical_and, [part(columns) for part in parts]))
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+            return lambda columns: columns[node.id]
+        if isinstance(node, ast.Constant) and (node.value is None or isinstance(node.value, (bool, int, float, str))):
+            return lambda columns: node.value
+        if isinstance(node, (ast.Tuple, ast.List, ast.Set)) and all(isinstance(e, ast.Constant) for e in node.elts):
+            values = [element.value for element in node.elts]
+            return lambda columns: values
+        raise ValueError(f"Unsupported expression: {ast.unparse(node)}")
+
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid expression {source!r}: {e.msg}")
+    return build(tree.body), names
+
+
+def _comparison(op, left, right, right_node):
+    import numpy as np
+
+    if isinstance(right_node, ast.Constant) and right_node.value is None and type(op) in (ast.Is, ast.Eq):
+        return lambda columns: _is_missing(left(columns))
+    if isinstance(right_node, ast.Constant) and right_node.value is None and type(op) in (ast.IsNot, ast.NotEq):
+        return lambda columns: np.logical_not(_is_missing(left(columns)))
+    if isinstance(op, (ast.In, ast.NotIn)):
+        invert = isinstance(op, ast.NotIn)
+        return lambda columns: _contains(left(columns), right(columns), invert)
+    if type(op) in _COMPARISONS:
+        compare = _COMPARISONS[type(op)]
+        return lambda columns: _compare(compare, left(columns), right(columns))
+    raise ValueError(f"Unsupported comparison: {type(op).__name__}")
+
+
+def _contains(values, options, invert):
+    import numpy as np
+
+    if isinstance(values, TextColumn):
+        return values.code_mask(options, invert)
+    return np.isin(_plain(values), options, invert=invert)
+
+
+def _compare(compare, left, right):
+    import numpy as np
+
+    # Equality of a text column and a constant is a comparison of codes
+    if compare in (operator.eq, operator.ne):
+        if isinstance(right, TextColumn) and not isinstance(left, TextColumn):
+            left, right = right, left
+        if isinstance(left, TextColumn) and not isinstance(right, (TextColumn, np.ndarray)):
+            return left.code_mask([right], invert=compare is operator.ne)
+
+    left, right = _plain(left), _plain(right)
+    try:
+        with np.errstate(invalid='ignore'):
+            return _mask(compare(left, right))
+    except TypeError:
+        # Mixed or missing values in an object column: compare one by one
+        pairs = np.broadcast(np.asarray(left, dtype=object), np.asarray(right, dtype=object))
+        return np.fromiter((_compare_values(compare, a, b) for a, b in pairs), bool, pairs.size)
+
+
+def _compare_values(compare, left, right):
+    # Missing values only ever differ
+    if left is None or right is None:
+        return compare is operator.ne
+    try:
+        return bool(compare(left, right))
+    except TypeError:
+        return False
+
+
+def _plain(values):
+    """Text columns as object arrays, for the operations codes do not cover."""
+    return values.values() if isinstance(values, TextColumn) else values
+
+
+def _is_missing(values):
+    import numpy as np
+
+    if isinstance(values, TextColumn):
+        return values.codes < 0
+    values = np.asarray(values)
+    if values.dtype == object:
+        return np.fromiter((value is None for value in values.flat), bool, values.size)
+    if values.dtype.kind == 'f':
+        return np.isnan(values)
+    return np.zeros(values.shape, bool)
+
+
+def _mask(values):
+    import numpy as np
+
+    values = np.asarray(_plain(values))
+    if values.dtype == bool:
+        return values
+    if values.dtype == object:
+        return np.fromiter((bool(value) for value in values.flat), bool, values.size)
+    # Numbers are true when non-zero; NaN (missing) is false
+    return np.nan_to_num(values, nan=0.0) != 0
+
+
+def _reduce(combine, masks):
+    result = masks[0]
+    for mask in masks[1:]:
+        result = combine(result, mask)
+    return result
+
+
+def column(values):
+    """
+    A column from a field's values: float64 (NaN for None) when all are
+    numbers or booleans, a TextColumn when all are text, objects otherwise
+    (lists, dicts, mixed types).
+    """
+    import numpy as np
+
+    types = set(map(type, values))
+    types.discard(type(None))
+    if types <= {int, float, bool}:
+        return np.array(values, dtype=float)
+    if types == {str}:
+        return TextColumn(values)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def finding_value(finding, name):
+    """A field of a finding for expressions and templates: an attribute, else a metadata field."""
+    if name in FINDING_FIELDS:
+        return getattr(finding, name)
+    return finding.metadata.get(name)
+
+
+class _TemplateFormatter(string.Formatter):
+    """str.format over a finding's fields, with missing values shown as 'n/a'."""
+
+    def get_value(self, key, args, finding):
+        return finding_value(finding, key)
+
+    def format_field(self, value, format_spec):
+        if value is None:
+            return 'n/a'
+        return super().format_field(value, format_spec)
+
+
+_formatter = _TemplateFormatter()
+
+
+class Rule:
+    """One compiled rule of a resource type."""
+
+    def __init__(self, resource_type, spec):
+        self.resource_type = resource_type
+        self.name = spec.get('name') or spec['when']
+        self.when = spec['when']
+        self.severity = spec.get('severity')
+        self.issue = spec.get('issue')
+        self.recommendation = spec.get('recommendation')
+        self.skip = bool(spec.get('skip', False))
+        if self.severity is not None and self.severity not in SEVERITIES:
+            raise ValueError(f"Rule {resource_type}/{self.name}: unknown severity {self.severity!r}")
+        try:
+            self.matches, self.names = compile_expression(self.when)
+        except ValueError as e:
+            raise ValueError(f"Rule {resource_type}/{self.name}: {str(e)}")
+
+    def apply(self, finding):
+        """Set the rule's severity, issue and recommendation on a matched finding."""
+        if self.severity:
+            finding.severity = self.severity
+        if self.issue:
+            finding.issue = self.issue
+        if self.recommendation:
+            try:
+                finding.recommendation = _formatter.vformat(self.recommendation, (), finding)
+            except (ValueError, TypeError, KeyError, AttributeError, IndexError):
+                # A field the template formats is of another type than its format spec expects
+                finding.recommendation = self.recommendation
+
+
+class RuleSet:
+    """
+    Compiled rules per resource type.
+
+    Usage:
+        rules = RuleSet.load('rules.json')
+        findings = rules.apply(findings)
+    """
+
+    def __init__(self, spec=None, source=None):
+        self.source = source
+        self.loaded_at = time.monotonic()
+        self.rules = {
+            resource_type: [Rule(resource_type, rule) for rule in rules]
+            for resource_type, rules in (spec or {}).items()
+        }
+
+    def __len__(self):
+        return sum(len(rules) for rules in self.rules.values())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f), path)
+
+    def matches(self, findings, resource_type):
+        """
+        Index of the first matching rule for each of `findings` (all of one
+        resource type), -1 where none matches, as an int array.
+        """
+        import numpy as np
+
+        rules = self.rules.get(resource_type, [])
+        matched = np.full(len(findings), -1)
+        if not rules or not findings:
+            return matched
+
+        columns = {}
+        for name in set().union(*(rule.names for rule in rules)):
+            if name in FINDING_FIELDS:
+                columns[name] = column([getattr(finding, name) for finding in findings])
+            else:
+                columns[name] = column([finding.metadata.get(name) for finding in findings])
+
+        unmatched = np.ones(len(findings), bool)
+        for index, rule in enumerate(rules):
+            try:
+                mask = np.broadcast_to(_mask(rule.matches(columns)), unmatched.shape)
+            except Exception as e:
+                print(f"Error evaluating rule {resource_type}/{rule.name}: {str(e)}")
+                continue
+            hits = unmatched & mask
+            matched[hits] = index
+            unmatched &= ~hits
+            if not unmatched.any():
+                break
+        return matched
+
+    def apply(self, findings):
+        """Apply the first matching rule to each finding; returns the findings no skip rule dropped."""
+        by_type = {}
+        for position, finding in enumerate(findings):
+            by_type.setdefault(finding.resource_type, []).append(position)
+
+        dropped = set()
+        for resource_type, positions in by_type.items():
+            rules = self.rules.get(resource_type)
+            if not rules:
+                continue
+            matched = self.matches([findings[position] for position in positions], resource_type)
+            for position, index in zip(positions, matched.tolist()):
+                if index < 0:
+                    continue
+                rule = rules[index]
+                if rule.skip:
+                    dropped.add(position)
+                else:
+                    rule.apply(findings[position])
+        if not dropped:
+            return findings
+        return [finding for position, finding in enumerate(findings) if position not in dropped]
+
+
+_shared_rules = None
+_shared_lock = threading.Lock()
+
+
+def shared_rules(clients=None, location=DEFAULT_RULES, ttl_seconds=DEFAULT_TTL_SECONDS):
+    """
+    Return the module-scope RuleSet from `location` (the bundled rules when
+    empty), reloaded once older than `ttl_seconds`. A file that cannot be
+    read or compiled falls back to the bundled rules rather than failing
+    the run.
+    """
+    global _shared_rules
+    rules = _shared_rules
+    if rules is not None and time.monotonic() - rules.loaded_at < ttl_seconds:
+        return rules
+
+    with _shared_lock:
+        rules = _shared_rules
+        if rules is None or time.monotonic() - rules.loaded_at >= ttl_seconds:
+            try:
+                rules = RuleSet.load(_local_rules(clients, location))
+            except Exception as e:
+                print(f"Error loading rules {location}: {str(e)}")
+                rules = RuleSet.load(BUNDLED_RULES)
+            print(f"Loaded {len(rules)} rules from {location or 'bundled rules'}")
+            _shared_rules = rules
+    return rules
+
+
+def _local_rules(clients, location):
+    if not location:
+        return BUNDLED_RULES
+    if not location.startswith('s3://'):
+        return location
+
+    bucket, _, key = location[len('s3://'):].partition('/')
+    path = '/tmp/rules.json'
+    clients.client('s3').download_file(bucket, key, path)
+    return path
@@ -0,0 +1,186 @@
+"""
+Storage class breakdown for S3 buckets from S3 Inventory reports.
+
+Inventory CSV files are streamed and gzip-decoded chunk by chunk, and
+aggregated into per storage class and per top-level prefix totals, so
+memory stays flat however large the report is. Buckets without a CSV
+inventory fall back to the per-StorageType BucketSizeBytes CloudWatch
+metrics (see STORAGE_TYPE_CLASSES).
+"""
+import csv
+import gzip
+import io
+import json
+from urllib.parse import unquote_plus
+
+from cost_optimizer.telemetry import debug
+
+# Top-level prefixes tracked per bucket, the rest are folded into OTHER_PREFIX
+MAX_PREFIXES = 1000
+OTHER_PREFIX = '(other)'
+
+# BucketSizeBytes StorageType dimension values and the storage class they belong to
+STORAGE_TYPE_CLASSES = {
+    'StandardStorage': 'STANDARD',
+    'IntelligentTieringFAStorage': 'INTELLIGENT_TIERING',
+    'IntelligentTieringIAStorage': 'INTELLIGENT_TIERING',
+    'IntelligentTieringAAStorage': 'INTELLIGENT_TIERING',
+    'IntelligentTieringAIAStorage': 'INTELLIGENT_TIERING',
+    'IntelligentTieringDAAStorage': 'INTELLIGENT_TIERING',
+    'StandardIAStorage': 'STANDARD_IA',
+    'StandardIASizeOverhead': 'STANDARD_IA',
+    'OneZoneIAStorage': 'ONEZONE_IA',
+    'OneZoneIASizeOverhead': 'ONEZONE_IA',
+    'ReducedRedundancyStorage': 'REDUCED_REDUNDANCY',
+    'GlacierInstantRetrievalStorage': 'GLACIER_IR',
+    'GlacierInstantRetrievalSizeOverhead': 'GLACIER_IR',
+    'GlacierStorage': 'GLACIER',
+    'GlacierStagingStorage': 'GLACIER',
+    'GlacierObjectOverhead': 'GLACIER',
+    'GlacierS3ObjectOverhead': 'GLACIER',
+    'DeepArchiveStorage': 'DEEP_ARCHIVE',
+    'DeepArchiveStagingStorage': 'DEEP_ARCHIVE',
+    'DeepArchiveObjectOverhead': 'DEEP_ARCHIVE',
+    'DeepArchiveS3ObjectOverhead': 'DEEP_ARCHIVE',
+    'ExpressOneZone': 'EXPRESS_ONEZONE'
+}
+
+
+class InventoryAggregate:
+    """Running object and byte totals per storage class and top-level prefix."""
+
+    def __init__(self, max_prefixes=MAX_PREFIXES):
+        self.max_prefixes = max_prefixes
+        self.objects = 0
+        self.bytes = 0
+        self.storage_classes = {}
+        self.prefixes = {}
+
+    def add(self, key, size, storage_class):
+        self.objects += 1
+        self.bytes += size
+        _add_to(self.storage_classes, storage_class, size)
+
+        prefix = key.split('/', 1)[0] + '/' if '/' in key else ''
+        if prefix not in self.prefixes and len(self.prefixes) >= self.max_prefixes:
+            prefix = OTHER_PREFIX
+        _add_to(self.prefixes, prefix, size)
+
+    def class_objects(self):
+        """Object count per storage class."""
+        return {storage_class: totals[0] for storage_class, totals in self.storage_classes.items()}
+
+    def class_bytes(self):
+        """Bytes per storage class."""
+        return {storage_class: totals[1] for storage_class, totals in self.storage_classes.items()}
+
+    def top_prefixes(self, count=20):
+        """The largest prefixes by bytes, as (prefix, objects, bytes) tuples."""
+        ranked = sorted(self.prefixes.items(), key=lambda item: item[1][1], reverse=True)
+        return [(prefix, totals[0], totals[1]) for prefix, totals in ranked[:count]]
+
+
+def _add_to(totals, name, size):
+    entry = totals.get(name)
+    if entry is None:
+        totals[name] = [1, size]
+    else:
+        entry[0] += 1
+        entry[1] += size
+
+
+def parse_schema(file_schema):
+    """Column names from a manifest fileSchema string."""
+    return [field.strip() for field in file_schema.split(',')]
+
+
+def aggregate_csv(fileobj, fields, aggregate, compressed=True):
+    """
+    Stream one inventory CSV file into an aggregate. `fileobj` can be an S3
+    StreamingBody or a local file opened in binary mode.
+    """
+    stream = gzip.GzipFile(fileobj=fileobj) if compressed else fileobj
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+    key_index = fields.index('Key')
+    size_index = fields.index('Size')
+    class_index = fields.index('StorageClass') if 'StorageClass' in fields else None
+    latest_index = fields.index('IsLatest') if 'IsLatest' in fields else None
+    marker_index = fields.index('IsDeleteMarker') if 'IsDeleteMarker' in fields else None
+
+    for row in csv.reader(text):
+        # Only count current, real objects in versioned buckets
+        if latest_index is not None and row[latest_index] != 'true':
+            continue
+        if marker_index is not None and row[marker_index] == 'true':
+            continue
+
+        size = int(row[size_index]) if row[size_index] else 0
+        storage_class = row[class_index] if class_index is not None and row[class_index] else 'STANDARD'
+        aggregate.add(unquote_plus(row[key_index]), size, storage_class)
+
+    return aggregate
+
+
+def aggregate_local_files(paths, fields, compressed=True):
+    """Aggregate inventory CSV files from local disk."""
+    aggregate = InventoryAggregate()
+    for path in paths:
+        with open(path, 'rb') as f:
+            aggregate_csv(f, fields, aggregate, compressed=compressed)
+    return aggregate
+
+
+def find_latest_manifest(s3, bucket_name):
+    """
+    Find the newest manifest of an enabled CSV inventory configuration for a
+    bucket. Returns (destination bucket, manifest) or None.
+    """
+    try:
+        response = s3.list_bucket_inventory_configurations(Bucket=bucket_name)
+    except Exception as e:
+        debug(f"Error getting inventory configurations for {bucket_name}: {str(e)}")
+        return None
+
+    for config in response.get('InventoryConfigurationList', []):
+        destination = config['Destination']['S3BucketDestination']
+        if not config.get('IsEnabled') or destination['Format'] != 'CSV':
+            continue
+
+        # Reports land under <prefix>/<source bucket>/<config id>/<YYYY-MM-DDTHH-MMZ>/manifest.json
+        destination_bucket = destination['Bucket'].split(':::')[-1]
+        parts = [destination.get('Prefix', '').strip('/'), bucket_name, config['Id']]
+        base_prefix = '/'.join(part for part in parts if part) + '/'
+
+        paginator = s3.get_paginator('list_objects_v2')
+        report_prefixes = []
+        for page in paginator.paginate(Bucket=destination_bucket, Prefix=base_prefix, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', []):
+                if not common_prefix['Prefix'].endswith('hive/'):
+                    report_prefixes.append(common_prefix['Prefix'])
+
+        for report_prefix in sorted(report_prefixes, reverse=True):
+            try:
+                response = s3.get_object(Bucket=destination_bucket, Key=report_prefix + 'manifest.json')
+                return destination_bucket, json.loads(response['Body'].read())
+            except Exception as e:
+                print(f"Error reading inventory manifest {report_prefix} for {bucket_name}: {str(e)}")
+
+    return None
+
+
+def get_inventory_breakdown(s3, bucket_name):
+    """Aggregate the bucket's latest CSV inventory report, or None when there is none."""
+    latest = find_latest_manifest(s3, bucket_name)
+    if latest is None:
+        return None
+
+    destination_bucket, manifest = latest
+    fields = parse_schema(manifest['fileSchema'])
+    aggregate = InventoryAggregate()
+
+    for report_file in manifest['files']:
+        response = s3.get_object(Bucket=destination_bucket, Key=report_file['key'])
+        aggregate_csv(response['Body'], fields, aggregate)
+
+    return aggregate
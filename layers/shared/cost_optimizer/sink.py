@@ -0,0 +1,172 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+
+from cost_optimizer.telemetry import timed
+
+# BatchWriteItem accepts at most 25 put requests per call
+MAX_BATCH_SIZE = 25
+
+DEFAULT_TABLE_NAME = os.environ.get('DYNAMODB_TABLE', 'CostOptimizerFindings')
+
+THROTTLE_ERRORS = (
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded'
+)
+
+
+class FindingSink:
+    """
+    Write findings to DynamoDB with BatchWriteItem on a few worker threads.
+
+    Findings are buffered into batches of 25 as they are produced. Unprocessed
+    items, throttled calls and connection errors are retried with jittered
+    exponential backoff.
+
+    Usage:
+        with FindingSink(dynamodb_client) as sink:
+            for finding in findings:
+                sink.write(finding)
+        print(sink.stats())
+    """
+
+    def __init__(self, dynamodb, table_name=DEFAULT_TABLE_NAME, workers=4,
+                 max_attempts=8, base_delay=0.05, max_delay=5.0):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        # Imported here so analyzers only pay for boto3.dynamodb when they write
+        from boto3.dynamodb.types import TypeSerializer
+        self._serializer = TypeSerializer()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        # Bound in-flight batches so a fast producer cannot buffer the whole run
+        self._in_flight = threading.BoundedSemaphore(workers * 2)
+        self._futures = []
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._finished = None
+
+        self.items_written = 0
+        self.items_failed = 0
+        self.consumed_wcu = 0.0
+        self.throttles = 0
+        self.requests = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, finding):
+        """Buffer a finding, submitting a batch once 25 are waiting. Safe to call from several threads."""
+        self.write_item({key: self._serializer.serialize(value) for key, value in finding.items()})
+
+    def write_item(self, item):
+        """Buffer an item already in low-level (wire) format, such as Finding.to_compact_item()."""
+        with self._buffer_lock:
+            self._buffer.append({'PutRequest': {'Item': item}})
+            if len(self._buffer) >= MAX_BATCH_SIZE:
+                self._submit()
+
+    def flush(self):
+        """Submit any buffered findings and wait for every batch to finish."""
+        with self._buffer_lock:
+            if self._buffer:
+                self._submit()
+            futures = self._futures
+            self._futures = []
+        for future in futures:
+            future.result()
+
+    def close(self):
+        """Flush and stop the worker threads."""
+        if self._finished is not None:
+            return
+        self.flush()
+        self._executor.shutdown(wait=True)
+        self._finished = time.monotonic()
+
+    def stats(self):
+        """Write throughput, consumed capacity and throttling counters."""
+        elapsed = (self._finished or time.monotonic()) - self._started
+        return {
+            'items_written': self.items_written,
+            'items_failed': self.items_failed,
+            'items_per_second': round(self.items_written / elapsed, 1) if elapsed > 0 else 0.0,
+            'consumed_wcu': round(self.consumed_wcu, 1),
+            'throttles': self.throttles,
+            'requests': self.requests
+        }
+
+    def _submit(self):
+        batch = self._buffer
+        self._buffer = []
+        self._in_flight.acquire()
+        future = self._executor.submit(timed('write', self._write_batch), batch)
+        future.add_done_callback(lambda _: self._in_flight.release())
+        self._futures.append(future)
+
+    def _write_batch(self, requests):
+        attempt = 0
+        while requests:
+            if attempt >= self.max_attempts:
+                print(f"Giving up on {len(requests)} findings after {attempt} attempts")
+                self._record(failed=len(requests))
+                return
+
+            if attempt:
+                self._backoff(attempt)
+            attempt += 1
+
+            try:
+                response = self.dynamodb.batch_write_item(
+                    RequestItems={self.table_name: requests},
+                    ReturnConsumedCapacity='TOTAL'
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] in THROTTLE_ERRORS:
+                    self._record(requests=1, throttles=1)
+                    continue
+                print(f"Error writing {len(requests)} findings: {str(e)}")
+                self._record(requests=1, failed=len(requests))
+                return
+            except (BotocoreConnectionError, HTTPClientError) as e:
+                # Dropped connections and timeouts the client's retry budget no longer covers
+                print(f"Connection error writing {len(requests)} findings: {str(e)}")
+                self._record(requests=1, throttles=1)
+                continue
+
+            wcu = sum(c.get('CapacityUnits', 0) for c in response.get('ConsumedCapacity', []))
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            self._record(
+                requests=1,
+                written=len(requests) - len(unprocessed),
+                wcu=wcu,
+                throttles=1 if unprocessed else 0
+            )
+            requests = unprocessed
+
+    def _backoff(self, attempt):
+        # Full jitter: sleep a random time up to the capped exponential delay
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+
+    def _record(self, requests=0, written=0, failed=0, wcu=0.0, throttles=0):
+        with self._lock:
+            self.requests += requests
+            self.items_written += written
+            self.items_failed += failed
+            self.consumed_wcu += wcu
+            self.throttles += throttles
@@ -0,0 +1,196 @@
+"""
+Per-resource scan state for incremental scanning.
+
+Each resource keeps a compact record in the state table: a fingerprint of
+its configuration, a digest of its last written finding and when it was
+last fully analyzed. Analyzers use it to skip metric and config calls for
+resources that have not changed, and to skip writing findings that are
+identical to the previous run.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from cost_optimizer.sink import FindingSink
+
+DEFAULT_STATE_TABLE = os.environ.get('STATE_TABLE', 'CostOptimizerScanState')
+
+# Fully re-analyze unchanged resources at least this often so metrics stay current
+DEFAULT_MAX_AGE_DAYS = int(os.environ.get('INCREMENTAL_MAX_AGE_DAYS', '7'))
+
+# BatchGetItem accepts at most 100 keys per call
+MAX_KEYS_PER_GET = 100
+
+
+def is_incremental(event):
+    """Check event['incremental'] or INCREMENTAL_SCAN for incremental mode."""
+    value = event.get('incremental', os.environ.get('INCREMENTAL_SCAN', 'false'))
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def fingerprint(values):
+    """Short, stable digest of a JSON-serializable structure."""
+    encoded = json.dumps(values, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+# Fields that change every run without the resource changing
+VOLATILE_FIELDS = ('timestamp',)
+VOLATILE_METADATA = ('age_days',)
+
+
+def finding_digest(finding):
+    """Digest of a finding's content, ignoring when it was produced and how old the resource is."""
+    content = {key: value for key, value in finding.items() if key not in VOLATILE_FIELDS}
+    if isinstance(content.get('metadata'), dict):
+        content['metadata'] = {
+            key: value for key, value in content['metadata'].items() if key not in VOLATILE_METADATA
+        }
+    return fingerprint(content)
+
+
+class ScanState:
+    """
+    Load and update state records batch by batch. Records of a batch are
+    kept until its resources are recorded or found unchanged, so pipeline
+    stages can load the next batch while an earlier one is being written.
+
+    Usage:
+        state = ScanState(dynamodb)
+        batch = state.changed(batch, resource_key, resource_config)
+        ...analyze batch...
+        state.record_unreported(map(resource_key, batch), findings)
+        ...per finding:
+        if state.record(finding.state_key, item):
+            sink.write(item)
+        state.save()
+    """
+
+    def __init__(self, dynamodb, table_name=DEFAULT_STATE_TABLE, max_age_days=DEFAULT_MAX_AGE_DAYS, account_id=None):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.max_age_seconds = max_age_days * 86400
+        # Records of another account's resources are kept apart from the own account's
+        self._prefix = f'{account_id}#' if account_id else ''
+        self._records = {}
+        self._fingerprints = {}
+        self._updates = []
+        self._lock = threading.Lock()
+
+        self.skipped = 0
+        self.unchanged_findings = 0
+
+    def load(self, keys):
+        """Fetch the state records for a batch of keys."""
+        from boto3.dynamodb.types import TypeDeserializer
+        deserializer = TypeDeserializer()
+
+        keys = list(dict.fromkeys(keys))
+        for start in range(0, len(keys), MAX_KEYS_PER_GET):
+            request = {self.table_name: {
+                'Keys': [{'id': {'S': self._prefix + key}} for key in keys[start:start + MAX_KEYS_PER_GET]]
+            }}
+            while request:
+                try:
+                    response = self.dynamodb.batch_get_item(RequestItems=request)
+                except Exception as e:
+                    # Without state every resource is simply analyzed again
+                    print(f"Error loading scan state: {str(e)}")
+                    break
+                for item in response['Responses'].get(self.table_name, []):
+                    record = {key: deserializer.deserialize(value) for key, value in item.items()}
+                    with self._lock:
+                        self._records[record['id'][len(self._prefix):]] = record
+                request = response.get('UnprocessedKeys')
+
+    def changed(self, resources, key_func, config_func):
+        """
+        Load state for a batch of resources and return the ones that need a
+        full scan: new resources, changed configs and stale records.
+        """
+        fingerprints = {key_func(resource): fingerprint(config_func(resource)) for resource in resources}
+        with self._lock:
+            self._fingerprints.update(fingerprints)
+        self.load(fingerprints.keys())
+
+        changed = []
+        for resource in resources:
+            key = key_func(resource)
+            if self.is_unchanged(key, fingerprints[key]):
+                self._forget(key)
+            else:
+                changed.append(resource)
+        return changed
+
+    def is_unchanged(self, key, config_fingerprint):
+        """True when the config matches the last full scan and that scan is recent enough."""
+        record = self._records.get(key)
+        if record is None or record.get('config') != config_fingerprint:
+            return False
+        if time.time() - int(record.get('scanned_at', 0)) > self.max_age_seconds:
+            return False
+        with self._lock:
+            self.skipped += 1
+        return True
+
+    def record(self, key, finding):
+        """
+        Remember a full scan of a resource from the current batch. Returns True
+        when the finding differs from the last one written and should be stored.
+        """
+        digest = finding_digest(finding)
+        with self._lock:
+            previous = self._records.pop(key, {})
+            config = self._fingerprints.pop(key, None)
+            changed = previous.get('finding') != digest
+
+            self._updates.append({
+                'id': self._prefix + key,
+                'config': config,
+                'finding': digest,
+                'scanned_at': int(time.time())
+            })
+            if not changed:
+                self.unchanged_findings += 1
+        return changed
+
+    def record_unreported(self, keys, findings):
+        """
+        Remember a full scan of the resources of the current batch that have
+        none of its `findings` (none was built, or a skip rule dropped it):
+        their config fingerprint without a finding digest, so they are skipped
+        like the others until their config changes.
+        """
+        reported = {finding.state_key for finding in findings}
+        scanned_at = int(time.time())
+        with self._lock:
+            for key in keys:
+                if key in reported:
+                    continue
+                self._records.pop(key, None)
+                config = self._fingerprints.pop(key, None)
+                self._updates.append({'id': self._prefix + key, 'config': config, 'scanned_at': scanned_at})
+
+    def save(self):
+        """Write the records updated since the last save."""
+        with self._lock:
+            updates, self._updates = self._updates, []
+        if not updates:
+            return
+        with FindingSink(self.dynamodb, table_name=self.table_name, workers=2) as sink:
+            for update in updates:
+                sink.write(update)
+
+    def _forget(self, key):
+        with self._lock:
+            self._records.pop(key, None)
+            self._fingerprints.pop(key, None)
+
+    def stats(self):
+        """Counts of skipped resources and unwritten findings."""
+        return {
+            'skipped_unchanged_config': self.skipped,
+            'unchanged_findings_not_written': self.unchanged_findings
+        }
@@ -0,0 +1,259 @@
+"""
+Low-overhead instrumentation for the analyzers.
+
+botocore events on every ClientPool client feed per-operation latency
+histograms, attempt (retry) counts and error classes; pipeline stages and
+DynamoDB writes add busy time per phase (enumerate, metrics, build, write).
+Everything is emitted once per invocation as CloudWatch Embedded Metric
+Format log lines, so CloudWatch turns them into metrics without any API
+calls. Per-resource log lines go through debug(), which only prints a
+sample of them.
+
+Usage in a handler:
+    reset_metrics()
+    try:
+        ...
+    finally:
+        emit_metrics('ec2', findings_count)
+"""
+import bisect
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'CostOptimizer')
+
+# Upper bounds of the latency histogram buckets in milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+PHASES = ('enumerate', 'metrics', 'build', 'write')
+
+# Fraction of per-resource debug lines printed; LOG_LEVEL=DEBUG prints all of them
+DEBUG_SAMPLE_RATE = float(os.environ.get('DEBUG_LOG_SAMPLE_RATE', '0.01'))
+DEBUG = os.environ.get('LOG_LEVEL', '').upper() == 'DEBUG'
+
+
+class LatencyHistogram:
+    """Counts per fixed latency bucket plus min, max and sum, in milliseconds."""
+
+    def __init__(self, bounds=LATENCY_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, milliseconds):
+        self.counts[bisect.bisect_left(self.bounds, milliseconds)] += 1
+        self.count += 1
+        self.sum += milliseconds
+        self.min = milliseconds if self.min is None else min(self.min, milliseconds)
+        self.max = milliseconds if self.max is None else max(self.max, milliseconds)
+
+    def to_emf(self):
+        """EMF values/counts: each non-empty bucket at its upper bound (the overflow bucket at the max)."""
+        values, counts = [], []
+        for index, count in enumerate(self.counts):
+            if count:
+                values.append(self.bounds[index] if index < len(self.bounds) else round(self.max, 1))
+                counts.append(count)
+        return {'Values': values, 'Counts': counts}
+
+
+class OperationStats:
+    """Latency, attempts and errors of one API operation."""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.calls = 0
+        self.retries = 0
+        self.errors = Counter()
+
+
+class Telemetry:
+    """Per-invocation counters shared by every thread and client."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
+            self.phases = {}
+            self.started = time.perf_counter()
+
+    def record_call(self, operation, milliseconds, attempts, error=None):
+        with self._lock:
+            stats = self.operations.get(operation)
+            if stats is None:
+                stats = self.operations[operation] = OperationStats()
+            stats.latency.record(milliseconds)
+            stats.calls += 1
+            stats.retries += max(attempts - 1, 0)
+            if error:
+                stats.errors[error] += 1
+
+    def record_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def emf_documents(self, analyzer, findings_count=None):
+        """EMF log documents: one for the invocation and one per API operation."""
+        timestamp = int(time.time() * 1000)
+        with self._lock:
+            operations = dict(self.operations)
+            phases = dict(self.phases)
+            seconds = time.perf_counter() - self.started
+
+        invocation = {
+            'Analyzer': analyzer,
+            'InvocationSeconds': round(seconds, 3),
+            'ApiCalls': sum(stats.calls for stats in operations.values()),
+            'ApiRetries': sum(stats.retries for stats in operations.values()),
+            'ApiErrors': sum(sum(stats.errors.values()) for stats in operations.values())
+        }
+        metrics = [
+            {'Name': 'InvocationSeconds', 'Unit': 'Seconds'},
+            {'Name': 'ApiCalls', 'Unit': 'Count'},
+            {'Name': 'ApiRetries', 'Unit': 'Count'},
+            {'Name': 'ApiErrors', 'Unit': 'Count'}
+        ]
+        for phase in PHASES:
+            name = f'{phase.capitalize()}Seconds'
+            invocation[name] = round(phases.get(phase, 0.0), 3)
+            metrics.append({'Name': name, 'Unit': 'Seconds'})
+        if findings_count is not None:
+            invocation['FindingsCount'] = findings_count
+            metrics.append({'Name': 'FindingsCount', 'Unit': 'Count'})
+        documents = [_emf(invocation, [['Analyzer']], metrics, timestamp)]
+
+        for operation, stats in sorted(operations.items()):
+            document = {
+                'Analyzer': analyzer,
+                'Operation': operation,
+                'ApiLatency': stats.latency.to_emf(),
+                'ApiCalls': stats.calls,
+                'ApiRetries': stats.retries,
+                'ApiErrors': sum(stats.errors.values()),
+                # Not a metric; searchable with CloudWatch Logs Insights
+                'ErrorClasses': dict(stats.errors)
+            }
+            documents.append(_emf(document, [['Analyzer', 'Operation']], [
+                {'Name': 'ApiLatency', 'Unit': 'Milliseconds'},
+                {'Name': 'ApiCalls', 'Unit': 'Count'},
+                {'Name': 'ApiRetries', 'Unit': 'Count'},
+                {'Name': 'ApiErrors', 'Unit': 'Count'}
+            ], timestamp))
+        return documents
+
+
+def _emf(document, dimensions, metrics, timestamp):
+    document['_aws'] = {
+        'Timestamp': timestamp,
+        'CloudWatchMetrics': [{'Namespace': NAMESPACE, 'Dimensions': dimensions, 'Metrics': metrics}]
+    }
+    return document
+
+
+_telemetry = Telemetry()
+
+
+def reset_metrics():
+    """Start a new invocation's counters."""
+    _telemetry.reset()
+
+
+def emit_metrics(analyzer, findings_count=None):
+    """Print this invocation's metrics as EMF log lines."""
+    for document in _telemetry.emf_documents(analyzer, findings_count):
+        print(json.dumps(document, separators=(',', ':')))
+
+
+def record_phase(name, seconds):
+    _telemetry.record_phase(name, seconds)
+
+
+def timed(name, func):
+    """Wrap func so its run time counts toward phase `name`."""
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _telemetry.record_phase(name, time.perf_counter() - started)
+    return wrapper
+
+
+def timed_iter(name, iterable):
+    """Yield from iterable, counting the time spent producing items toward phase `name`."""
+    iterator = iter(iterable)
+    while True:
+        started = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _telemetry.record_phase(name, time.perf_counter() - started)
+        yield item
+
+
+def debug(message):
+    """Per-resource log line, printed for a DEBUG_SAMPLE_RATE sample of calls (all of them at LOG_LEVEL=DEBUG)."""
+    if DEBUG or random.random() < DEBUG_SAMPLE_RATE:
+        print(message)
+
+
+def attach(client):
+    """Record latency, attempts and errors of every call a client makes."""
+    service_id = client.meta.service_model.service_id.hyphenize()
+    client.meta.events.register(f'before-call.{service_id}', _before_call)
+    client.meta.events.register(f'request-created.{service_id}', _request_created)
+    client.meta.events.register(f'after-call.{service_id}', _after_call)
+    client.meta.events.register(f'after-call-error.{service_id}', _after_call_error)
+    return client
+
+
+def _before_call(context, **kwargs):
+    context['telemetry_attempts'] = 0
+
+
+def _request_created(request, **kwargs):
+    # Emitted for every attempt, retries included. The rate limiter's handler
+    # runs first, so latency starts after the first attempt was let through.
+    context = getattr(request, 'context', None)
+    if context is None or 'telemetry_attempts' not in context:
+        return
+    if not context['telemetry_attempts']:
+        context['telemetry_started'] = time.perf_counter()
+    context['telemetry_attempts'] += 1
+
+
+def _after_call(http_response, parsed, context, event_name, **kwargs):
+    error = None
+    if http_response.status_code >= 300:
+        error = parsed.get('Error', {}).get('Code') or f'HTTP{http_response.status_code}'
+    _finish(event_name, context, error)
+
+
+def _after_call_error(exception, context, event_name, **kwargs):
+    _finish(event_name, context, type(exception).__name__)
+
+
+def _finish(event_name, context, error):
+    started = context.get('telemetry_started')
+    if started is None:
+        return
+    # 'after-call.<service>.<Operation>'
+    _, service, operation = event_name.split('.', 2)
+    _telemetry.record_call(
+        f'{service}.{operation}',
+        (time.perf_counter() - started) * 1000,
+        context.get('telemetry_attempts', 1),
+        error
+    )
@@ -0,0 +1,53 @@
+import importlib.util
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'layers', 'shared'))
+
+# moto intercepts every call, these only keep botocore from looking for real credentials
+os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+os.environ['AWS_ACCESS_KEY_ID'] = 'testing'
+os.environ['AWS_SECRET_ACCESS_KEY'] = 'testing'
+
+
+@pytest.fixture
+def aws():
+    """moto AWS with the findings and scan state tables; yields a DynamoDB client."""
+    from cost_optimizer import inventory
+
+    with mock_aws():
+        dynamodb = boto3.client('dynamodb')
+        dynamodb.create_table(
+            TableName='CostOptimizerFindings',
+            KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}, {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}],
+            AttributeDefinitions=[
+                {'AttributeName': 'id', 'AttributeType': 'S'}, {'AttributeName': 'timestamp', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        dynamodb.create_table(
+            TableName='CostOptimizerScanState',
+            KeySchema=[{'AttributeName': 'id', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'id', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        # Inventory snapshots of another test's mocked account would be reused for the age limit
+        inventory._snapshots.clear()
+        yield dynamodb
+
+
+@pytest.fixture
+def load_analyzer():
+    """Import an analyzer's lambda_function module by its directory name, e.g. 'ebs_analyzer'."""
+    def load(name):
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, 'lambdas', name, 'lambda_function.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    return load
+
@@ -0,0 +1,76 @@
+import json
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+
+from cost_optimizer import accounts
+from cost_optimizer.accounts import parse_account, resolve_accounts, scope
+
+OWN, MEMBER, DENIED = '123456789012', '111111111111', '222222222222'
+
+
+def test_accounts_must_use_the_scan_role():
+    role_arn = f'arn:aws:iam::{MEMBER}:role/CostOptimizerScanRole'
+    assert parse_account(MEMBER) == {'account_id': MEMBER, 'role_arn': role_arn}
+    assert parse_account(role_arn)['account_id'] == MEMBER
+    assert parse_account({'account_id': MEMBER, 'external_id': 'x'})['external_id'] == 'x'
+
+    for value in (f'arn:aws:iam::{MEMBER}:role/Admin', f'arn:aws:iam::{MEMBER}:user/scanner',
+                  f'arn:aws:s3:::{MEMBER}', '1111', 'not-an-account'):
+        with pytest.raises(ValueError):
+            parse_account(value)
+
+    listed = [account['account_id'] for account in resolve_accounts({'accounts': f'{MEMBER}, {role_arn}'})]
+    assert listed == [MEMBER, MEMBER]
+    assert resolve_accounts({'accounts': json.dumps([{'account_id': DENIED}])})[0]['account_id'] == DENIED
+    assert resolve_accounts({'shard': {'region': 'us-east-1'}}) == []
+    assert scope('us-east-1', parse_account(MEMBER)) == f'{MEMBER}/us-east-1' and scope('us-east-1') == 'us-east-1'
+
+
+def member_session(account):
+    credentials = boto3.client('sts').assume_role(
+        RoleArn=f'arn:aws:iam::{account}:role/CostOptimizerScanRole', RoleSessionName='setup'
+    )['Credentials']
+    return boto3.session.Session(
+        aws_access_key_id=credentials['AccessKeyId'], aws_secret_access_key=credentials['SecretAccessKey'],
+        aws_session_token=credentials['SessionToken'], region_name='us-east-1'
+    )
+
+
+def test_an_account_that_cannot_be_assumed_does_not_stop_the_others(aws, load_analyzer, monkeypatch):
+    monkeypatch.setattr(accounts, '_pools', {})
+    member_ec2 = member_session(MEMBER).client('ec2')
+    member_ids = {member_ec2.create_volume(AvailabilityZone='us-east-1a', Size=10)['VolumeId'] for _ in range(3)}
+    own_id = boto3.client('ec2').create_volume(AvailabilityZone='us-east-1a', Size=10)['VolumeId']
+
+    assume_role = accounts.assumed_role_session
+
+    def assumed_role_session(sts, role_arn, *args, **kwargs):
+        if f'::{DENIED}:' in role_arn:
+            raise ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'not authorized'}}, 'AssumeRole')
+        return assume_role(sts, role_arn, *args, **kwargs)
+
+    monkeypatch.setattr(accounts, 'assumed_role_session', assumed_role_session)
+    ebs = load_analyzer('ebs_analyzer')
+
+    response = ebs.lambda_handler({'accounts': [MEMBER, DENIED], 'regions': ['us-east-1'], 'incremental': True}, None)
+
+    assert response['statusCode'] == 200
+    body = json.loads(response['body'])
+    report = body['accounts']
+    assert report[MEMBER]['us-east-1']['findings_count'] == 3 and 'error' not in report[MEMBER]['us-east-1']
+    assert 'AccessDenied' in report[DENIED]['us-east-1']['error']
+
+    # Only the member's volumes, each tagged with its account
+    findings = {finding['resource_id']: finding for finding in body['findings']}
+    assert set(findings) == member_ids and own_id not in findings
+    assert {finding['account_id'] for finding in findings.values()} == {MEMBER}
+
+    # Its state records are kept apart from the own account's
+    state_ids = {
+        item['id']['S'] for item in aws.scan(TableName='CostOptimizerScanState')['Items']
+        if not item['id']['S'].startswith('CHECKPOINT#')
+    }
+    assert state_ids == {f'{MEMBER}#EBS#{volume_id}' for volume_id in member_ids}
+    assert OWN not in {key.split('#')[0] for key in state_ids}
@@ -0,0 +1,39 @@
+import json
+
+import boto3
+
+from cost_optimizer.checkpoint import TimeBudget, run_locally
+
+
+def test_resumed_scan_analyzes_every_resource_once(aws, load_analyzer, monkeypatch):
+    client = boto3.client('rds')
+    # describe_db_instances pages of 100, so batches of 40 straddle the page boundary
+    for index in range(130):
+        client.create_db_instance(
+            DBInstanceIdentifier=f'db-{index:03d}', DBInstanceClass='db.t3.micro', Engine='postgres',
+            AllocatedStorage=100, MasterUsername='admin', MasterUserPassword='password123'
+        )
+    rds = load_analyzer('rds_analyzer')
+    monkeypatch.setattr(rds, 'BATCH_SIZE', 40)
+
+    # Every invocation's time budget runs out after its first batch
+    def expired(self):
+        self.checks = getattr(self, 'checks', 0) + 1
+        return self.checks > 1
+
+    with monkeypatch.context() as patch:
+        patch.setattr(TimeBudget, 'expired', expired)
+        bodies = run_locally(rds.lambda_handler, {}, budget_seconds=60)
+
+    assert [body['checkpoint']['status'] for body in bodies] == ['interrupted'] * 3 + ['complete']
+    assert [body['checkpoint']['invocation'] for body in bodies] == [1, 2, 3, 4]
+    # The totals carried over every checkpoint
+    assert bodies[-1]['findings_count'] == 130
+    assert bodies[-1]['aggregates']['resource_type'] == {'RDS': 130}
+
+    # Each invocation timestamps its findings, so a repeated resource would have two items
+    items = aws.scan(TableName='CostOptimizerFindings')['Items']
+    assert sorted(item['id']['S'] for item in items) == [f'db-{index:03d}' for index in range(130)]
+
+    uninterrupted = json.loads(rds.lambda_handler({}, None)['body'])
+    assert uninterrupted['aggregates'] == bodies[-1]['aggregates']
@@ -0,0 +1,86 @@
+import json
+import math
+import random
+import threading
+
+import boto3
+
+from cost_optimizer import fanout
+from cost_optimizer.checkpoint import ScanCheckpoint
+from cost_optimizer.fanout import MAX_SHARD_RESOURCES, plan_shards
+
+
+def test_plans_balanced_shards_within_the_id_limits():
+    rng = random.Random(7)
+    resources = {
+        'us-east-1': [(f'i-{index:05d}', rng.choice([1, 3, 4, 10])) for index in range(5000)],
+        'eu-west-1': [(f'i-eu-{index:03d}', 1) for index in range(450)],
+        'ap-south-1': []
+    }
+    shards = plan_shards(resources, shard_weight=600)
+
+    planned = sorted(resource_id for shard in shards for resource_id in shard['ids'])
+    assert planned == sorted(resource_id for items in resources.values() for resource_id, _ in items)
+    assert all(len(shard['ids']) <= MAX_SHARD_RESOURCES for shard in shards)
+    # Split by weight, each shard within one resource's weight of the others
+    weights = [shard['weight'] for shard in shards if shard['region'] == 'us-east-1']
+    assert len(weights) == math.ceil(sum(weight for _, weight in resources['us-east-1']) / 600)
+    assert max(weights) - min(weights) <= 10
+    # Light resources are split by the id limit instead
+    assert [len(shard['ids']) for shard in shards if shard['region'] == 'eu-west-1'] == [150, 150, 150]
+    # The RDS analyzer's limit
+    assert max(len(shard['ids']) for shard in plan_shards(resources, 600, max_resources=100)) == 100
+
+
+def test_coordinator_merges_shards_after_a_failure_and_continuations(aws, load_analyzer, monkeypatch):
+    ec2 = boto3.client('ec2')
+    for index in range(30):
+        ec2.create_volume(Size=10 + index, AvailabilityZone='us-east-1a')
+    ebs = load_analyzer('ebs_analyzer')
+    monkeypatch.setattr(fanout, 'POLL_SECONDS', 0.01)
+    # Two volumes per batch, and every worker invocation stops after its first batch
+    monkeypatch.setattr(ebs, 'BATCH_SIZE', 2)
+
+    def should_stop(self):
+        self.batches = getattr(self, 'batches', 0) + 1
+        self.interrupted = self.batches > 1
+        return self.interrupted
+
+    monkeypatch.setattr(ScanCheckpoint, 'should_stop', should_stop)
+    # The first worker to start fails
+    shared_index = ebs.shared_index
+    lock = threading.Lock()
+    failures = []
+
+    def flaky_index(clients):
+        with lock:
+            if not failures:
+                failures.append(1)
+                raise RuntimeError('injected')
+        return shared_index(clients)
+
+    monkeypatch.setattr(ebs, 'shared_index', flaky_index)
+
+    body = json.loads(ebs.lambda_handler({'fan_out': True, 'shard_weight': 6}, None)['body'])
+
+    assert body['findings_count'] == 30
+    assert body['aggregates']['resource_type'] == {'EBS': 30}
+    assert body['shards']['count'] == 5
+    assert body['shards']['failed'] == []
+    reports = body['shard_report']
+    assert sorted(report['resources'] for report in reports.values()) == [6] * 5
+    assert sorted(report['retries'] for report in reports.values()) == [0, 0, 0, 0, 1]
+    # Three batches per shard: two continuations from the worker's checkpoint
+    assert all(report['continuations'] == 2 for report in reports.values())
+
+    # Reruns and continuations wrote every volume once, with the fan-out's timestamp
+    items = aws.scan(TableName='CostOptimizerFindings')['Items']
+    assert len(items) == 30
+    assert len({item['id']['S'] for item in items}) == 30
+    assert len({item['timestamp']['S'] for item in items}) == 1
+
+    # The merged totals are those of one unsharded scan
+    monkeypatch.undo()
+    plain = json.loads(ebs.lambda_handler({}, None)['body'])
+    assert plain['findings_count'] == body['findings_count']
+    assert plain['aggregates'] == body['aggregates']
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from botocore.stub import ANY, Stubber
+from moto import mock_aws
+
+from cost_optimizer.metrics import MAX_QUERIES_PER_REQUEST, MetricQueryEngine
+
+INSTANCES = 1000
+
+# The EC2 analyzer used to make one GetMetricStatistics call per instance and metric
+EC2_METRICS = [('CPUUtilization', 'Average'), ('NetworkIn', 'Sum'), ('NetworkOut', 'Sum')]
+
+
+def queue_instances(engine, instance_ids):
+    for instance_id in instance_ids:
+        for metric_name, stat in EC2_METRICS:
+            engine.add(instance_id, 'AWS/EC2', metric_name, [{'Name': 'InstanceId', 'Value': instance_id}], stat)
+
+
+def test_batches_queries_into_get_metric_data_calls():
+    with mock_aws():
+        cloudwatch = boto3.client('cloudwatch', region_name='us-east-1')
+        timestamp = datetime.now(timezone.utc) - timedelta(hours=2)
+        cloudwatch.put_metric_data(Namespace='AWS/EC2', MetricData=[{
+            'MetricName': 'CPUUtilization',
+            'Dimensions': [{'Name': 'InstanceId', 'Value': 'i-00007'}],
+            'Timestamp': timestamp,
+            'Value': value
+        } for value in (10.0, 30.0)])
+
+        engine = MetricQueryEngine(cloudwatch, days=7)
+        instance_ids = [f'i-{index:05d}' for index in range(INSTANCES)]
+        queue_instances(engine, instance_ids)
+        engine.resolve()
+
+    per_resource_calls = INSTANCES * len(EC2_METRICS)
+    assert engine.api_calls == per_resource_calls // MAX_QUERIES_PER_REQUEST
+    assert per_resource_calls / engine.api_calls >= 100
+    assert engine.failed_queries == 0
+
+    assert engine.average('i-00007', 'CPUUtilization') == 20.0
+    assert engine.average('i-00008', 'CPUUtilization') == 0.0
+    assert not engine.failed('i-00008')
+
+
+def test_follows_next_token_and_maps_results_to_resources():
+    cloudwatch = boto3.client('cloudwatch', region_name='us-east-1')
+    now = datetime.now(timezone.utc)
+    engine = MetricQueryEngine(cloudwatch)
+    queue_instances(engine, ['i-a', 'i-b'])
+
+    with Stubber(cloudwatch) as stubber:
+        stubber.add_response('get_metric_data', {
+            'MetricDataResults': [
+                {'Id': 'q0', 'Timestamps': [now], 'Values': [5.0], 'StatusCode': 'PartialData'},
+                {'Id': 'q3', 'Timestamps': [now], 'Values': [7.0], 'StatusCode': 'Complete'}
+            ],
+            'NextToken': 'page-2'
+        }, {'MetricDataQueries': ANY, 'StartTime': ANY, 'EndTime': ANY, 'ScanBy': 'TimestampDescending'})
+        stubber.add_response('get_metric_data', {
+            'MetricDataResults': [
+                {'Id': 'q0', 'Timestamps': [now - timedelta(days=1)], 'Values': [1.0], 'StatusCode': 'Complete'},
+                {'Id': 'q4', 'Timestamps': [now], 'Values': [2048.0], 'StatusCode': 'Complete'}
+            ]
+        }, {'MetricDataQueries': ANY, 'StartTime': ANY, 'EndTime': ANY, 'ScanBy': 'TimestampDescending',
+            'NextToken': 'page-2'})
+
+        engine.resolve()
+        stubber.assert_no_pending_responses()
+
+    assert engine.api_calls == 2
+    assert engine.values('i-a', 'CPUUtilization') == [5.0, 1.0]
+    assert engine.latest('i-a', 'CPUUtilization') == 5.0
+    assert engine.average('i-b', 'CPUUtilization') == 7.0
+    assert engine.sum('i-b', 'NetworkIn') == 2048.0
+    assert engine.sum('i-b', 'NetworkOut') == 0.0
+
+
+def test_failed_queries_are_unknown_rather_than_zero():
+    cloudwatch = boto3.client('cloudwatch', region_name='us-east-1')
+    engine = MetricQueryEngine(cloudwatch)
+    queue_instances(engine, ['i-a'])
+    engine.add('i-b', 'AWS/EC2', 'CPUUtilization', [{'Name': 'InstanceId', 'Value': 'i-b'}], 'Average')
+
+    with Stubber(cloudwatch) as stubber:
+        stubber.add_client_error('get_metric_data', service_error_code='Throttling', http_status_code=400)
+        engine.resolve()
+
+    assert engine.api_calls == 0
+    assert engine.failed_queries == 4
+    assert engine.failed('i-a') and engine.failed('i-b')
+    assert engine.average('i-a', 'CPUUtilization') == 0.0
@@ -0,0 +1,129 @@
+from types import SimpleNamespace
+
+import pytest
+
+from cost_optimizer import ratelimit
+from cost_optimizer.ratelimit import MAX_ATTEMPTS, AdaptiveRateLimiter, RetryBudget, ServiceThrottle
+
+
+class Clock:
+    """Stands in for the time module, so the limiter's cooldown can be stepped through."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        # A real sleep never returns in less than a microsecond
+        self.now += max(seconds, 1e-6)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+def response(status, code=None):
+    """A (http response, parsed body) pair as botocore passes to needs-retry handlers."""
+    return SimpleNamespace(status_code=status), {'Error': {'Code': code}} if code else {}
+
+
+def test_throttling_halves_the_rate_at_most_once_per_second(clock):
+    throttle = ServiceThrottle('ec2')
+    assert throttle.limiter.rate == 20.0
+
+    for _ in range(5):
+        assert throttle.needs_retry(response(400, 'RequestLimitExceeded'), attempts=1) is not None
+    assert throttle.limiter.rate == 10.0
+
+    clock.now += 0.5
+    throttle.needs_retry(response(429), attempts=1)
+    assert throttle.limiter.rate == 10.0
+    clock.now += 0.5
+    throttle.needs_retry(response(429), attempts=1)
+    assert throttle.limiter.rate == 5.0
+    assert throttle.counters['throttles'] == 7
+
+    # Successes win the rate back additively: +1/s after `rate` of them
+    for _ in range(5):
+        throttle.needs_retry(response(200), attempts=1)
+    assert 5.9 < throttle.limiter.rate < 6.0
+
+
+def test_rate_stays_within_its_bounds(clock):
+    limiter = AdaptiveRateLimiter(rate=1.0, max_rate=2.0)
+    for _ in range(10):
+        limiter.on_throttle()
+        clock.now += 1
+    assert limiter.rate == ratelimit.MIN_RATE
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.rate == 2.0
+
+
+def test_limiter_paces_requests_to_its_rate(clock):
+    limiter = AdaptiveRateLimiter(rate=10.0)
+    started = clock.now
+    for _ in range(21):
+        limiter.acquire()
+    # One token to start with, then one every 100 ms
+    assert clock.now - started == pytest.approx(2.0, abs=1e-4)
+
+
+def test_retry_budget_is_a_fifth_of_successes_up_to_100():
+    budget = RetryBudget()
+    assert sum(budget.withdraw() for _ in range(20)) == 10
+
+    for _ in range(5):
+        budget.deposit()
+    assert [budget.withdraw() for _ in range(2)] == [True, False]
+
+    for _ in range(1000):
+        budget.deposit()
+    assert sum(budget.withdraw() for _ in range(200)) == 100
+
+
+def test_spent_budget_stops_retries(clock):
+    throttle = ServiceThrottle('rds')
+    delays = [throttle.needs_retry(response(503), attempts=1) for _ in range(12)]
+
+    assert all(delay is not None for delay in delays[:10]) and delays[10:] == [None, None]
+    assert throttle.counters['retries'] == 10
+    assert throttle.counters['failed'] == throttle.counters['retry_budget_exhausted'] == 2
+
+    # Five successes pay for one more retry
+    for _ in range(5):
+        throttle.needs_retry(response(200), attempts=1)
+    assert throttle.needs_retry(response(503), attempts=1) is not None
+    assert throttle.needs_retry(response(503), attempts=1) is None
+
+
+def test_outcomes_are_classified(clock):
+    throttle = ServiceThrottle('s3')
+    rate = throttle.limiter.rate
+
+    # 5xx and connection errors are retried without slowing down
+    for status in (500, 502, 503, 504):
+        delay = throttle.needs_retry(response(status), attempts=2)
+        assert 0 <= delay <= ratelimit.BASE_DELAY * 4
+    assert throttle.needs_retry(None, attempts=1, caught_exception=ConnectionResetError()) is not None
+    assert throttle.limiter.rate == rate and throttle.counters['throttles'] == 0
+
+    # Throttling codes are retried and slow down
+    assert throttle.needs_retry(response(503, 'SlowDown'), attempts=1) is not None
+    assert throttle.limiter.rate == rate / 2 and throttle.counters['throttles'] == 1
+
+    # Refusals are answers: counted, neither retried nor slowing down
+    assert throttle.needs_retry(response(403, 'AccessDenied'), attempts=1) is None
+    assert throttle.needs_retry(response(404, 'NoSuchBucketPolicy'), attempts=1) is None
+    assert throttle.needs_retry(response(200), attempts=1) is None
+    assert throttle.counters['errors'] == 2 and throttle.counters['succeeded'] == 1
+
+    # The last attempt fails whatever the budget
+    assert throttle.needs_retry(response(500), attempts=MAX_ATTEMPTS) is None
+    assert throttle.counters['retries'] == 6 and throttle.counters['failed'] == 1
+    assert throttle.counters['calls'] == 4
@@ -0,0 +1,20 @@
+from cost_optimizer.rightsizing import FAMILY_SIZES, SIZE_FACTORS, recommend_types
+
+
+def test_recommends_only_sizes_of_the_family():
+    recommended = recommend_types(
+        ['m5zn.12xlarge', 'c5n.18xlarge', 'm5.4xlarge', 't3.large', 'm6g.large'], [30, 30, 10, 5, 5], [168] * 5
+    )
+    # m5zn skips from 6xlarge to 12xlarge, c5n from 4xlarge to 9xlarge
+    assert recommended == ['m5zn.6xlarge', 'c5n.9xlarge', 'm5.large', 't3.nano', 'm6g.medium']
+
+
+def test_unknown_families_sizes_and_thin_data_get_no_recommendation():
+    assert recommend_types(
+        ['x1.32xlarge', 'm5.metal', 'm5.4xlarge', 'm5.large'], [5, 5, 10, 5], [168, 168, 23, 168]
+    ) == [None, None, None, None]
+
+
+def test_family_sizes_are_known_and_ascending():
+    for sizes in FAMILY_SIZES.values():
+        assert list(sizes) == sorted(sizes, key=SIZE_FACTORS.__getitem__)
@@ -0,0 +1,104 @@
+import pytest
+
+from cost_optimizer.findings import Finding
+from cost_optimizer.rules import BUNDLED_RULES, RuleSet
+
+
+def finding(resource_id, resource_type, issue='x', **metadata):
+    return Finding(
+        resource_id=resource_id, resource_type=resource_type, issue=issue, severity='info', details='',
+        recommendation='analyzer default', metadata=metadata
+    )
+
+
+@pytest.fixture
+def bundled():
+    return RuleSet.load(BUNDLED_RULES)
+
+
+def test_first_matching_rule_wins(bundled):
+    ec2 = dict(datapoints=168, age_days=90, cpu_p99_percent=12.0, recommended_type='m5.large',
+               instance_type='m5.xlarge')
+    findings = [
+        # Idle and with a recommendation: metrics_incomplete, then idle come first
+        finding('i-failed', 'EC2', **ec2, metrics_failed=True, idle_hours_fraction=0.99, cpu_p95_percent=1.0),
+        finding('i-idle', 'EC2', **ec2, metrics_failed=False, idle_hours_fraction=0.99, cpu_p95_percent=1.0),
+        finding('i-busy', 'EC2', **ec2, metrics_failed=False, idle_hours_fraction=0.1, cpu_p95_percent=9.0),
+        # `is not None` over a None value does not match, so the analyzer's values stay
+        finding('i-right', 'EC2', **dict(ec2, recommended_type=None), metrics_failed=False,
+                idle_hours_fraction=0.1, cpu_p95_percent=9.0)
+    ]
+
+    assert bundled.matches(findings, 'EC2').tolist() == [0, 1, 3, -1]
+    assert bundled.apply(findings) == findings
+    assert [(f.severity, f.issue) for f in findings] == [
+        ('info', 'x'), ('high', 'idle_instance'), ('medium', 'oversized_instance'), ('info', 'x')
+    ]
+    assert findings[1].recommendation == 'Idle 99% of hours (CPU p95 1.0%) - stop or terminate'
+    assert findings[2].recommendation == 'Downsize from m5.xlarge to m5.large (CPU p99 12.0%)'
+    assert findings[3].recommendation == 'analyzer default'
+
+
+def test_skip_rules_drop_findings(bundled):
+    rds = dict(storage_gb=100, storage_type='gp3', idle=False, reclaimable_gb=0)
+    findings = [
+        finding('stopped', 'RDS', **rds, status='stopped', cluster_id=None),
+        finding('member', 'RDS', **rds, status='available', cluster_id='aurora-1'),
+        finding('tiny', 'RDS', **dict(rds, storage_gb=5), status='available', cluster_id=None),
+        finding('gp2', 'RDS', **dict(rds, storage_type='gp2'), status='available', cluster_id=None),
+        finding('cluster', 'RDS_CLUSTER', status='stopped', idle=True)
+    ]
+
+    kept = bundled.apply(findings)
+
+    assert [f.resource_id for f in kept] == ['gp2']
+    assert kept[0].recommendation == 'Move the 100GB of gp2 storage to gp3'
+
+
+def test_text_fields_compare_by_value(bundled):
+    ebs = dict(is_attached=True, metrics_failed=False, read_ops_7d=10, write_ops_7d=10, iops=3000, size_gb=100)
+    findings = [
+        finding('vol-stopped', 'EBS', 'attached_to_stopped_instance', **ebs, volume_type='gp3'),
+        finding('vol-io2', 'EBS', **ebs, volume_type='io2'),
+        finding('vol-gp2', 'EBS', **ebs, volume_type='gp2'),
+        finding('vol-gp3', 'EBS', **ebs, volume_type='gp3'),
+        finding('vol-none', 'EBS', **ebs, volume_type=None)
+    ]
+
+    assert bundled.matches(findings, 'EBS').tolist() == [1, 3, 4, -1, -1]
+    bundled.apply(findings)
+    assert findings[0].severity == 'medium' and findings[0].recommendation == 'analyzer default'
+    assert findings[1].recommendation == 'Uses under 10% of its 3000 provisioned IOPS - lower them or move to gp3'
+    assert findings[2].recommendation == 'Migrate the 100GB volume to gp3 - same baseline performance for less'
+
+
+def test_expressions_over_missing_and_mixed_values():
+    rules = RuleSet({'X': [
+        {'name': 'missing', 'when': 'size is None', 'issue': 'missing', 'recommendation': '{size} at {cost:.1f}'},
+        {'name': 'not_big', 'when': 'not size > 10 and label != "keep"', 'issue': 'small'},
+        {'name': 'mixed', 'when': 'size == "10"', 'issue': 'text'},
+        {'name': 'format', 'when': 'size > 10', 'issue': 'big', 'recommendation': '{label:.1f}'}
+    ]})
+    findings = [
+        finding('a', 'X', size=None, cost=None, label='keep'),
+        finding('b', 'X', size=5, label='drop'),
+        finding('c', 'X', size=5, label='keep'),
+        finding('d', 'X', size='10', label='keep'),
+        finding('e', 'X', size=50, label='keep')
+    ]
+
+    rules.apply(findings)
+
+    assert [f.issue for f in findings] == ['missing', 'small', 'x', 'text', 'big']
+    # Missing values format as n/a; a template that does not fit the value is kept as written
+    assert findings[0].recommendation == 'n/a at n/a'
+    assert findings[4].recommendation == '{label:.1f}'
+
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(ValueError):
+        RuleSet({'X': [{'when': '__import__("os")'}]})
+    with pytest.raises(ValueError):
+        RuleSet({'X': [{'when': 'size >'}]})
+    with pytest.raises(ValueError):
+        RuleSet({'X': [{'when': 'size > 1', 'severity': 'urgent'}]})
@@ -0,0 +1,188 @@
+from datetime import datetime
+from decimal import Decimal
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+from moto import mock_aws
+
+from cost_optimizer.findings import Finding, decode_item
+from cost_optimizer.sink import FindingSink
+
+TABLE_NAME = 'CostOptimizerFindings'
+
+
+@pytest.fixture
+def dynamodb():
+    with mock_aws():
+        client = boto3.client('dynamodb', region_name='us-east-1')
+        client.create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[
+                {'AttributeName': 'id', 'KeyType': 'HASH'},
+                {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
+            ],
+            AttributeDefinitions=[
+                {'AttributeName': 'id', 'AttributeType': 'S'},
+                {'AttributeName': 'timestamp', 'AttributeType': 'S'}
+            ],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        yield client
+
+
+class FlakyDynamoDB:
+    """Hands back part of each batch as UnprocessedItems, or throttles, before letting it through."""
+
+    def __init__(self, dynamodb, unprocessed=0, throttles=0, error=None, connection_errors=()):
+        self.dynamodb = dynamodb
+        self.unprocessed = unprocessed
+        self.throttles = throttles
+        self.error = error
+        self.connection_errors = list(connection_errors)
+        self.calls = 0
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self.calls += 1
+        if self.error:
+            raise ClientError({'Error': {'Code': self.error, 'Message': self.error}}, 'BatchWriteItem')
+        if self.connection_errors:
+            raise self.connection_errors.pop(0)
+        if self.throttles:
+            self.throttles -= 1
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'slow down'}},
+                              'BatchWriteItem')
+
+        (table_name, requests), = RequestItems.items()
+        held_back = requests[:self.unprocessed]
+        self.unprocessed = 0
+        response = self.dynamodb.batch_write_item(
+            RequestItems={table_name: requests[len(held_back):]}, **kwargs
+        ) if len(held_back) < len(requests) else {}
+        response['UnprocessedItems'] = {table_name: held_back} if held_back else {}
+        return response
+
+
+def findings(count):
+    return [Finding(
+        resource_id=f'vol-{index:05d}',
+        resource_type='EBS',
+        issue='unattached_volume',
+        severity='medium',
+        details='Volume is not attached',
+        recommendation='Snapshot and delete the volume',
+        metadata={'size_gb': 100, 'volume_type': 'gp2'},
+        monthly_cost=10.0
+    ) for index in range(count)]
+
+
+def scan_all(dynamodb):
+    return dynamodb.scan(TableName=TABLE_NAME)['Items']
+
+
+def test_writes_findings_in_batches_of_25(dynamodb):
+    with FindingSink(dynamodb, table_name=TABLE_NAME, workers=2) as sink:
+        for finding in findings(60):
+            sink.write(finding.to_item())
+
+    stats = sink.stats()
+    assert stats['items_written'] == 60
+    assert stats['items_failed'] == 0
+    assert stats['requests'] == 3
+    assert stats['throttles'] == 0
+    assert len(scan_all(dynamodb)) == 60
+
+
+def test_retries_unprocessed_items(dynamodb):
+    flaky = FlakyDynamoDB(dynamodb, unprocessed=10)
+    with FindingSink(flaky, table_name=TABLE_NAME, workers=1, base_delay=0) as sink:
+        for finding in findings(25):
+            sink.write(finding.to_item())
+
+    stats = sink.stats()
+    assert flaky.calls == 2
+    assert stats['items_written'] == 25
+    assert stats['throttles'] == 1
+    assert len(scan_all(dynamodb)) == 25
+
+
+def test_retries_throttled_requests(dynamodb):
+    flaky = FlakyDynamoDB(dynamodb, throttles=2)
+    with FindingSink(flaky, table_name=TABLE_NAME, workers=1, base_delay=0) as sink:
+        for finding in findings(5):
+            sink.write(finding.to_item())
+
+    stats = sink.stats()
+    assert stats['items_written'] == 5
+    assert stats['items_failed'] == 0
+    assert stats['throttles'] == 2
+    assert stats['requests'] == 3
+    assert len(scan_all(dynamodb)) == 5
+
+
+def test_gives_up_after_max_attempts(dynamodb):
+    flaky = FlakyDynamoDB(dynamodb, throttles=10)
+    with FindingSink(flaky, table_name=TABLE_NAME, workers=1, max_attempts=3, base_delay=0) as sink:
+        for finding in findings(5):
+            sink.write(finding.to_item())
+
+    assert flaky.calls == 3
+    assert sink.stats()['items_failed'] == 5
+    assert scan_all(dynamodb) == []
+
+
+def test_retries_connection_errors(dynamodb):
+    errors = [
+        EndpointConnectionError(endpoint_url='https://dynamodb.us-east-1.amazonaws.com'),
+        ReadTimeoutError(endpoint_url='https://dynamodb.us-east-1.amazonaws.com')
+    ]
+    flaky = FlakyDynamoDB(dynamodb, connection_errors=errors)
+    with FindingSink(flaky, table_name=TABLE_NAME, workers=1, base_delay=0) as sink:
+        for finding in findings(5):
+            sink.write(finding.to_item())
+
+    stats = sink.stats()
+    assert flaky.calls == 3
+    assert stats['items_written'] == 5 and stats['throttles'] == 2
+    assert len(scan_all(dynamodb)) == 5
+
+
+def test_connection_errors_fail_the_batch_after_max_attempts(dynamodb):
+    errors = [EndpointConnectionError(endpoint_url='https://dynamodb.us-east-1.amazonaws.com')] * 3
+    flaky = FlakyDynamoDB(dynamodb, connection_errors=errors)
+    # Counted as failed items rather than raised from flush()
+    with FindingSink(flaky, table_name=TABLE_NAME, workers=1, max_attempts=3, base_delay=0) as sink:
+        for finding in findings(5):
+            sink.write(finding.to_item())
+
+    assert flaky.calls == 3
+    assert sink.stats()['items_failed'] == 5
+
+
+def test_other_errors_fail_the_batch_without_retrying(dynamodb):
+    flaky = FlakyDynamoDB(dynamodb, error='ValidationException')
+    with FindingSink(flaky, table_name=TABLE_NAME, workers=1, base_delay=0) as sink:
+        for finding in findings(5):
+            sink.write(finding.to_item())
+
+    assert flaky.calls == 1
+    assert sink.stats()['items_failed'] == 5
+
+
+def test_writes_items_that_read_back_as_written(dynamodb):
+    finding = findings(1)[0]
+    with FindingSink(dynamodb, table_name=TABLE_NAME) as sink:
+        sink.write(finding.to_item())
+
+    item = decode_item(scan_all(dynamodb)[0])
+    assert item == finding.to_item()
+    assert item['estimated_monthly_cost'] == Decimal('10.0')
+
+
+def test_compact_items_read_back_with_exact_timestamps():
+    for finding in findings(3):
+        finding.metadata = {'cpu_avg_percent': 3.25, 'datapoints': 168, 'top_prefixes': [{'prefix': 'logs/'}] * 20}
+        # Naive UTC, the standard table's sort key format
+        assert datetime.fromisoformat(finding.timestamp).tzinfo is None
+        for compress in (True, False):
+            assert decode_item(finding.to_compact_item(compress)) == finding.to_item()
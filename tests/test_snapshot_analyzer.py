@@ -0,0 +1,105 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import boto3
+import pytest
+
+from cost_optimizer.inventory import InventorySnapshot, shared_snapshot
+
+
+@pytest.fixture
+def snapshot_analyzer(aws, load_analyzer):
+    return load_analyzer('snapshot_analyzer')
+
+
+@pytest.fixture
+def volume_lookups(snapshot_analyzer, monkeypatch):
+    """The volume ids of every describe_volumes lookup the analyzer makes."""
+    lookups = []
+    iter_volumes = snapshot_analyzer.iter_volumes
+
+    def recording_iter_volumes(ec2, volume_ids=None, **kwargs):
+        lookups.append(list(volume_ids))
+        return iter_volumes(ec2, volume_ids=volume_ids, **kwargs)
+
+    monkeypatch.setattr(snapshot_analyzer, 'iter_volumes', recording_iter_volumes)
+    return lookups
+
+
+def findings_by_id(snapshot_analyzer, event=None):
+    response = snapshot_analyzer.lambda_handler(event or {}, None)
+    assert response['statusCode'] == 200
+    return {finding['resource_id']: finding for finding in json.loads(response['body'])['findings']}
+
+
+def test_joins_snapshots_against_volumes_and_images(snapshot_analyzer, monkeypatch):
+    ec2 = boto3.client('ec2')
+    kept = ec2.create_volume(Size=10, AvailabilityZone='us-east-1a')['VolumeId']
+    kept_snapshots = [ec2.create_snapshot(VolumeId=kept)['SnapshotId'] for _ in range(3)]
+    deleted = ec2.create_volume(Size=20, AvailabilityZone='us-east-1a')['VolumeId']
+    orphan = ec2.create_snapshot(VolumeId=deleted)['SnapshotId']
+    ec2.delete_volume(VolumeId=deleted)
+    # The snapshot of an AMI is not orphaned by its volume being gone (moto gives the AMI a snapshot of its own)
+    image_id = ec2.register_image(
+        Name='image', RootDeviceName='/dev/sda1',
+        BlockDeviceMappings=[{'DeviceName': '/dev/sda1', 'Ebs': {'SnapshotId': orphan}}]
+    )['ImageId']
+    image, = ec2.describe_images(ImageIds=[image_id])['Images']
+    image_snapshot = image['BlockDeviceMappings'][0]['Ebs']['SnapshotId']
+    image_volume = ec2.describe_snapshots(SnapshotIds=[image_snapshot])['Snapshots'][0]['VolumeId']
+    assert image_volume not in {volume['VolumeId'] for volume in ec2.describe_volumes()['Volumes']}
+
+    findings = findings_by_id(snapshot_analyzer)
+
+    assert findings[orphan]['issue'] == 'orphaned_snapshot'
+    assert findings[orphan]['metadata']['volume_id'] == deleted
+    # Three snapshots of one volume on one day: two are duplicates
+    assert findings[kept]['issue'] == 'duplicate_snapshots'
+    assert findings[kept]['metadata']['duplicate_count'] == 2
+    assert image_snapshot not in findings and not set(kept_snapshots) & set(findings)
+
+    # Once old enough, the kept volume's snapshots are stale; the AMI's still is not reported
+    monkeypatch.setattr(snapshot_analyzer, 'STALE_DAYS', -1)
+    findings = findings_by_id(snapshot_analyzer)
+
+    assert {snapshot_id: findings[snapshot_id]['issue'] for snapshot_id in kept_snapshots} == dict.fromkeys(
+        kept_snapshots, 'stale_snapshot'
+    )
+    assert findings[orphan]['issue'] == 'orphaned_snapshot' and image_snapshot not in findings
+
+
+def test_confirms_volumes_newer_than_the_inventory(snapshot_analyzer, volume_lookups):
+    ec2 = boto3.client('ec2')
+    deleted = ec2.create_volume(Size=20, AvailabilityZone='us-east-1a')['VolumeId']
+    orphan = ec2.create_snapshot(VolumeId=deleted)['SnapshotId']
+    ec2.delete_volume(VolumeId=deleted)
+    inventory = shared_snapshot(snapshot_analyzer.shared_pool(), 'us-east-1')
+
+    # Created after the inventory, which warm invocations keep using
+    newer = ec2.create_volume(Size=5, AvailabilityZone='us-east-1a')['VolumeId']
+    fresh = ec2.create_snapshot(VolumeId=newer)['SnapshotId']
+    start_time = ec2.describe_snapshots(SnapshotIds=[fresh])['Snapshots'][0]['StartTime']
+    inventory.created_at = min(inventory.created_at, start_time.timestamp())
+    assert newer not in inventory.volume_by_id
+
+    findings = findings_by_id(snapshot_analyzer)
+
+    assert fresh not in findings
+    assert findings[orphan]['issue'] == 'orphaned_snapshot'
+    assert newer in sum(volume_lookups, [])
+
+
+def test_only_snapshots_after_the_inventory_are_looked_up(snapshot_analyzer, volume_lookups):
+    ec2 = boto3.client('ec2')
+    live = ec2.create_volume(Size=5, AvailabilityZone='us-east-1a')['VolumeId']
+    taken = datetime(2026, 10, 1, 12, tzinfo=timezone.utc)
+    inventory = InventorySnapshot('us-east-1', [], [], created_at=taken.timestamp())
+    snapshots = [
+        {'VolumeId': 'vol-before', 'StartTime': taken - timedelta(seconds=1)},
+        {'VolumeId': 'vol-ffffffff', 'StartTime': taken + timedelta(seconds=1)},
+        {'VolumeId': 'vol-gone', 'StartTime': taken + timedelta(seconds=1)},
+        {'VolumeId': live, 'StartTime': taken}
+    ]
+
+    assert snapshot_analyzer.volumes_since(ec2, snapshots, inventory) == {live}
+    assert volume_lookups == [sorted([live, 'vol-gone'])]
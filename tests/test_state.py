@@ -0,0 +1,56 @@
+import json
+
+import boto3
+
+from cost_optimizer.findings import Finding
+from cost_optimizer.resources import iter_db_instances
+from cost_optimizer.state import ScanState
+
+
+def state_records(dynamodb):
+    items = dynamodb.scan(TableName='CostOptimizerScanState')['Items']
+    return {item['id']['S']: item for item in items if not item['id']['S'].startswith('CHECKPOINT#')}
+
+
+def test_resources_without_findings_leave_no_cached_entries(aws):
+    state = ScanState(aws)
+    batch = state.changed([{'id': 'a'}, {'id': 'b'}], lambda resource: f"X#{resource['id']}", lambda resource: resource)
+    finding = Finding(
+        resource_id='a', resource_type='X', issue='x', severity='low', details='', recommendation=''
+    )
+
+    state.record_unreported((f"X#{resource['id']}" for resource in batch), [finding])
+    assert state.record(finding.state_key, finding.to_item())
+    state.save()
+
+    assert state._records == {} and state._fingerprints == {}
+    records = state_records(aws)
+    assert set(records) == {'X#a', 'X#b'}
+    assert 'finding' in records['X#a'] and 'finding' not in records['X#b']
+
+
+def test_resources_dropped_by_skip_rules_are_skipped_next_run(aws, load_analyzer):
+    client = boto3.client('rds')
+    for name, storage_gb in (('live-db', 100), ('stopped-db', 100), ('tiny-db', 5)):
+        client.create_db_instance(
+            DBInstanceIdentifier=name, DBInstanceClass='db.t3.micro', Engine='postgres',
+            AllocatedStorage=storage_gb, MasterUsername='admin', MasterUserPassword='password123'
+        )
+    client.stop_db_instance(DBInstanceIdentifier='stopped-db')
+    rds = load_analyzer('rds_analyzer')
+
+    body = json.loads(rds.lambda_handler({'incremental': True}, None)['body'])
+
+    # not_running and small_storage drop two of them, but all three were scanned
+    assert [finding['resource_id'] for finding in body['findings']] == ['live-db']
+    records = state_records(aws)
+    assert set(records) == {'RDS#live-db', 'RDS#stopped-db', 'RDS#tiny-db'}
+    assert [key for key, record in records.items() if 'finding' in record] == ['RDS#live-db']
+
+    # So none of them needs a full scan until its config changes
+    state = ScanState(aws)
+    assert state.changed(list(iter_db_instances(client)), rds.db_key, rds.db_config) == []
+    assert state.skipped == 3
+    client.start_db_instance(DBInstanceIdentifier='stopped-db')
+    changed = state.changed(list(iter_db_instances(client)), rds.db_key, rds.db_config)
+    assert [db_instance['DBInstanceIdentifier'] for db_instance in changed] == ['stopped-db']